@@ -0,0 +1,154 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+from collections import defaultdict, OrderedDict
+from threading import Lock
+from typing import Any, Hashable, Optional, Tuple
+
+
+class FrameCache(object):
+    """
+    Least-recently-used cache of numpy arrays whose total size is bounded by
+    a memory budget, in bytes. A single instance may be shared by several
+    datasources, in which case they share the budget as well.
+
+    Cached arrays are made read-only; copy them before modifying them.
+
+    Parameters
+    ------------
+    maxbytes : int
+        Memory budget. Once the cached arrays take up more than 'maxbytes'
+        bytes, the least recently used arrays are evicted. Arrays larger than
+        the budget are never cached.
+    """
+    def __init__(self, maxbytes: int):
+        self.maxbytes = maxbytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = OrderedDict()
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable):
+        return key in self._entries
+
+    def get(self, key: Hashable, default: Any = None) -> Optional[np.ndarray]:
+        with self._lock:
+            try:
+                value = self._entries[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            else:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return value
+
+    def put(self, key: Hashable, value: np.ndarray) -> np.ndarray:
+        """
+        Caches 'value' and returns it.
+        """
+        nbytes = value.nbytes
+        if nbytes > self.maxbytes:
+            return value
+
+        value.flags.writeable = False
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.nbytes -= old.nbytes
+            self._entries[key] = value
+            self.nbytes += nbytes
+            self._evict(self.maxbytes)
+        return value
+
+    def _evict(self, maxbytes: int):
+        while self.nbytes > maxbytes:
+            _, value = self._entries.popitem(last=False)
+            self.nbytes -= value.nbytes
+            self.evictions += 1
+
+    def resize(self, maxbytes: int):
+        """
+        Change the memory budget, evicting arrays if necessary.
+        """
+        with self._lock:
+            self.maxbytes = maxbytes
+            self._evict(maxbytes)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.nbytes = 0
+
+    @property
+    def stats(self):
+        return dict(hits=self.hits, misses=self.misses,
+                    evictions=self.evictions, nbytes=self.nbytes,
+                    maxbytes=self.maxbytes, entries=len(self._entries))
+
+
+class FrameBufferPool(object):
+    """
+    Reusable arrays, so that reading and displaying one frame after another
+    doesn't allocate new arrays for each frame. Arrays are pooled by shape
+    and dtype and are C-contiguous.
+
+    Parameters
+    ------------
+    maxbuffers : int
+        Maximum number of free arrays kept per shape and dtype.
+    """
+    def __init__(self, maxbuffers: int = 4):
+        self.maxbuffers = maxbuffers
+        self.allocations = 0
+        self._free = defaultdict(list)
+        self._lock = Lock()
+
+    @staticmethod
+    def _key(shape: Tuple[int, ...], dtype: np.dtype) -> Tuple:
+        return tuple(shape), np.dtype(dtype)
+
+    def acquire(self, shape: Tuple[int, ...], dtype: np.dtype) -> np.ndarray:
+        """
+        Returns an array of the given shape and dtype, whose contents are
+        undefined. Hand it back with 'release' once it's no longer used.
+        """
+        with self._lock:
+            free = self._free[self._key(shape, dtype)]
+            if free:
+                return free.pop()
+            self.allocations += 1
+        return np.empty(shape, dtype=dtype)
+
+    def release(self, array: np.ndarray):
+        with self._lock:
+            free = self._free[self._key(array.shape, array.dtype)]
+            if len(free) < self.maxbuffers:
+                free.append(array)
+
+    def clear(self):
+        with self._lock:
+            self._free.clear()
@@ -0,0 +1,173 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import zlib
+import h5py
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from itertools import product
+from typing import List, Optional, Tuple
+
+from .config import DECOMPRESSION_WORKERS
+
+# filters that ParallelChunkReader can undo itself
+SUPPORTED_FILTERS = (h5py.h5z.FILTER_DEFLATE, h5py.h5z.FILTER_SHUFFLE)
+
+
+def chunk_filters(dset: h5py.Dataset) -> List[int]:
+    """
+    Returns the IDs of the filters in a Dataset's pipeline, in the order in
+    which they're applied when writing.
+    """
+    plist = dset.id.get_create_plist()
+    return [plist.get_filter(i)[0] for i in range(plist.get_nfilters())]
+
+
+def supports_direct_chunks(dset: h5py.Dataset) -> bool:
+    """
+    Whether a Dataset's chunks can be read raw and decoded by
+    ParallelChunkReader, i.e. whether it's chunked, has a numeric dtype and
+    is only filtered by DEFLATE (gzip) and the byte shuffle.
+    """
+    if dset.chunks is None or dset.dtype.kind not in 'biuf':
+        return False
+    return all(f in SUPPORTED_FILTERS for f in chunk_filters(dset))
+
+
+def _unshuffle(buffer: bytes, itemsize: int) -> np.ndarray:
+    """
+    Undoes HDF5's shuffle filter, which stores the first byte of every
+    element, then the second byte of every element, etc.
+    """
+    data = np.frombuffer(buffer, dtype=np.uint8)
+    n = len(data) // itemsize
+    out = np.empty(len(data), dtype=np.uint8)
+    out[:n * itemsize].reshape(n, itemsize)[...] = \
+        data[:n * itemsize].reshape(itemsize, n).T
+    # bytes that don't make up a whole element aren't shuffled
+    out[n * itemsize:] = data[n * itemsize:]
+    return out
+
+
+class ParallelChunkReader(object):
+    """
+    Reads selections of chunked, compressed Datasets by fetching the raw
+    chunks with read_direct_chunk and decoding them on a pool of threads,
+    straight into the output array. zlib releases the GIL while it
+    decompresses, so chunks are decompressed in parallel.
+
+    Use supports_direct_chunks to check whether a Dataset can be read.
+
+    Parameters
+    ------------
+    max_workers : Optional[int]
+        Number of decompression threads. Defaults to DECOMPRESSION_WORKERS.
+    """
+    def __init__(self, max_workers: Optional[int] = None):
+        if max_workers is None:
+            max_workers = DECOMPRESSION_WORKERS
+        self.max_workers = max_workers
+        self._executor = ThreadPoolExecutor(max_workers=max_workers)
+
+    def shutdown(self):
+        self._executor.shutdown(wait=True)
+
+    def read(self, dset: h5py.Dataset, selection: Tuple[slice, ...],
+             out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Returns dset[selection], for a selection made of slices with a step
+        of 1. Like h5py, the returned array has the Dataset's dtype.
+
+        Parameters
+        ------------
+        dset : h5py.Dataset
+
+        selection : Tuple[slice, ...]
+            Missing trailing dimensions are selected entirely.
+
+        out : Optional[np.ndarray]
+            Preallocated C-contiguous array to read into, with the shape of
+            the selection and the Dataset's dtype.
+        """
+        selection = tuple(selection) + \
+            (slice(None), ) * (dset.ndim - len(selection))
+        bounds = []
+        for sl, length in zip(selection, dset.shape):
+            start, stop, step = sl.indices(length)
+            if not step == 1:
+                raise ValueError('Only slices with a step of 1 are supported.')
+            bounds.append((start, max(start, stop)))
+
+        shape = tuple(stop - start for start, stop in bounds)
+        dtype = dset.dtype
+        if out is None:
+            out = np.empty(shape, dtype=dtype)
+        elif not (out.shape == shape and out.dtype == dtype):
+            raise ValueError('out must have shape {} and dtype {}.'.format(
+                shape, dtype))
+        if not out.size:
+            return out
+
+        filters = chunk_filters(dset)
+        grid = [range(start // c, -(-stop // c))
+                for (start, stop), c in zip(bounds, dset.chunks)]
+        futures = [
+            self._executor.submit(
+                self._read_chunk, dset, filters, bounds, out,
+                tuple(i * c for i, c in zip(index, dset.chunks)))
+            for index in product(*grid)]
+        for future in futures:
+            # re-raises any exception from the worker
+            future.result()
+        return out
+
+    @staticmethod
+    def _read_chunk(dset: h5py.Dataset, filters: List[int],
+                    bounds: List[Tuple[int, int]], out: np.ndarray,
+                    offset: Tuple[int, ...]):
+        """
+        Reads and decodes the chunk at 'offset', and copies its intersection
+        with the selection into 'out'.
+        """
+        src = []
+        dest = []
+        for (start, stop), o, c in zip(bounds, offset, dset.chunks):
+            lo, hi = max(start, o), min(stop, o + c)
+            src.append(slice(lo - o, hi - o))
+            dest.append(slice(lo - start, hi - start))
+        src, dest = tuple(src), tuple(dest)
+
+        # h5py serializes these calls, but they only read from the file
+        if dset.id.get_chunk_info_by_coord(offset).byte_offset is None:
+            # the chunk was never written
+            out[dest] = dset.fillvalue
+            return
+        filter_mask, buffer = dset.id.read_direct_chunk(offset)
+
+        for i, f in reversed(list(enumerate(filters))):
+            if filter_mask & (1 << i):
+                # the filter was skipped when the chunk was written
+                continue
+            if f == h5py.h5z.FILTER_DEFLATE:
+                buffer = zlib.decompress(buffer)
+            elif f == h5py.h5z.FILTER_SHUFFLE:
+                buffer = _unshuffle(buffer, dset.dtype.itemsize)
+        chunk = np.frombuffer(buffer, dtype=dset.dtype).reshape(dset.chunks)
+        out[dest] = chunk[src]
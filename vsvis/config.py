@@ -63,6 +63,19 @@ class Dimension(IntFlag):
     Z = auto()
 
 
+class Normalization(IntFlag):
+    # each frame is rescaled to its own intensity range
+    FRAME = auto()
+    # all frames are rescaled to the range of the whole stack
+    STACK = auto()
+
+
+class Projection(IntFlag):
+    MAX = auto()
+    MEAN = auto()
+    STD = auto()
+
+
 class MarkerVisible(IntFlag):
     true = auto()
     false = auto()
@@ -72,6 +85,89 @@ class MarkerVisible(IntFlag):
 DEFAULT_MARKER_PARAMETERS = dict(shape=Shape.CIRCLE, size=3,
                                  color=Qt.white, filled=True)
 
+# memory budget, in bytes, of the frame cache shared by all datasources
+FRAME_CACHE_NBYTES = 512 * 2**20
+
+# maximum number of HDF5 files a multi-file datasource keeps open at once
+MAX_OPEN_FILES = 32
+
+# number of threads that decompress the chunks of a frame in parallel
+DECOMPRESSION_WORKERS = os.cpu_count() or 1
+
+# highest level of the image pyramid, at which frames are 2**level times
+# smaller along each axis, shown while zoomed out
+PYRAMID_MAX_LEVEL = 5
+
+# frames with at least this many pixels are read and drawn in tiles of
+# TILE_SIZE x TILE_SIZE pixels, only where they're visible, while the view
+# shows them at full resolution. At most TILE_CACHE_SIZE tiles are kept.
+# Tiles are loaded on TILE_WORKERS threads.
+TILED_THRESHOLD = 4096 * 4096
+TILE_SIZE = 512
+TILE_CACHE_SIZE = 256
+TILE_WORKERS = 2
+
+# percentiles of each frame's intensities that the statistics index stores,
+# and the number of bins of each frame's histogram
+STATS_PERCENTILES = (0.1, 1, 50, 99, 99.9)
+STATS_BINS = 256
+# frames are read in blocks of at most this many bytes while the index is
+# computed
+STATS_BLOCK_NBYTES = 64 * 2**20
+# percentiles of the intensities that are shown as black and white once the
+# index has been computed; (0, 100) is the minimum and maximum
+DISPLAY_PERCENTILES = (0, 100)
+
+# projections of the stack are computed from blocks of frames of about this
+# many bytes, reduced by this many threads
+PROJECTION_BLOCK_NBYTES = 64 * 2**20
+PROJECTION_WORKERS = os.cpu_count() or 1
+
+# colormap that frames are shown with; see display.COLORMAPS
+DEFAULT_COLORMAP = 'gray'
+
+# Dimensions of the navigation axes of image Datasets that don't label them,
+# in order; e.g. a Dataset of shape [T, Z, x, y]
+DIMENSION_ORDER = (Dimension.T, Dimension.Z, Dimension.C)
+
+# colormaps of the channels of composite images, in order
+CHANNEL_COLORMAPS = ('green', 'magenta', 'cyan', 'yellow')
+
+# average number of markers per cell of the grids that index the markers of
+# each frame, and the distance, in screen pixels, from a marker within which
+# a click picks it
+SPATIAL_INDEX_DENSITY = 4
+MARKER_PICK_TOLERANCE = 4
+
+# frame rate that movies are played at, in frames per second, the number
+# of frames read and converted ahead of the one being shown, and the threads
+# doing so
+PLAYBACK_FPS = 30
+PLAYBACK_QUEUE_SIZE = 8
+PLAYBACK_WORKERS = 2
+# seconds between reports of the achieved frame rate
+PLAYBACK_REPORT_INTERVAL = 0.5
+
+# number of frames loaded ahead of the current index while scrolling, at
+# least, and at most while scrolling fast: enough frames to keep ahead of
+# PREFETCH_LOOKAHEAD seconds of scrolling at the current rate
+PREFETCH_WINDOW = 8
+PREFETCH_MAX_WINDOW = 32
+PREFETCH_LOOKAHEAD = 0.5
+
+# whether the file inspection dialog reads an HDF5 file's structure as the
+# user browses it, rather than scanning the whole file when it's opened
+LAZY_FILE_INSPECTION = True
+
+# whether HDF5 files are read in SWMR mode, so that they can be followed
+# while another process writes to them. This works for any HDF5 file, and
+# every part of the application must agree on it to share open files.
+SWMR_READ = True
+
+# interval, in milliseconds, at which files are checked for appended data
+# while following them
+FOLLOW_INTERVAL = 1000
+
 EXTENSIONS = EnumDict([(DataType.HD5, ['.h5', '.hdf5', '.hf5', '.hd5']),
                        (DataType.TIFF_IMAGE, ['.tif', '.tiff', '.ome.tif'])])
 
@@ -94,3 +190,5 @@ DATATYPES = [DataType.GROUND_TRUTH, DataType.PREDICTED]
 ROOT_DIR = os.path.dirname(os.path.abspath(__file__))
 UI_DIR = os.path.join(ROOT_DIR, 'ui')
 TEST_DIR = os.path.join(ROOT_DIR, 'tests')
+# sidecar files, e.g. the scanned structure of HDF5 files
+CACHE_DIR = os.path.join(os.path.expanduser('~'), '.cache', 'vsvis')
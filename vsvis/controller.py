@@ -18,12 +18,15 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import numpy as np
 from qtpy import QtCore, QtWidgets
 
-from qtpy.QtCore import QObject, Qt, Property, Signal, Slot
+from qtpy.QtCore import QObject, QPointF, Qt, Property, Signal, Slot
+from qtpy.QtGui import QImage, QPixmap
 
 
-from typing import Any, Dict, Iterable, MutableSet, Optional, Sequence, Tuple
+from typing import (
+    Any, Dict, Iterable, List, MutableSet, Optional, Sequence, Tuple)
 from functools import partialmethod
 from collections import OrderedDict
 from vladutils.data_structures import EnumDict
@@ -33,7 +36,16 @@ from .models.table import HDF5TableModel
 from .models.scene import VGraphicsScene
 from .models.marker import MarkerFactory
 from .datasource import HDF5DataSource
-from .config import DataType, MarkerVisible, DATAPARAM, DATATYPES, NAMES
+from .prefetch import Prefetcher
+from .projection import ProjectionEngine
+from .pyramid import ImagePyramid
+from .stats import FrameStatistics
+from .cache import FrameBufferPool
+from .display import DisplayLUT
+from .config import (
+    DataType, Dimension, MarkerVisible, Normalization, CHANNEL_COLORMAPS,
+    DATAPARAM, DATATYPES, DISPLAY_PERCENTILES, NAMES, PREFETCH_WINDOW,
+    TILED_THRESHOLD)
 from .widgets import VTabWidget, VWarningMessageBox
 from .utils import gui_error
 
@@ -62,6 +74,7 @@ class Controller(QObject):
     """
     datasource_about_to_load = Signal(object)
     datasource_loaded = Signal(object)
+    datasource_refreshed = Signal(object)
     index_about_to_change = Signal()
     index_changed = Signal(int)
 
@@ -81,13 +94,40 @@ class Controller(QObject):
         self._markers_to_hide = dict()
         self._markers_to_show = dict()
         self.datasources = dict()
+        self.prefetcher = Prefetcher(self.datasources, PREFETCH_WINDOW)
+        # buffers for converting frames for display
+        self.buffers = FrameBufferPool()
+        # downsampled frames shown while the view is zoomed out
+        self.pyramid: Optional[ImagePyramid] = None
+        self.image_level = 0
+        # intensity statistics of the image datasource, once computed
+        self.statistics: Optional[FrameStatistics] = None
+        self.normalization = Normalization.FRAME
+        # gamma and colormap that frames are shown with
+        self.lut = DisplayLUT()
+        # projections of the image stack, and the one shown in place of the
+        # current frame, if any
+        self.projections: Optional[ProjectionEngine] = None
+        self.projection: Optional[np.ndarray] = None
+        # whether the channels of frames are blended into one image, the
+        # colormap and user-set limits of each channel, and the channels
+        # last read, as (index, planes)
+        self.composite = False
+        self.channel_luts: List[DisplayLUT] = []
+        self.channel_limits: Dict[int, Tuple[float, float]] = dict()
+        self._channels: Optional[Tuple[int, np.ndarray]] = None
 
         self.current_index = 0
         self._signals_setup()
 
     def cleanup(self):
+        self.prefetcher.shutdown()
+        self.scene.tiled_image.shutdown()
         for source in self.datasources.values():
             source.cleanup()
+        # results of workers that are still queued, e.g. statistics, must
+        # not find the closed datasources
+        self.datasources.clear()
 
     def _signals_setup(self):
         # signals from the coordinate tables to Markers in GraphicsView:
@@ -152,10 +192,8 @@ class Controller(QObject):
             self._add_top_level_group(dtype)
             print('added top level group: {}'.format(repr(dtype)))
         if not self.scene.has_markers(dtype, self.current_index):
-            key = self.scene.groups[dtype].add_subgroup(self.current_index)
             print('adding index: {}'.format(self.current_index))
-            print('key: {}'.format(key))
-            self._add_markers(dtype, key)
+            self._add_markers(dtype, self.current_index)
 
     def _reset_marker_group(self, dtype: DataType):
         """
@@ -179,11 +217,9 @@ class Controller(QObject):
         source = self.datasources[dtype]
         coordinates = source.request(index) + 1
         factory = self.groupbox.create_factory(dtype)
-        markers = [factory(x, y) for x, y in coordinates[:, :2]]
-        print('adding markers: {}'.format(markers))
-        group = self.scene.groups[dtype]
-        subgroup = group[index]
-        subgroup.replace_child_items(markers, vis=False)
+        # one item draws all the markers of the frame
+        layer = factory.layer(coordinates[:, :2])
+        self.scene.reset_markers(dtype, index, layer)
 
     def _delete_datasource(self, dtype: DataType):
         self.scene.delete_top_level_group(dtype)
@@ -192,10 +228,9 @@ class Controller(QObject):
         self._markers_to_show[dtype] = set()
 
     def _set_marker_property(self, setter_name, value, dtype):
-        for group in self.scene.groups[dtype]:
-            for marker in group:
-                setter = getattr(marker, setter_name)
-                setter(value)
+        for layer in self.scene.groups[dtype]:
+            setter = getattr(layer, setter_name)
+            setter(value)
 
     _set_marker_color = partialmethod(_set_marker_property, 'set_marker_color')
     _set_marker_fill = partialmethod(_set_marker_property, 'set_marker_fill')
@@ -226,13 +261,62 @@ class Controller(QObject):
                        name: Optional[str] = None, ind: Optional[int] = None):
         # TODO: add appropriate gui_error wrapper
         if dtype in self.datasources:
+            # cancelling doesn't stop reads that have started, which must
+            # finish before the file they read from is closed
+            self.prefetcher.cancel(wait_started=True)
+            if dtype & DataType.IMAGE:
+                self.scene.tiled_image.cancel(wait_started=True)
             old = self.datasources[dtype]
             old.cleanup()
 
         self.datasource_about_to_load.emit(dtype)
+        if dtype & DataType.IMAGE:
+            self.pyramid = ImagePyramid(
+                datasource, getattr(datasource, 'cache', None))
+            self.statistics = None
+            self.projections = ProjectionEngine(datasource)
+            self.projection = None
+            self._channels = None
         self.datasources[dtype] = datasource
         self.datasource_loaded.emit(dtype)
 
+    @Slot()
+    def refresh(self):
+        """
+        Shows data appended to the datasources' files since they were opened
+        or last refreshed. Markers and tables are only rebuilt for frames
+        whose coordinates changed.
+        """
+        for dtype, source in list(self.datasources.items()):
+            refresh = getattr(source, 'refresh', None)
+            if refresh is None:
+                continue
+            changed = refresh()
+            if not len(changed):
+                continue
+            if dtype & DataType.IMAGE:
+                self.scene.tiled_image.invalidate(changed)
+                # a projection that's shown is kept until it's recomputed
+                self.projections.clear()
+                self._channels = None
+                if self.current_index in changed:
+                    self._set_image(self.current_index)
+            elif dtype & DataType.DATA:
+                self._refresh_markers(dtype, changed)
+            self.datasource_refreshed.emit(dtype)
+
+    def _refresh_markers(self, dtype: DataType, changed: Sequence[int]):
+        if self.scene.has_markers(dtype):
+            group = self.scene.groups[dtype]
+            # stale Markers of other frames are re-created when they're shown
+            for index in changed:
+                if index in group and not index == self.current_index:
+                    group.delete_child_item(index)
+        if self.current_index in changed:
+            self._update_table_model(dtype)
+            if self.scene.has_markers(dtype, self.current_index):
+                self._add_markers(dtype, self.current_index)
+
     def has_data(self, dtype: DataType) -> bool:
         return any(self.datasources[dtype])
 
@@ -321,7 +405,7 @@ class Controller(QObject):
             self._visible_marker_dtypes ^= dtype
             markers = self.scene.get_markers(
                 dtype, self.current_index, MarkerVisible.true)
-            hidden = [m.key for m in markers]
+            hidden = list(markers)
             print('hidden: {}'.format(hidden))
             self.scene.set_markers_visible(dtype, index, False, hidden)
             self._markers_to_show[dtype].update(hidden)
@@ -333,25 +417,271 @@ class Controller(QObject):
             self._markers_to_hide[dtype].clear()
             self._markers_to_show[dtype].clear()
 
+    @Slot(QPointF, float)
+    def pick_marker(self, pos: QPointF, tolerance: float = 0
+                    ) -> Optional[Tuple[DataType, int]]:
+        """
+        Selects the table row of the marker of the current frame at 'pos',
+        a position in the scene, of the first DataType whose markers are
+        shown that has one there. Returns the DataType and row, if any.
+        """
+        for dtype in list(self.scene.groups):
+            if not dtype & self._visible_marker_dtypes or \
+                    dtype not in self.tabwidget.tables:
+                continue
+            row = self.scene.pick_marker(
+                dtype, self.current_index, pos, tolerance)
+            if row is not None:
+                self.tabwidget.select_row(dtype, row)
+                return dtype, row
+        return None
+
     @Slot(int)
     def set_index(self, index: int):
+        self._change_index(index, None)
+        self.prefetcher.update(index)
+
+    @Slot(int, object)
+    def show_frame(self, index: int, image: QImage):
+        """
+        Sets the current index like set_index, but shows 'image', e.g. from
+        render_frame, rather than reading the frame. Used for playback, in
+        which frames are read ahead by a PlaybackEngine.
+        """
+        self._change_index(index, image)
+
+    def _change_index(self, index: int, image: Optional[QImage]):
         self.index_about_to_change.emit()
         self.current_index = index
         self._set_table_models(index)
-        self._set_image(index)
+        if image is None or self.projection is not None:
+            self._set_image(index)
+        else:
+            self.scene.set_pixmap(QPixmap.fromImage(image), index)
         # add new markers if necessary
         datakeys = (k for k in self.datasources if k & DataType.DATA)
         for key in datakeys:
             self._reset_scene_markers(key)
         self.index_changed.emit(index)
 
+    def render_frame(self, index: int) -> QImage:
+        """
+        Reads the frame at 'index' and converts it to a QImage as _set_image
+        would show it, without touching the scene, so that it may be called
+        on worker threads. Frames that would be shown in tiles are converted
+        whole.
+        """
+        source = self.datasources[DataType.IMAGE]
+        if self.composite and getattr(source, 'channels', 1) > 1:
+            planes = source.request_channels(index)
+            channels = range(len(planes))
+            return self.scene.composite2image(
+                [plane.T for plane in planes],
+                self._channel_luts(len(planes)),
+                [self.channel_display_limits(index, c) for c in channels])
+        pyramid = self.pyramid
+        if self.image_level > 0 and pyramid is not None:
+            frame = pyramid.request(index, self.image_level)
+        else:
+            frame = source.request(index)
+        image = self.scene.array2image(
+            frame.squeeze().T, True, self.display_limits(index), self.lut)
+        if self.image_level > 0 and pyramid is not None and \
+                pyramid.full_shape is not None:
+            image.setDevicePixelRatio(
+                frame.shape[-2] / pyramid.full_shape[-2])
+        return image
+
     # @gui_error('Has image data been loaded?')
     def _set_image(self, index: int):
+        if self.projection is not None:
+            self._set_projection_image(index)
+            return
         source = self.datasources[DataType.IMAGE]
-        image = source.request(index).squeeze().T
-        pixmap = self.scene.array2pixmap(image, rescale=True)
+        if self.composite and getattr(source, 'channels', 1) > 1:
+            self._set_composite_image(index)
+            return
+        limits = self.display_limits(index)
+        if self.image_level == 0 and self._is_tiled(source, index):
+            shape, _ = source.frame_info(index)
+            self.scene.set_tiled_image(
+                source, index, shape, limits, self.lut)
+            return
+
+        if self.image_level > 0 and self.pyramid is not None:
+            frame = self.pyramid.request(index, self.image_level)
+        else:
+            # 'request' caches the frame, so scrolling back to it doesn't
+            # read it again, reads chunked Datasets a chunk-aligned block at
+            # a time, and returns memory-mapped frames as views, uncopied
+            frame = source.request(index)
+        # frames are stored as (1, x, y); transposing the view is free, and
+        # array2pixmap writes the rescaled image in display order
+        image = frame.squeeze().T
+        pixmap = self.scene.array2pixmap(
+            image, True, self.buffers, limits, self.lut)
+        if self.image_level > 0 and self.pyramid.full_shape is not None:
+            # draw the downsampled frame at the size of the full frame
+            pixmap.setDevicePixelRatio(
+                frame.shape[-2] / self.pyramid.full_shape[-2])
+        self.scene.set_pixmap(pixmap, index)
+
+    def _set_projection_image(self, index: int):
+        # projections are shown like a frame, rescaled to their own range
+        image = self.projection.squeeze().T
+        pixmap = self.scene.array2pixmap(
+            image, True, self.buffers, None, self.lut)
         self.scene.set_pixmap(pixmap, index)
 
+    def _set_composite_image(self, index: int):
+        # channels are only read when the index changes, not when their
+        # contrast or colormap does
+        if self._channels is None or not self._channels[0] == index:
+            source = self.datasources[DataType.IMAGE]
+            self._channels = (index, source.request_channels(index))
+        planes = self._channels[1]
+        channels = range(len(planes))
+        pixmap = self.scene.composite2pixmap(
+            [plane.T for plane in planes], self._channel_luts(len(planes)),
+            [self.channel_display_limits(index, c) for c in channels],
+            self.buffers)
+        self.scene.set_pixmap(pixmap, index)
+
+    def _channel_luts(self, channels: int) -> List[DisplayLUT]:
+        while len(self.channel_luts) < channels:
+            i = len(self.channel_luts) % len(CHANNEL_COLORMAPS)
+            self.channel_luts.append(DisplayLUT(colormap=CHANNEL_COLORMAPS[i]))
+        return self.channel_luts[:channels]
+
+    def channel_display_limits(self, index: int, channel: int
+                               ) -> Optional[Tuple[float, float]]:
+        """
+        Returns the limits of 'channel' of the frame at 'index' in composite
+        images: those set with set_channel_limits, or else those of the
+        channel's frame according to self.normalization.
+        """
+        limits = self.channel_limits.get(channel)
+        if limits is not None:
+            return limits
+        frame_index = self.datasources[DataType.IMAGE].frame_index
+        position = list(frame_index.position(index))
+        position[frame_index.axis_of(Dimension.C)] = channel
+        return self.display_limits(frame_index.index(position))
+
+    @Slot(bool)
+    def set_composite(self, enable: bool):
+        """
+        Shows all channels of frames with a C Dimension blended into one
+        image, each with its own colormap, or one channel at a time.
+        """
+        self.composite = enable
+        if DataType.IMAGE in self.datasources:
+            self._set_image(self.current_index)
+
+    @Slot(int, object)
+    def set_channel_limits(self, channel: int,
+                           limits: Optional[Tuple[float, float]]):
+        """
+        Sets the intensities of 'channel' shown as black and full color in
+        composite images, or resets them if 'limits' is None.
+        """
+        if limits is None:
+            self.channel_limits.pop(channel, None)
+        else:
+            self.channel_limits[channel] = tuple(limits)
+        if self.composite and DataType.IMAGE in self.datasources:
+            self._set_image(self.current_index)
+
+    @Slot(int, str)
+    def set_channel_colormap(self, channel: int, name: str):
+        self._channel_luts(channel + 1)[channel].set_colormap(name)
+        if self.composite and DataType.IMAGE in self.datasources:
+            self._set_image(self.current_index)
+
+    @Slot(object)
+    def set_projection(self, projection: Optional[np.ndarray]):
+        """
+        Shows 'projection', e.g. from self.projections, in place of the
+        frames as a virtual frame, or the frames again if it's None. The
+        markers of the current frame are still shown over it.
+        """
+        self.projection = projection
+        if DataType.IMAGE in self.datasources:
+            self._set_image(self.current_index)
+
+    @staticmethod
+    def _is_tiled(source, index: int) -> bool:
+        """
+        Whether the frame at 'index' is large enough to be shown in tiles,
+        and 'source' can read parts of it.
+        """
+        if not hasattr(source, 'request_region'):
+            return False
+        shape, _ = source.frame_info(index)
+        return len(shape) >= 2 and shape[-2] * shape[-1] >= TILED_THRESHOLD
+
+    def display_limits(self, index: int) -> Optional[Tuple[float, float]]:
+        """
+        Returns the intensities shown as black and white in frame 'index',
+        according to self.normalization, or None if they aren't known yet,
+        in which case frames are rescaled to their own minimum and maximum.
+        """
+        stats = self.statistics
+        # frames appended since the statistics were computed aren't indexed
+        if stats is None or index >= len(stats):
+            return None
+        if self.normalization & Normalization.STACK:
+            return stats.limits(None, *DISPLAY_PERCENTILES)
+        return stats.limits(index, *DISPLAY_PERCENTILES)
+
+    @Slot(object)
+    def set_statistics(self, stats: Optional[FrameStatistics]):
+        """
+        Sets the intensity statistics of the image datasource, which the
+        display limits are taken from, and redraws the current frame.
+        """
+        self.statistics = stats
+        if DataType.IMAGE in self.datasources:
+            self._set_image(self.current_index)
+
+    @Slot(object)
+    def set_normalization(self, normalization: Normalization):
+        self.normalization = normalization
+        if DataType.IMAGE in self.datasources:
+            self._set_image(self.current_index)
+
+    @Slot(float)
+    def set_gamma(self, gamma: float):
+        self.lut.set_gamma(gamma)
+        self._redraw_image()
+
+    @Slot(str)
+    def set_colormap(self, name: str):
+        """
+        Shows frames with the colormap called 'name'; see
+        display.COLORMAPS.
+        """
+        self.lut.set_colormap(name)
+        self._redraw_image()
+
+    def _redraw_image(self):
+        # tiles hold pixels that were converted with the old table
+        self.scene.tiled_image.clear()
+        if DataType.IMAGE in self.datasources:
+            self._set_image(self.current_index)
+
+    @Slot(int)
+    def set_image_level(self, level: int):
+        """
+        Sets the level of the image pyramid that frames are shown at, e.g.
+        to match the zoom of the view.
+        """
+        if level == self.image_level:
+            return
+        self.image_level = level
+        if DataType.IMAGE in self.datasources:
+            self._set_image(self.current_index)
+
     # def _set_scene_markers(self, index: int):
     #     for dtype, group in self.scene.groups.items():
     #         if self.current_index in group:
@@ -382,6 +712,19 @@ class Controller(QObject):
     def current_index(self, value):
         self._current_index = value
 
+    @property
+    def prefetch_window(self) -> int:
+        """
+        Number of frames loaded in the background ahead of the current index,
+        at least; more are loaded while scrolling fast. Set to 0 to disable
+        prefetching.
+        """
+        return self.prefetcher.window
+
+    @prefetch_window.setter
+    def prefetch_window(self, value: int):
+        self.prefetcher.window = value
+
     @property
     def dtypes(self):
         return list(self.tabwidget.keys())
@@ -20,12 +20,22 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import h5py
 import numpy as np
-from typing import Optional, Sequence, Tuple, Union
+from threading import RLock
+from typing import Dict, Hashable, List, Optional, Sequence, Tuple, Union
 from collections.abc import Callable
-from collections import namedtuple
-from itertools import repeat, count
+from collections import namedtuple, OrderedDict
+from bisect import bisect_right
 from vladutils.iteration import isiterable
 
+from .cache import FrameCache
+from .chunks import ParallelChunkReader, supports_direct_chunks
+from .config import (
+    DIMENSION_ORDER, FRAME_CACHE_NBYTES, MAX_OPEN_FILES, Dimension)
+from .registry import file_registry
+
+# h5py's default size of the raw data chunk cache
+DEFAULT_RDCC_NBYTES = 2**20
+
 """
 This API is written to be (somewhat) consistent with FileDataSource objects
 found in vladutils.io.datasource's modules, e.g.
@@ -94,6 +104,7 @@ class HDF5Request(Callable):
 
 
 Index = namedtuple('Index', ['handle', 'i'])
+FileIndex = namedtuple('FileIndex', ['filename', 'handle', 'i'])
 
 
 class _HDF5Request(Callable):
@@ -103,11 +114,53 @@ class _HDF5Request(Callable):
     pass
 
 
-class HDF5Request1D(_HDF5Request):
+class _StackedHDF5Request(_HDF5Request):
+    """
+    Base class of requests that index along Datasets as if they were stacked
+    along 'axis'. Subclasses set self._offsets, the index of the first frame
+    of each Dataset followed by the total number of frames.
+    """
+    axis: Optional[int] = None
+    _offsets: np.ndarray
+
+    @property
+    def length(self) -> int:
+        return int(self._offsets[-1])
+
+    def locate(self, index: int) -> Tuple[int, int]:
+        """
+        Returns the position of the Dataset in self.dataset_names that holds
+        frame 'index', and the index of the frame within that Dataset.
+        Negative indices count from the end of the stack.
+        """
+        length = self.length
+        if index < 0:
+            index += length
+        if not 0 <= index < length:
+            raise IndexError('Index out of range.')
+
+        dataset_index = bisect_right(self._offsets, index) - 1
+        return dataset_index, index - int(self._offsets[dataset_index])
+
+    def hyperslab(self, i: int) -> Tuple[slice, ...]:
+        """
+        Selection of frame 'i' within a single Dataset.
+        """
+        if self.axis is None:
+            return (slice(None), )
+        return (slice(None), ) * self.axis + (slice(i, i + 1), )
+
+
+class HDF5Request1D(_StackedHDF5Request):
     """
     Index along a list of HDF5 Datasets as if they were stacked along
     the 'axis' parameter.
 
+    Only the cumulative length of the Datasets is stored, so the memory
+    footprint of this object scales with the number of Datasets rather than
+    with the number of frames. Calling an instance resolves a frame index to
+    its Dataset with a binary search over the cumulative lengths.
+
     Parameters
     -------------
     filename: str
@@ -121,10 +174,16 @@ class HDF5Request1D(_HDF5Request):
 
     dataset_names: str
         Name of the h5py.Datasets, such that h5file[name] -> h5py.Dataset
+
+    swmr: bool
+        Whether to open the file in SWMR read mode, so that it may be read
+        while another process is writing to it. See refresh.
     """
-    def __init__(self, filename: str, dataset_names: Sequence[str], axis: Optional[int] = None):
+    def __init__(self, filename: str, dataset_names: Sequence[str],
+                 axis: Optional[int] = None, swmr: bool = False):
         self.filename = filename
         self.axis = axis
+        self.swmr = swmr
 
         # if axis is None:
         #     self.dataset_names = np.concatenate(dataset_names)
@@ -135,43 +194,187 @@ class HDF5Request1D(_HDF5Request):
             raise ValueError('dataset_names must be one-dimensional '
                              '(or squeezable to one dimension).')
 
-        self.length, self._cum_lengths = self._get_axis_lengths(
+        self.ndim, self._offsets = self._get_axis_lengths(
             filename, self.dataset_names, axis)
 
     def _get_axis_lengths(self, filename, handles, axis):
+        """
+        Returns the number of dimensions of the Datasets and the index of the
+        first frame of each Dataset. The last element of the offsets is the
+        total number of frames.
+        """
         # TODO: add gui_error for ValueError and a warning if axis_lengths are not all equal along axis
-        axis_lengths = []
         if axis is None:
-            ret = [{c: Index(h, i)} for h, i, c
-                   in zip(handles, repeat(slice(None)), range(len(handles)))]
-            return len(handles), ret
-        else:
-            with h5py.File(filename) as h5file:
-                ndims = [h5file[h].ndim for h in handles]
-                if not np.min(ndims) == np.max(ndims):
-                    raise ValueError('All Datasets must have the same '
-                                     'number of dimensions.')
-                ndims = ndims[0]
-                # length of each Dataset along the desired axis
-                axis_lengths = [h5file[h].shape[axis] for h in handles]
-                cum = np.cumsum(axis_lengths)
+            return None, np.arange(len(handles) + 1, dtype=np.int64)
+
+        with file_registry.open(filename, self.swmr) as h5file:
+            ndims = [h5file[h].ndim for h in handles]
+            if not np.min(ndims) == np.max(ndims):
+                raise ValueError('All Datasets must have the same '
+                                 'number of dimensions.')
+            return ndims[0], self._read_offsets(h5file, handles, axis)
+
+    @staticmethod
+    def _read_offsets(h5file, handles, axis) -> np.ndarray:
+        # length of each Dataset along the desired axis
+        axis_lengths = [h5file[h].shape[axis] for h in handles]
+        offsets = np.zeros(len(handles) + 1, dtype=np.int64)
+        np.cumsum(axis_lengths, out=offsets[1:])
+        return offsets
+
+    def refresh(self, datasets: Sequence[h5py.Dataset]) -> int:
+        """
+        Re-reads the lengths of the Datasets, which grow when frames are
+        appended to a file being written in SWMR mode. Only metadata is read.
+
+        Parameters
+        ------------
+        datasets : Sequence[h5py.Dataset]
+            The Datasets named in self.dataset_names, already refreshed.
 
-                # pair up appropriate 'index' argument to the Dataset name and
-                # slice within the Dataset
-                _handles = np.concatenate([list(repeat(h, n)) for h, n in zip(handles, cum)])
-                _indices = np.concatenate([np.arange(c) for c in cum])
-                _slices = (tuple([slice(i, i+1) if d == axis else slice(None)
-                           for d in range(ndims)]) for i in _indices)
-                ret = {c: Index(h, i) for h, i, c in zip(_handles, _slices, count())}
-                return cum[-1], ret
+        Returns the index of the first frame that was added or moved. If only
+        the last Dataset grew, that's the previous length of the stack.
+        """
+        if self.axis is None:
+            return self.length
+        offsets = np.zeros(len(datasets) + 1, dtype=np.int64)
+        np.cumsum([d.shape[self.axis] for d in datasets], out=offsets[1:])
+        changed = np.flatnonzero(offsets != self._offsets)
+        if len(changed):
+            j = changed[0]
+            first = int(min(offsets[j], self._offsets[j]))
+        else:
+            first = int(offsets[-1])
+        # assigned in one step, so that other threads calling this object
+        # see either the old or the new offsets
+        self._offsets = offsets
+        return first
 
     def __call__(self, index: int) -> Index:
         """
         """
+        dataset_index, i = self.locate(index)
+        return Index(self.dataset_names[dataset_index], self.hyperslab(i))
+
+
+class HDF5RequestND(_HDF5Request):
+    """
+    Index the frames of a single Dataset with several navigation axes, e.g.
+    one of shape [T, Z, C, x, y]: every axis but the last two, which are the
+    image's, is a Dimension that can be navigated independently.
+
+    Frames are also numbered by a flat index, in C order of the navigation
+    axes, so that the datasource, its cache and the prefetcher treat them
+    like any other stack. A frame's selection only covers that frame, so
+    moving along one Dimension leaves the cached frames at other positions,
+    e.g. the neighbouring time points of another Z plane, untouched.
+
+    Parameters
+    ------------
+    filename : str
+
+    dataset_name : str
+
+    dimensions : Optional[Sequence[Dimension]]
+        Dimension of each navigation axis. By default, they're read from
+        the Dataset's dimension labels ('T', 'Z' or 'C'), if every
+        navigation axis has one, and taken from DIMENSION_ORDER otherwise.
+
+    swmr : bool
+        Whether to open the file in SWMR read mode.
+    """
+    def __init__(self, filename: str, dataset_name: str,
+                 dimensions: Optional[Sequence[Dimension]] = None,
+                 swmr: bool = False):
+        self.filename = filename
+        self.dataset_names = np.array([dataset_name])
+        with file_registry.open(filename, swmr) as h5file:
+            dset = h5file[dataset_name]
+            if dset.ndim < 3:
+                raise ValueError('The Dataset has no navigation axes.')
+            self.shape = dset.shape[:-2]
+            labels = [dim.label for dim in dset.dims][:-2]
+
+        if dimensions is None:
+            dimensions = self._dimensions_from_labels(labels)
+        self.dimensions = tuple(dimensions)
+        if not len(self.dimensions) == len(self.shape):
+            raise ValueError('Expected {} dimensions, got {}.'.format(
+                len(self.shape), len(self.dimensions)))
+        if not len(set(self.dimensions)) == len(self.dimensions):
+            raise ValueError('Dimensions must be unique.')
+
+    def _dimensions_from_labels(self, labels: Sequence[str]
+                                ) -> Tuple[Dimension, ...]:
         try:
-            return self._cum_lengths[index]
-        except KeyError as e:
-            raise IndexError('Index out of range.') from e
+            dimensions = tuple(Dimension[label.upper()] for label in labels)
+        except KeyError:
+            dimensions = ()
+        if len(set(dimensions)) == len(self.shape):
+            return dimensions
+        if len(self.shape) > len(DIMENSION_ORDER):
+            raise ValueError('The Dataset has more navigation axes than '
+                             'there are Dimensions.')
+        return tuple(DIMENSION_ORDER[:len(self.shape)])
+
+    @property
+    def length(self) -> int:
+        return int(np.prod(self.shape))
+
+    def position(self, index: int) -> Tuple[int, ...]:
+        """
+        Returns the position along each navigation axis of frame 'index'.
+        Negative indices count from the last frame.
+        """
+        if index < 0:
+            index += self.length
+        if not 0 <= index < self.length:
+            raise IndexError('Index out of range.')
+        return tuple(int(i) for i in np.unravel_index(index, self.shape))
+
+    def index(self, position: Sequence[int]) -> int:
+        """
+        Returns the flat index of the frame at 'position'.
+        """
+        return int(np.ravel_multi_index(tuple(position), self.shape))
+
+    def axis_of(self, dimension: Dimension) -> int:
+        return self.dimensions.index(dimension)
+
+    def frames_along(self, index: int, dimension: Dimension) -> np.ndarray:
+        """
+        Returns the flat indices of the frames along 'dimension', in order,
+        at the position of frame 'index' along the other Dimensions; e.g.
+        the time points of one Z plane and channel.
+        """
+        axis = self.axis_of(dimension)
+        position = list(self.position(index))
+        position[axis] = np.arange(self.shape[axis])
+        return np.ravel_multi_index(tuple(position), self.shape)
+
+    def hyperslab(self, position: Sequence[int]) -> Tuple[slice, ...]:
+        return tuple(slice(i, i + 1) for i in position)
+
+    def __call__(self, index: int) -> Index:
+        return Index(self.dataset_names[0],
+                     self.hyperslab(self.position(index)))
+
+
+def image_request(filename: str, dataset_names: Sequence[Sequence[str]],
+                  swmr: bool = False) -> _HDF5Request:
+    """
+    Returns the request for the image Datasets 'dataset_names': an
+    HDF5RequestND for a single Dataset with more than one navigation axis,
+    and an HDF5Request1D, stacking the Datasets along their first axis,
+    otherwise.
+    """
+    names = np.concatenate(dataset_names)
+    if len(names) == 1:
+        with file_registry.open(filename, swmr) as h5file:
+            ndim = h5file[names[0]].ndim
+        if ndim > 3:
+            return HDF5RequestND(filename, names[0], swmr=swmr)
+    return HDF5Request1D(filename, dataset_names, axis=0, swmr=swmr)
 
 
 class HDF5Request2D(_HDF5Request):
@@ -216,15 +419,335 @@ class HDF5Request2D(_HDF5Request):
         return name, None
 
 
+def memmap_dataset(dset: h5py.Dataset) -> Optional[np.memmap]:
+    """
+    Maps a Dataset's data into memory if it's stored as a single contiguous,
+    uncompressed block in the HDF5 file. Returns None if the Dataset is
+    chunked, compressed, stored externally or not yet allocated.
+    """
+    if dset.chunks is not None or dset.external or dset.size == 0:
+        return None
+    if dset.dtype.kind not in 'biuf':
+        return None
+    offset = dset.id.get_offset()
+    if offset is None:
+        return None
+    return np.memmap(dset.file.filename, dtype=dset.dtype, mode='r',
+                     offset=offset, shape=dset.shape)
+
+
+def _next_prime(n: int) -> int:
+    def is_prime(k):
+        return k > 1 and all(k % d for d in range(2, int(k**0.5) + 1))
+    while not is_prime(n):
+        n += 1
+    return n
+
+
+def chunk_cache_size(filename: str, dataset_names: Sequence[str],
+                     axis: Optional[int], swmr: bool = False
+                     ) -> Dict[str, int]:
+    """
+    Sizes HDF5's raw data chunk cache for reading frames along 'axis' of
+    the Datasets. The cache is made large enough to hold every chunk that
+    one frame intersects, so that reading the frames of a chunk one after
+    the other decompresses each chunk only once.
+
+    Returns keyword arguments for h5py.File, i.e. 'rdcc_nbytes' and
+    'rdcc_nslots', or an empty dict if none of the Datasets are chunked.
+    """
+    nbytes = 0
+    nchunks = 0
+    with file_registry.open(filename, swmr) as h5file:
+        for name in dataset_names:
+            dset = h5file[name]
+            if dset.chunks is None:
+                continue
+            # number of chunks spanned by one frame
+            n = 1
+            for d, (length, extent) in enumerate(zip(dset.shape, dset.chunks)):
+                if not d == axis:
+                    n *= -(-length // extent)
+            chunk_nbytes = np.prod(dset.chunks) * dset.dtype.itemsize
+            nbytes = max(nbytes, int(n * chunk_nbytes))
+            nchunks = max(nchunks, n)
+
+    if not nbytes:
+        return dict()
+    # HDF5's documentation recommends ~100 hash table slots per chunk that
+    # fits in the cache, and a prime number of slots
+    return dict(rdcc_nbytes=max(nbytes, DEFAULT_RDCC_NBYTES),
+                rdcc_nslots=_next_prime(max(100 * nchunks, 521)))
+
+
+def _selection_shape(sl: Tuple[slice, ...],
+                     shape: Tuple[int, ...]) -> Tuple[int, ...]:
+    """
+    Shape of the array that selecting 'sl', a tuple of slices, from an array
+    of shape 'shape' returns. Missing trailing dimensions are selected
+    entirely.
+    """
+    sl = tuple(sl) + (slice(None), ) * (len(shape) - len(sl))
+    return tuple(len(range(*s.indices(n))) for s, n in zip(sl, shape))
+
+
+def _selection_key(sl) -> Hashable:
+    """
+    slice objects are not hashable, so we convert them to tuples before
+    using them in a dictionary key.
+    """
+    if sl is None:
+        return None
+    return tuple((s.start, s.stop, s.step) if isinstance(s, slice) else s
+                 for s in sl)
+
+
+def _region_selection(sl: Tuple[slice, ...], shape: Tuple[int, ...],
+                      region: Tuple[slice, slice]) -> Tuple[slice, ...]:
+    """
+    Narrows 'sl', the selection of a frame from a Dataset of shape 'shape',
+    to 'region', a pair of slices along the frame's last two axes.
+    """
+    sl = tuple(sl) + (slice(None), ) * (len(shape) - len(sl))
+    tail = []
+    for s, r, n in zip(sl[-2:], region, shape[-2:]):
+        rng = range(*s.indices(n))[r]
+        tail.append(slice(rng.start, rng.stop, rng.step))
+    return sl[:-2] + tuple(tail)
+
+
+class CSRCoordinates(object):
+    """
+    Coordinates of every frame, concatenated into a single array. The rows
+    belonging to frame i are values[offsets[i]:offsets[i + 1]], so indexing
+    returns a view and doesn't copy anything.
+
+    Parameters
+    ------------
+    values : np.ndarray
+        2D array holding the rows of all frames.
+
+    offsets : np.ndarray
+        Index of each frame's first row in 'values'. Its last element is the
+        total number of rows.
+    """
+    def __init__(self, values: np.ndarray, offsets: np.ndarray):
+        self.values = values
+        self.offsets = offsets
+        self.values.flags.writeable = False
+        # set by from_hdf5: the Datasets the rows were read from. Once rows
+        # are appended, 'values' is the start of a larger buffer whose spare
+        # rows later appended rows are read into
+        self._datasets: Optional[List[List[h5py.Dataset]]] = None
+        self._columns: Optional[np.ndarray] = None
+        self._buffer = values
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index: int) -> np.ndarray:
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Index out of range.')
+        return self.values[self.offsets[index]:self.offsets[index + 1]]
+
+    @classmethod
+    def from_hdf5(cls, h5file: h5py.File, dataset_names: np.ndarray,
+                  dtype: np.dtype = np.float32,
+                  progress: Optional[Callable] = None) -> 'CSRCoordinates':
+        """
+        Reads per-frame Datasets into a CSRCoordinates object.
+
+        Parameters
+        ------------
+        h5file : h5py.File
+
+        dataset_names : np.ndarray
+            2D array of Dataset names, with one row per frame. The Datasets
+            in a row must have the same length; they're concatenated
+            column-wise, as in HDF5Request2D. 1D Datasets count as one column.
+
+        dtype : np.dtype
+            dtype of the output array.
+
+        progress : Optional[Callable]
+            Called with the number of frames read so far and the total
+            number of frames, after each frame is read.
+        """
+        dataset_names = np.atleast_2d(dataset_names)
+        datasets = [[h5file[n] for n in row] for row in dataset_names]
+
+        # first pass over the Datasets' metadata only
+        lengths = [min(d.shape[0] for d in row) for row in datasets]
+        widths = [1 if d.ndim == 1 else d.shape[1] for d in datasets[0]]
+        columns = np.zeros(len(widths) + 1, dtype=np.int64)
+        np.cumsum(widths, out=columns[1:])
+        offsets = np.zeros(len(datasets) + 1, dtype=np.int64)
+        np.cumsum(lengths, out=offsets[1:])
+
+        # second pass reads each Dataset straight into its place in 'values'
+        buffer = np.empty((offsets[-1], columns[-1]), dtype=dtype)
+        frames = zip(offsets[:-1], offsets[1:], datasets)
+        for i, (start, stop, row) in enumerate(frames):
+            _read_rows(buffer, start, row, columns, 0, stop - start)
+            if progress is not None:
+                progress(i + 1, len(datasets))
+        coordinates = cls(buffer, offsets)
+        coordinates._datasets = datasets
+        coordinates._columns = columns
+        return coordinates
+
+    def refresh(self) -> np.ndarray:
+        """
+        Reads the rows appended to the Datasets since they were read by
+        from_hdf5 or last refreshed, e.g. while the file is written in SWMR
+        mode. Rows that were read before are neither read nor copied again,
+        as long as rows are only appended to the last frames that have any.
+
+        Returns the indices of frames whose number of rows changed.
+        """
+        if self._datasets is None:
+            raise TypeError('The coordinates were not read from HDF5.')
+        # these are the only open handles of the Datasets, which is what
+        # Dataset.refresh requires. Only their extents are read.
+        for d in (d for row in self._datasets for d in row):
+            d.refresh()
+        lengths = np.array([min(d.shape[0] for d in row)
+                            for row in self._datasets], dtype=np.int64)
+        previous = np.diff(self.offsets)
+        changed = np.flatnonzero(lengths != previous)
+        if not len(changed):
+            return changed
+
+        first = changed[0]
+        offsets = np.zeros_like(self.offsets)
+        np.cumsum(lengths, out=offsets[1:])
+        nrows = offsets[-1]
+        buffer = self._buffer
+        # rows of a frame that's followed by frames with rows can't be
+        # appended in place without moving rows that callers may hold views
+        # of, so they're read into a new buffer
+        if (np.any(previous[first + 1:]) or nrows > len(buffer)
+                or not buffer.flags.writeable):
+            # spare rows make appending to the last frames amortized O(1)
+            buffer = np.empty((max(nrows, 2 * len(buffer)), buffer.shape[1]),
+                              dtype=buffer.dtype)
+            buffer[:offsets[first]] = self.values[:offsets[first]]
+            for j in range(first, len(self)):
+                n = min(previous[j], lengths[j])
+                buffer[offsets[j]:offsets[j] + n] = self[j][:n]
+        for j in range(first, len(self)):
+            n = min(previous[j], lengths[j])
+            _read_rows(buffer, offsets[j], self._datasets[j], self._columns,
+                       n, lengths[j])
+
+        values = buffer[:nrows]
+        values.flags.writeable = False
+        # 'values' only grows, so other threads indexing this object with
+        # the old offsets in the meantime still get the old rows
+        self._buffer = buffer
+        self.values = values
+        self.offsets = offsets
+        return changed
+
+
+def _read_rows(values: np.ndarray, start: int,
+               datasets: Sequence[h5py.Dataset], columns: np.ndarray,
+               first: int, stop: int):
+    """
+    Reads rows first:stop of a frame's Datasets into 'values', where the
+    frame's rows start at row 'start'.
+    """
+    if first >= stop:
+        return
+    for c0, c1, dset in zip(columns[:-1], columns[1:], datasets):
+        if dset.ndim == 1:
+            dest = np.s_[start + first:start + stop, c0]
+        else:
+            dest = np.s_[start + first:start + stop, c0:c1]
+        dset.read_direct(values, np.s_[first:stop], dest)
+
+
 class HDF5DataSource(object):
     """
     Together with HDF5Request, allows indexing into a list of
     h5py.Dataset objects as if they were stacked together.
+
+    Parameters
+    ------------
+    filename : str
+
+    request : _HDF5Request
+
+    cache : Optional[FrameCache]
+        Cache of previously requested data. Pass the same FrameCache to
+        several datasources to have them share one memory budget. Arrays
+        are cached by file, Dataset name and selection, so requests from
+        different datasources that resolve to the same data share an entry.
+        If None, a cache of FRAME_CACHE_NBYTES bytes is created.
+
+    memmap : bool
+        Whether to read contiguous, uncompressed Datasets directly from a
+        memory map of the file. Frames from such Datasets are views into the
+        memory map; they are neither copied nor cached. Other Datasets are
+        read with h5py.
+
+    rdcc_nbytes, rdcc_nslots, rdcc_w0 : Optional
+        Parameters of HDF5's raw data chunk cache; see h5py.File. If none
+        are given and 'request' is an HDF5Request1D, the chunk cache is
+        sized with chunk_cache_size.
+
+    chunk_reader : Optional[ParallelChunkReader]
+        If given, and it has more than one worker, frames of Datasets
+        compressed with gzip (and optionally shuffled) are decompressed
+        chunk by chunk in parallel, rather than by h5py's filter pipeline.
+
+    The file is opened through file_registry, so datasources reading the
+    same file share one handle and chunk cache. If the shared file's chunk
+    cache is smaller than 'rdcc_nbytes', Datasets are opened with a chunk
+    cache of their own.
+
+    Frames of Datasets that are chunked along the request's axis are read
+    one chunk-aligned block at a time. All frames in the block are cached,
+    so each chunk is decompressed once while scrolling through it.
+
+    swmr : bool
+        Whether to open the file in SWMR read mode, so that it may be read
+        while another process is writing to it. See refresh.
+
+    Coordinates requested with an HDF5Request2D are read all at once, the
+    first time they're requested, into a CSRCoordinates object.
     """
-    def __init__(self, filename: str, request: _HDF5Request):
+    def __init__(self, filename: str, request: _HDF5Request,
+                 cache: Optional[FrameCache] = None, memmap: bool = True,
+                 rdcc_nbytes: Optional[int] = None,
+                 rdcc_nslots: Optional[int] = None,
+                 rdcc_w0: Optional[float] = None, swmr: bool = False,
+                 chunk_reader: Optional[ParallelChunkReader] = None):
         self.filename = filename
+        self.chunk_reader = chunk_reader
+        # whether ParallelChunkReader can read each Dataset, keyed by name
+        self._direct_chunks: Dict[str, bool] = dict()
+        self.memmap = memmap
         self._request = request
-        self.h5file = h5py.File(filename)
+        self.cache = FrameCache(FRAME_CACHE_NBYTES) if cache is None else cache
+
+        chunk_cache = dict(rdcc_nbytes=rdcc_nbytes, rdcc_nslots=rdcc_nslots,
+                           rdcc_w0=rdcc_w0)
+        if not any(v is not None for v in chunk_cache.values()) and \
+                isinstance(request, HDF5Request1D):
+            chunk_cache = chunk_cache_size(
+                filename, request.dataset_names, request.axis, swmr)
+        self._chunk_cache = {k: v for k, v in chunk_cache.items()
+                             if v is not None}
+        self.h5file = file_registry.acquire(
+            filename, swmr, **self._chunk_cache)
+        self._acquired = True
+        # h5py.Dataset handles, keyed by name; looking a Dataset up by name is
+        # comparatively slow, so we only do it once per Dataset
+        self._datasets = dict()
+        self._coordinates: Optional[CSRCoordinates] = None
 
     def __enter__(self):
         return self
@@ -235,14 +758,654 @@ class HDF5DataSource(object):
     def __len__(self):
         return self._request.length
 
+    @property
+    def dataset_names(self) -> np.ndarray:
+        return self._request.dataset_names
+
     def cleanup(self):
-        self.h5file.close()
+        self._datasets.clear()
+        self._coordinates = None
+        if self._acquired:
+            self._acquired = False
+            file_registry.release(self.h5file)
+
+    @property
+    def coordinates(self) -> CSRCoordinates:
+        """
+        All coordinates of an HDF5Request2D, loaded on first access.
+        """
+        return self.load_coordinates()
+
+    def load_coordinates(self, progress: Optional[Callable] = None
+                         ) -> CSRCoordinates:
+        """
+        Loads all coordinates of an HDF5Request2D, if they aren't loaded yet.
+
+        Parameters
+        ------------
+        progress : Optional[Callable]
+            See CSRCoordinates.from_hdf5.
+        """
+        if self._coordinates is None:
+            self._coordinates = CSRCoordinates.from_hdf5(
+                self.h5file, self._request.dataset_names, progress=progress)
+        return self._coordinates
+
+    def refresh(self) -> np.ndarray:
+        """
+        Picks up data appended to the file since it was opened or last
+        refreshed, e.g. by a process writing to it in SWMR mode. Only the
+        Datasets' extents and the appended coordinates are read.
+
+        Returns the indices of frames that were added or changed.
+        """
+        if isinstance(self._request, HDF5Request1D):
+            # HDF5 mishandles refreshing a Dataset that has more than one
+            # open handle, so Datasets are only refreshed through the handles
+            # in self._datasets. Memory-mapped Datasets can't grow.
+            datasets = [self._get_dataset(name)
+                        for name in self._request.dataset_names]
+            for dset in datasets:
+                if isinstance(dset, h5py.Dataset):
+                    dset.refresh()
+            first = self._request.refresh(datasets)
+            return np.arange(first, len(self), dtype=np.int64)
+        elif self._coordinates is not None:
+            return self._coordinates.refresh()
+        return np.empty(0, dtype=np.int64)
+
+    def _get_dataset(self, name: str) -> Union[h5py.Dataset, np.memmap]:
+        try:
+            return self._datasets[name]
+        except KeyError:
+            dset = self._open_dataset(name)
+            if self.memmap:
+                mapped = memmap_dataset(dset)
+                if mapped is not None:
+                    dset = mapped
+            self._datasets[name] = dset
+            return dset
+
+    def _open_dataset(self, name: str) -> h5py.Dataset:
+        nbytes = self._chunk_cache.get('rdcc_nbytes')
+        _, nslots, file_nbytes, w0 = self.h5file.id.get_access_plist(
+            ).get_cache()
+        if nbytes is None or nbytes <= file_nbytes:
+            return self.h5file[name]
+        # another datasource opened the file with a smaller chunk cache
+        dapl = h5py.h5p.create(h5py.h5p.DATASET_ACCESS)
+        dapl.set_chunk_cache(self._chunk_cache.get('rdcc_nslots', nslots),
+                             nbytes, self._chunk_cache.get('rdcc_w0', w0))
+        return h5py.Dataset(h5py.h5d.open(
+            self.h5file.id, name.encode('utf-8'), dapl))
 
-    def request(self, index: int, axis: int = -1):
+    def request(self, index: int, axis: int = -1) -> np.ndarray:
+        """
+        Returns the data at 'index'. The returned array may be shared with
+        other callers via the cache and is therefore read-only.
+
+        'axis' is kept for backwards compatibility; coordinates are always
+        concatenated along their last axis.
+        """
+        name, sl = self._request(index)
+        if isiterable(name):
+            return self.coordinates[index]
+
+        key = (self.filename, name, _selection_key(sl))
+        arr = self.cache.get(key)
+        if arr is not None:
+            return arr
+
+        dset = self._get_dataset(name)
+        if isinstance(dset, np.memmap):
+            # a view into the memory map costs nothing to recreate
+            return dset[sl]
+        elif self._is_chunked_along_axis(dset):
+            return self._read_chunk_aligned(name, dset, sl)
+        return self.cache.put(key, self._read(name, dset, sl))
+
+    def frame_info(self, index: int) -> Tuple[Tuple[int, ...], np.dtype]:
+        """
+        Returns the shape and dtype of the frame at 'index', i.e. of the
+        buffer to pass to read_into. Only metadata is read.
+        """
         name, sl = self._request(index)
         if isiterable(name):
-            arr = [self.h5file[n].value for n in name]
-            arr = [a[:, None] if a.ndim == 1 else a for a in arr]
-            return np.concatenate(arr, axis)
+            raise TypeError('read_into only supports image Datasets.')
+        dset = self._get_dataset(name)
+        return _selection_shape(sl, dset.shape), dset.dtype
+
+    def read_into(self, index: int, out: np.ndarray) -> np.ndarray:
+        """
+        Reads the frame at 'index' into 'out', a caller-owned array that may
+        be reused from one frame to the next, e.g. one from a
+        FrameBufferPool, and returns it. See frame_info for its shape and
+        dtype.
+
+        Frames in the cache or memory map are copied from it. Frames of
+        Datasets chunked along the stack's axis are read a chunk-aligned
+        block at a time and cached, as by 'request', so that each chunk is
+        decompressed once. Other frames are read with Dataset.read_direct,
+        straight into 'out', and aren't cached. To display a frame, use
+        'request', which neither copies memory-mapped frames nor skips the
+        cache.
+        """
+        shape, dtype = self.frame_info(index)
+        if not (out.shape == shape and out.dtype == dtype and
+                out.flags.c_contiguous):
+            raise ValueError('out must be a C-contiguous array with shape '
+                             '{} and dtype {}.'.format(shape, dtype))
+
+        name, sl = self._request(index)
+        arr = self.cache.get((self.filename, name, _selection_key(sl)))
+        dset = self._get_dataset(name)
+        if arr is None and isinstance(dset, np.memmap):
+            arr = dset[sl]
+        elif arr is None and self._is_chunked_along_axis(dset):
+            arr = self._read_chunk_aligned(name, dset, sl)
+        if arr is not None:
+            np.copyto(out, arr)
+        elif self._use_chunk_reader(name, dset):
+            self.chunk_reader.read(dset, sl, out)
         else:
-            return self.h5file[name][sl]
+            dset.read_direct(out, source_sel=sl)
+        return out
+
+    def request_region(self, index: int,
+                       region: Tuple[slice, slice]) -> np.ndarray:
+        """
+        Returns the part of the frame at 'index' that 'region', a pair of
+        slices along the frame's last two axes, selects. Only that hyperslab
+        is read from the file, unless the whole frame is in the cache.
+
+        Regions aren't cached; callers such as VTiledImageItem keep what
+        they've converted for display.
+        """
+        name, sl = self._request(index)
+        if isiterable(name):
+            raise TypeError('request_region only supports image Datasets.')
+        region = tuple(region)
+        arr = self.cache.get((self.filename, name, _selection_key(sl)))
+        dset = self._get_dataset(name)
+        if arr is None and isinstance(dset, np.memmap):
+            arr = dset[sl]
+        if arr is not None:
+            return arr[(Ellipsis, ) + region]
+        return dset[_region_selection(sl, dset.shape, region)]
+
+    @property
+    def frame_index(self) -> Optional[HDF5RequestND]:
+        """
+        The index of frames along several Dimensions, if the frames are
+        navigated that way.
+        """
+        if isinstance(self._request, HDF5RequestND):
+            return self._request
+        return None
+
+    @property
+    def channels(self) -> int:
+        """
+        Number of channels of each frame: the length of the C Dimension, or
+        1 if the frames have none.
+        """
+        frame_index = self.frame_index
+        if frame_index is None or Dimension.C not in frame_index.dimensions:
+            return 1
+        return frame_index.shape[frame_index.axis_of(Dimension.C)]
+
+    def request_channels(self, index: int) -> np.ndarray:
+        """
+        Returns every channel of the frame at 'index', i.e. of its position
+        along the other Dimensions, as an array of shape (channels, x, y).
+        The channels are read with a single hyperslab selection, which is
+        cached like a frame.
+        """
+        if self.channels < 2:
+            raise TypeError('The frames have no C Dimension.')
+        axis = self.frame_index.axis_of(Dimension.C)
+        name, sl = self._request(index)
+        sl = sl[:axis] + (slice(None), ) + sl[axis + 1:]
+        key = (self.filename, name, _selection_key(sl))
+        arr = self.cache.get(key)
+        if arr is None:
+            dset = self._get_dataset(name)
+            if isinstance(dset, np.memmap):
+                arr = dset[sl]
+            else:
+                arr = self.cache.put(key, self._read(name, dset, sl))
+        return np.moveaxis(arr, axis, 0).reshape(
+            (arr.shape[axis], ) + arr.shape[-2:])
+
+    @property
+    def axis(self) -> Optional[int]:
+        """
+        Axis of the Datasets along which frames are stacked.
+        """
+        return getattr(self._request, 'axis', None)
+
+    def frame_blocks(self, maxbytes: int) -> List[Tuple[int, int]]:
+        """
+        Splits the stack into blocks of frames, (start, stop), for reading
+        with read_block. Each block lies within one Dataset, starts at a
+        chunk boundary along the stacking axis and holds whole chunks, and
+        is at most 'maxbytes' large unless a single chunk is larger.
+        """
+        request = self._request
+        if not isinstance(request, HDF5Request1D) or request.axis is None:
+            raise TypeError('Only stacks of image frames can be read in '
+                            'blocks.')
+        axis = request.axis
+        blocks = []
+        offsets = request._offsets
+        for j, name in enumerate(request.dataset_names):
+            start, stop = int(offsets[j]), int(offsets[j + 1])
+            if start == stop:
+                continue
+            length = _block_length(self._get_dataset(name), axis, maxbytes)
+            blocks.extend((b, min(b + length, stop))
+                          for b in range(start, stop, length))
+        return blocks
+
+    def read_block(self, start: int, stop: int) -> np.ndarray:
+        """
+        Returns frames 'start' to 'stop', which must lie within one Dataset,
+        concatenated along self.axis. Blocks aren't cached, so reading a
+        whole stack doesn't evict the frames being shown.
+        """
+        request = self._request
+        j, i = request.locate(start)
+        if stop - start > request._offsets[j + 1] - start:
+            raise ValueError('Blocks must lie within one Dataset.')
+        name = request.dataset_names[j]
+        dset = self._get_dataset(name)
+        selection = request.hyperslab(i)[:-1] + (
+            slice(i, i + stop - start), )
+        if isinstance(dset, np.memmap):
+            return dset[selection]
+        return self._read(name, dset, selection)
+
+    def read_line(self, index: int, dimension: Dimension, start: int,
+                  stop: int) -> np.ndarray:
+        """
+        Returns the frames at positions 'start' to 'stop' along 'dimension',
+        at the position of frame 'index' along the other Dimensions, as an
+        array of shape (stop - start, x, y). They're read with a single
+        hyperslab selection and, like blocks, aren't cached.
+        """
+        frame_index = self.frame_index
+        if frame_index is None:
+            raise TypeError('The frames have no Dimensions.')
+        axis = frame_index.axis_of(dimension)
+        name, sl = self._request(index)
+        sl = sl[:axis] + (slice(start, stop), ) + sl[axis + 1:]
+        dset = self._get_dataset(name)
+        if isinstance(dset, np.memmap):
+            arr = dset[sl]
+        else:
+            arr = self._read(name, dset, sl)
+        return np.moveaxis(arr, axis, 0).reshape(
+            (arr.shape[axis], ) + arr.shape[-2:])
+
+    def _use_chunk_reader(self, name: str, dset: h5py.Dataset) -> bool:
+        reader = self.chunk_reader
+        if reader is None or reader.max_workers < 2:
+            return False
+        try:
+            return self._direct_chunks[name]
+        except KeyError:
+            direct = self._direct_chunks[name] = supports_direct_chunks(dset)
+            return direct
+
+    def _read(self, name: str, dset: h5py.Dataset,
+              sl: Tuple[slice, ...]) -> np.ndarray:
+        if self._use_chunk_reader(name, dset):
+            return self.chunk_reader.read(dset, sl)
+        return dset[sl]
+
+    def _is_chunked_along_axis(self, dset: h5py.Dataset) -> bool:
+        axis = getattr(self._request, 'axis', None)
+        return _is_chunked_along(dset, axis, self.cache.maxbytes)
+
+    def _read_chunk_aligned(self, name: str, dset: h5py.Dataset,
+                            sl: Tuple[slice, ...]) -> np.ndarray:
+        return _read_chunk_aligned(
+            self.cache, self._request, self.filename, name, dset, sl,
+            lambda d, s: self._read(name, d, s))
+
+
+def _block_length(dset: h5py.Dataset, axis: int, maxbytes: int) -> int:
+    """
+    Returns the number of frames of the blocks that 'dset' is read in by
+    frame_blocks: a multiple of its chunks' extent along 'axis', at most
+    'maxbytes' large unless a single chunk is larger.
+    """
+    chunks = getattr(dset, 'chunks', None)
+    extent = 1 if chunks is None else chunks[axis]
+    frame_nbytes = dset.size // dset.shape[axis] * dset.dtype.itemsize
+    return max(maxbytes // max(frame_nbytes * extent, 1), 1) * extent
+
+
+def _is_chunked_along(dset: h5py.Dataset, axis: Optional[int],
+                      maxbytes: int) -> bool:
+    if axis is None or dset.chunks is None or dset.chunks[axis] < 2:
+        return False
+    frame_nbytes = dset.size // dset.shape[axis] * dset.dtype.itemsize
+    block_nbytes = frame_nbytes * dset.chunks[axis]
+    # don't let one block crowd everything else out of the cache
+    return block_nbytes * 4 <= maxbytes
+
+
+def _read_chunk_aligned(cache: FrameCache, request: _StackedHDF5Request,
+                        filename: str, name: str, dset: h5py.Dataset,
+                        sl: Tuple[slice, ...],
+                        read: Optional[Callable] = None) -> np.ndarray:
+    """
+    Reads every frame in the chunk containing 'sl', caches them all and
+    returns the one at 'sl'. 'read(dset, selection)' reads the block; by
+    default, it's read with h5py.
+    """
+    axis = request.axis
+    i = sl[axis].start
+    extent = dset.chunks[axis]
+    start = i - i % extent
+    stop = min(start + extent, dset.shape[axis])
+    selection = sl[:axis] + (slice(start, stop), )
+    block = dset[selection] if read is None else read(dset, selection)
+
+    # each frame is copied out of the block, so that evicting it from the
+    # cache frees its memory rather than keeping the whole block alive
+    head = (slice(None), ) * axis
+    for j in range(start, stop):
+        arr = block[head + (slice(j - start, j - start + 1), )].copy()
+        key = (filename, name, _selection_key(request.hyperslab(j)))
+        arr = cache.put(key, arr)
+        if j == i:
+            frame = arr
+    return frame
+
+
+class HDF5FilePool(object):
+    """
+    Keeps at most 'maxfiles' HDF5 files open for reading, closing the least
+    recently used file when another one has to be opened. h5py.Dataset
+    handles are kept along with their file, so that looking up a Dataset
+    by name is done once per open.
+
+    Use 'lock' while holding on to any h5py object from the pool, so that
+    its file isn't closed by another thread in the meantime.
+
+    Parameters
+    ------------
+    maxfiles : int
+
+    swmr : bool
+        Whether to read the files in SWMR mode.
+
+    kwargs
+        Keyword arguments passed to h5py.File, e.g. 'rdcc_nbytes'.
+
+    Files are opened through file_registry, so a file that's also open
+    elsewhere in the application isn't opened a second time.
+    """
+    def __init__(self, maxfiles: int = MAX_OPEN_FILES, swmr: bool = False,
+                 **kwargs):
+        if maxfiles < 1:
+            raise ValueError('maxfiles must be at least 1.')
+        self.maxfiles = maxfiles
+        self.swmr = swmr
+        self.kwargs = kwargs
+        self.lock = RLock()
+        self._files: OrderedDict = OrderedDict()
+        self.opens = 0
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    def __contains__(self, filename: str) -> bool:
+        return filename in self._files
+
+    def file(self, filename: str) -> h5py.File:
+        return self._entry(filename)[0]
+
+    def dataset(self, filename: str, name: str) -> h5py.Dataset:
+        h5file, datasets = self._entry(filename)
+        try:
+            return datasets[name]
+        except KeyError:
+            dset = datasets[name] = h5file[name]
+            return dset
+
+    def _entry(self, filename: str) -> Tuple[h5py.File, Dict]:
+        with self.lock:
+            try:
+                self._files.move_to_end(filename)
+                return self._files[filename]
+            except KeyError:
+                pass
+            while len(self._files) >= self.maxfiles:
+                _, (h5file, datasets) = self._files.popitem(last=False)
+                datasets.clear()
+                file_registry.release(h5file)
+            entry = self._files[filename] = (
+                file_registry.acquire(filename, self.swmr, **self.kwargs),
+                dict())
+            self.opens += 1
+            return entry
+
+    def close(self):
+        with self.lock:
+            for h5file, datasets in self._files.values():
+                datasets.clear()
+                file_registry.release(h5file)
+            self._files.clear()
+
+
+class HDF5MultiFileRequest(_StackedHDF5Request):
+    """
+    Index along the same Datasets in each of several HDF5 files, as if they
+    were all stacked along 'axis': first the Datasets of the first file, in
+    the order of 'dataset_names', then those of the second file, etc.
+
+    The stack's index is built from the Datasets' shapes only.
+
+    Parameters
+    ------------
+    filenames : Sequence[str]
+
+    dataset_names : Sequence[str]
+        Names of the Datasets in every file.
+
+    axis : int
+
+    pool : HDF5FilePool
+        Pool through which the files are opened.
+
+    progress : Optional[Callable]
+        Called with the number of files scanned so far and the total number
+        of files.
+    """
+    def __init__(self, filenames: Sequence[str], dataset_names: Sequence[str],
+                 axis: int, pool: HDF5FilePool,
+                 progress: Optional[Callable] = None):
+        self.filenames = list(filenames)
+        self.dataset_names = np.ravel(dataset_names)
+        self.axis = axis
+
+        lengths = np.empty((len(self.filenames), len(self.dataset_names)),
+                           dtype=np.int64)
+        ndims = set()
+        for i, filename in enumerate(self.filenames):
+            with pool.lock:
+                for j, name in enumerate(self.dataset_names):
+                    dset = pool.dataset(filename, name)
+                    lengths[i, j] = dset.shape[axis]
+                    ndims.add(dset.ndim)
+            if progress is not None:
+                progress(i + 1, len(self.filenames))
+        if len(ndims) > 1:
+            raise ValueError('All Datasets must have the same '
+                             'number of dimensions.')
+        self.ndim = ndims.pop() if ndims else None
+
+        self._offsets = np.zeros(lengths.size + 1, dtype=np.int64)
+        np.cumsum(lengths.ravel(), out=self._offsets[1:])
+
+    def __call__(self, index: int) -> FileIndex:
+        """
+        """
+        k, i = self.locate(index)
+        filename, name = divmod(k, len(self.dataset_names))
+        return FileIndex(self.filenames[filename],
+                         self.dataset_names[name], self.hyperslab(i))
+
+
+class HDF5MultiFileDataSource(object):
+    """
+    Presents Datasets spread across many HDF5 files, e.g. one file per
+    acquisition block, as a single stack of frames. At most
+    'max_open_files' files are open at once.
+
+    Parameters
+    ------------
+    filenames : Sequence[str]
+
+    dataset_names : Sequence[str]
+        Names of the image Datasets in every file.
+
+    axis : int
+        Axis of the Datasets along which they're stacked.
+
+    cache : Optional[FrameCache]
+        See HDF5DataSource.
+
+    max_open_files : int
+        Number of h5py.File handles kept open in an LRU pool.
+
+    progress : Optional[Callable]
+        See HDF5MultiFileRequest.
+
+    swmr : bool
+        Whether to read the files in SWMR mode.
+
+    The files' chunk cache is sized for the first file's Datasets, assuming
+    that every file has the same layout.
+    """
+    def __init__(self, filenames: Sequence[str], dataset_names: Sequence[str],
+                 axis: int = 0, cache: Optional[FrameCache] = None,
+                 max_open_files: int = MAX_OPEN_FILES,
+                 progress: Optional[Callable] = None, swmr: bool = False):
+        if not len(filenames):
+            raise ValueError('No files given.')
+        self.filenames = list(filenames)
+        self.cache = FrameCache(FRAME_CACHE_NBYTES) if cache is None else cache
+        chunk_cache = chunk_cache_size(
+            self.filenames[0], np.ravel(dataset_names), axis, swmr)
+        self.pool = HDF5FilePool(max_open_files, swmr, **chunk_cache)
+        try:
+            self._request = HDF5MultiFileRequest(
+                self.filenames, dataset_names, axis, self.pool, progress)
+        except BaseException:
+            self.pool.close()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cleanup()
+
+    def __len__(self):
+        return self._request.length
+
+    @property
+    def dataset_names(self) -> np.ndarray:
+        return self._request.dataset_names
+
+    def cleanup(self):
+        self.pool.close()
+
+    def request(self, index: int, axis: int = -1) -> np.ndarray:
+        """
+        Returns the frame at 'index'. The returned array may be shared with
+        other callers via the cache and is therefore read-only.
+        """
+        filename, name, sl = self._request(index)
+        key = (filename, name, _selection_key(sl))
+        arr = self.cache.get(key)
+        if arr is not None:
+            return arr
+
+        with self.pool.lock:
+            dset = self.pool.dataset(filename, name)
+            if _is_chunked_along(dset, self._request.axis,
+                                 self.cache.maxbytes):
+                return _read_chunk_aligned(
+                    self.cache, self._request, filename, name, dset, sl)
+            return self.cache.put(key, dset[sl])
+
+    def frame_info(self, index: int) -> Tuple[Tuple[int, ...], np.dtype]:
+        """
+        Returns the shape and dtype of the frame at 'index'. Only metadata
+        is read.
+        """
+        filename, name, sl = self._request(index)
+        with self.pool.lock:
+            dset = self.pool.dataset(filename, name)
+            return _selection_shape(sl, dset.shape), dset.dtype
+
+    @property
+    def axis(self) -> int:
+        """
+        Axis of the Datasets along which frames are stacked.
+        """
+        return self._request.axis
+
+    def frame_blocks(self, maxbytes: int) -> List[Tuple[int, int]]:
+        """
+        See HDF5DataSource.frame_blocks. Each block lies within one Dataset
+        of one file.
+        """
+        request = self._request
+        names = request.dataset_names
+        offsets = request._offsets
+        blocks = []
+        for k in range(len(offsets) - 1):
+            start, stop = int(offsets[k]), int(offsets[k + 1])
+            if start == stop:
+                continue
+            f, j = divmod(k, len(names))
+            with self.pool.lock:
+                dset = self.pool.dataset(request.filenames[f], names[j])
+                length = _block_length(dset, request.axis, maxbytes)
+            blocks.extend((b, min(b + length, stop))
+                          for b in range(start, stop, length))
+        return blocks
+
+    def read_block(self, start: int, stop: int) -> np.ndarray:
+        """
+        See HDF5DataSource.read_block. Blocks must lie within one Dataset
+        of one file, and aren't cached.
+        """
+        request = self._request
+        k, i = request.locate(start)
+        if stop - start > request._offsets[k + 1] - start:
+            raise ValueError('Blocks must lie within one Dataset.')
+        filename, name, sl = request(start)
+        selection = sl[:-1] + (slice(i, i + stop - start), )
+        with self.pool.lock:
+            return self.pool.dataset(filename, name)[selection]
+
+    def request_region(self, index: int,
+                       region: Tuple[slice, slice]) -> np.ndarray:
+        """
+        See HDF5DataSource.request_region.
+        """
+        filename, name, sl = self._request(index)
+        region = tuple(region)
+        arr = self.cache.get((filename, name, _selection_key(sl)))
+        if arr is not None:
+            return arr[(Ellipsis, ) + region]
+        with self.pool.lock:
+            dset = self.pool.dataset(filename, name)
+            return dset[_region_selection(sl, dset.shape, region)]
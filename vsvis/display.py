@@ -0,0 +1,242 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+from collections import OrderedDict
+from threading import Lock
+from typing import List, Optional, Tuple
+from qtpy.QtGui import QImage, qRgb
+
+from .config import DEFAULT_COLORMAP
+
+"""
+Maps raw pixel values to displayed colors through lookup tables, so that
+integer frames are converted for display with a single gather, and changing
+the contrast or colormap only rebuilds a table.
+"""
+
+
+def _ramp() -> np.ndarray:
+    return np.arange(256, dtype=np.float64) / 255
+
+
+def _colormap_hot() -> np.ndarray:
+    x = _ramp()
+    return np.stack([np.clip(3 * x, 0, 1), np.clip(3 * x - 1, 0, 1),
+                     np.clip(3 * x - 2, 0, 1)], axis=1)
+
+
+def _single_channel(channel: int):
+    def colormap():
+        rgb = np.zeros((256, 3))
+        rgb[:, channel] = _ramp()
+        return rgb
+    return colormap
+
+
+# functions returning (256, 3) arrays of RGB values in [0, 1]
+COLORMAPS = {
+    'gray': lambda: np.repeat(_ramp()[:, None], 3, axis=1),
+    'inverted': lambda: np.repeat(_ramp()[::-1, None], 3, axis=1),
+    'hot': _colormap_hot,
+    'red': _single_channel(0),
+    'green': _single_channel(1),
+    'blue': _single_channel(2),
+    'cyan': lambda: np.stack([0 * _ramp(), _ramp(), _ramp()], axis=1),
+    'magenta': lambda: np.stack([_ramp(), 0 * _ramp(), _ramp()], axis=1),
+    'yellow': lambda: np.stack([_ramp(), _ramp(), 0 * _ramp()], axis=1),
+}
+
+
+def colormap(name: str) -> np.ndarray:
+    """
+    Returns the colormap called 'name', see COLORMAPS, as a (256, 3) uint8
+    array of RGB values.
+    """
+    try:
+        rgb = COLORMAPS[name]()
+    except KeyError:
+        raise ValueError('Unknown colormap: {}'.format(name))
+    return np.rint(rgb * 255).astype(np.uint8)
+
+
+class DisplayLUT(object):
+    """
+    Converts frames of 8 and 16 bit integers for display by looking their
+    pixel values up in a table that applies the display limits (window and
+    level) and gamma, and a colormap.
+
+    The table maps every possible pixel value to one of 256 levels, which
+    are shown as a grayscale image, or as an indexed one whose color table
+    is the colormap. Tables are cached, so that showing frames with the
+    same limits only costs the gather; changing the limits or gamma builds
+    a new table, and changing the colormap only replaces the color table.
+
+    Parameters
+    ------------
+    gamma : float
+        Levels are proportional to the normalized value to the power of
+        1 / gamma.
+
+    colormap : str
+        Name of a colormap in COLORMAPS.
+
+    maxtables : int
+        Number of tables kept, e.g. for the tiles of different frames.
+
+    Tables may be looked up from several threads at once, e.g. by the
+    workers of a PlaybackEngine.
+    """
+    def __init__(self, gamma: float = 1.0, colormap: str = DEFAULT_COLORMAP,
+                 maxtables: int = 4):
+        self.maxtables = maxtables
+        self._lock = Lock()
+        self._tables = OrderedDict()
+        # RGB values of each table, keyed by gamma too
+        self._rgb_tables = OrderedDict()
+        self.set_gamma(gamma)
+        self.set_colormap(colormap)
+
+    @staticmethod
+    def supports(dtype: np.dtype) -> bool:
+        dtype = np.dtype(dtype)
+        return dtype.kind in 'ui' and dtype.itemsize <= 2
+
+    def set_gamma(self, gamma: float):
+        if not gamma > 0:
+            raise ValueError('gamma must be positive.')
+        self.gamma = float(gamma)
+        self._tables.clear()
+
+    def set_colormap(self, name: str):
+        rgb = colormap(name)
+        self.colormap = name
+        self._rgb = rgb
+        self._color_table = [qRgb(*map(int, c)) for c in rgb]
+        self._rgb_tables = OrderedDict()
+
+    @property
+    def color_table(self) -> List[int]:
+        """
+        The colormap as a list of QRgb values, one per level.
+        """
+        return self._color_table
+
+    def table(self, dtype: np.dtype,
+              limits: Tuple[float, float]) -> np.ndarray:
+        """
+        Returns the uint8 levels of every value of 'dtype', indexed by the
+        value's bits read as an unsigned integer, with 'limits' mapped to 0
+        and 255.
+        """
+        dtype = np.dtype(dtype)
+        key = (dtype.str, float(limits[0]), float(limits[1]))
+        with self._lock:
+            table = self._tables.get(key)
+            if table is not None:
+                self._tables.move_to_end(key)
+                return table
+
+        unsigned = np.dtype('u{}'.format(dtype.itemsize))
+        values = np.arange(2 ** (8 * dtype.itemsize), dtype=unsigned)
+        values = values.view(dtype).astype(np.float64)
+        low, high = limits
+        scale = 1 / (high - low) if high > low else 0
+        levels = np.clip((values - low) * scale, 0, 1)
+        if not self.gamma == 1:
+            levels **= 1 / self.gamma
+        table = np.rint(levels * 255).astype(np.uint8)
+
+        with self._lock:
+            self._tables[key] = table
+            while len(self._tables) > self.maxtables:
+                self._tables.popitem(last=False)
+        return table
+
+    def rgb_table(self, dtype: np.dtype,
+                  limits: Tuple[float, float]) -> np.ndarray:
+        """
+        Returns the colormap's RGB values of every value of 'dtype', as an
+        array of shape (values, 3), indexed like table.
+        """
+        key = (np.dtype(dtype).str, float(limits[0]), float(limits[1]),
+               self.gamma)
+        with self._lock:
+            rgb = self._rgb_tables.get(key)
+            if rgb is not None:
+                self._rgb_tables.move_to_end(key)
+                return rgb
+        rgb = self._rgb[self.table(dtype, limits)]
+        with self._lock:
+            self._rgb_tables[key] = rgb
+            while len(self._rgb_tables) > self.maxtables:
+                self._rgb_tables.popitem(last=False)
+        return rgb
+
+    def map(self, array: np.ndarray,
+            limits: Optional[Tuple[float, float]] = None,
+            out: Optional[np.ndarray] = None) -> np.ndarray:
+        """
+        Returns the levels of 'array', of 8 or 16 bit integers, in 'out' if
+        it's given: a uint8 array of the same shape, which is written in its
+        own memory order, so 'array' may be e.g. a transposed frame. If
+        'limits' is None, they're the minimum and maximum of 'array'.
+        """
+        if limits is None:
+            limits = (array.min(), array.max())
+        table = self.table(array.dtype, limits)
+        unsigned = np.dtype('u{}'.format(array.dtype.itemsize))
+        return np.take(table, array.view(unsigned), out=out)
+
+    def is_identity(self, dtype: np.dtype,
+                    limits: Optional[Tuple[float, float]]) -> bool:
+        """
+        Whether uint16 frames shown with 'limits' look the same as a
+        Format_Grayscale16 QImage of the raw pixels.
+        """
+        return (np.dtype(dtype) == np.uint16 and limits is not None and
+                tuple(limits) == (0, 65535) and self.gamma == 1 and
+                self.colormap == 'gray')
+
+    def to_qimage(self, array: np.ndarray,
+                  limits: Optional[Tuple[float, float]] = None,
+                  out: Optional[np.ndarray] = None) -> QImage:
+        """
+        Converts a 2D array of 8 or 16 bit integers to a QImage; see map for
+        'limits' and 'out'.
+
+        The QImage shares the memory of 'out', or of 'array' if it's shown
+        as-is, so it must be copied, e.g. into a QPixmap, before they're
+        reused.
+        """
+        if self.is_identity(array.dtype, limits) and \
+                array.strides[1] == array.itemsize:
+            h, w = array.shape
+            return QImage(array.ctypes.data, w, h, array.strides[0],
+                          QImage.Format_Grayscale16)
+        levels = self.map(array, limits, out)
+        h, w = levels.shape
+        if self.colormap == 'gray':
+            return QImage(levels.ctypes.data, w, h, levels.strides[0],
+                          QImage.Format_Grayscale8)
+        qimage = QImage(levels.ctypes.data, w, h, levels.strides[0],
+                        QImage.Format_Indexed8)
+        qimage.setColorTable(self._color_table)
+        return qimage
@@ -33,10 +33,12 @@ from collections import OrderedDict, namedtuple
 from vladutils.decorators import methdispatch as method_dispatch
 from vladutils.iteration import isiterable
 
-from .models.tree import DraggableTreeModel
+from .models.tree import DraggableTreeModel, LazyHDF5TreeModel
 from .models.table import DroppableListModel, DataFrameModel, ListModel
 from .utils import load_node_from_hdf5
-from .config import DataType, loadUiType, UI_DIR, TEST_DIR, EXTENSIONS
+from .config import (
+    DataType, loadUiType, UI_DIR, TEST_DIR, EXTENSIONS, LAZY_FILE_INSPECTION,
+    CACHE_DIR)
 
 
 Ui_GroupBoxClass, GroupBoxBaseClass = loadUiType(
@@ -154,38 +156,39 @@ class VFileInspectionDialog(DialogBaseClass, Ui_DialogClass):
     #     model = DraggableTreeModel(root, [])
     #     self.file_structure_tree_view.setModel(model)
 
-    def load(self, filename: str, *parameters: FileLoadingParameter):
+    def load(self, filename: str, *parameters: FileLoadingParameter,
+             lazy: bool = False, root: Optional[Node] = None):
         """
         filename : str
             Name of HDF5 file to be inspected.
 
         parameters : NamedTuple
+
+        lazy : bool
+            If True, Groups' contents and Datasets' attributes are read from
+            the file as the user browses it, rather than all at once.
+
+        root : Optional[Node]
+            The file's structure, if it has already been scanned (e.g. on a
+            worker thread) with scan_file. Ignored if 'lazy' is True.
         """
         if splitext(filename)[1] not in EXTENSIONS[DataType.HD5][0]:
             raise TypeError("{} is not an HDF5 file.".format(basename(filename)))
         self.filename = filename
-        self.attributes, self.columns, functions = zip(*parameters)
-
-        # same as
-        # args = [attr for attr, _, func in zip(
-        #   self.attributes, self.columns, functions) if func is None]
-        functions_iter = iter(functions)
-        args = tuple(filter(lambda x: not next(functions_iter),
-                            self.attributes))
-
-        # same as
-        # kwargs = {attr: func for attr, _, func
-        #           in zip(self.attributes, self.columns, functions)
-        #           if func is not None}
-        functions_iter = iter(functions)
-        kwargs = dict(filter(lambda x: next(functions_iter),
-                             zip(self.attributes, functions)))
+        self.attributes, self.columns, _ = zip(*parameters)
+        args, kwargs = _split_parameters(parameters)
 
         # parse the contents of the HDF5 file and populate the
         # file_structure_tree_view (instance of QTreeView) with the info.
-        root = load_node_from_hdf5(filename, *args, **kwargs)
-        self.file_structure_tree_view.setModel(
-            DraggableTreeModel(root, self.attributes))
+        if lazy:
+            tree_model = LazyHDF5TreeModel(
+                filename, self.attributes, args, kwargs)
+        else:
+            if root is None:
+                root = load_node_from_hdf5(
+                    filename, *args, cache_dir=CACHE_DIR, **kwargs)
+            tree_model = DraggableTreeModel(root, self.attributes)
+        self.file_structure_tree_view.setModel(tree_model)
 
         # when a user clicks on items in the QTreeView, their properties -- or
         # at least the properties enumerated in self.columns -- are shown in
@@ -271,44 +274,92 @@ class VFileInspectionDialog(DialogBaseClass, Ui_DialogClass):
         return df.values
 
 
-def _make_dialog_base(filename, dtype):
-    dialog = VFileInspectionDialog(dtype)
+def _split_parameters(parameters: Sequence[FileLoadingParameter]
+                      ) -> Tuple[Tuple[str, ...], Dict[str, Callable]]:
+    """
+    Splits FileLoadingParameters into the *args and **kwargs of
+    load_node_from_hdf5.
+    """
+    attributes, _, functions = zip(*parameters)
 
-    def get_name(dset):
-        """
-        If a dataset's name consists of numbers only, pad the number with
-        zeros. Otherwise, return the name unmodified.
-        """
-        regexp = re.compile(r'[a-zA-Z]+')
-        name = getattr(dset, 'name')
-        name = name.split('/')[-1]
-        if regexp.search(name):
-            return name
-        else:
-            return '{:0>5}'.format(name)
-
-    parameters = [
-        FileLoadingParameter(
-            attr='name',
-            column='Name',
-            function=get_name),
-        FileLoadingParameter(
-            attr='directory',
-            column='Path',
-            function=lambda dset: getattr(dset, 'name')),
-        FileLoadingParameter(
-            attr='shape', column='Shape'),
-        FileLoadingParameter(
-            attr='dtype',
-            column="Type",
-            function=lambda dset: str(getattr(dset, 'dtype')))]
-
-    dialog.load(filename, *parameters)
+    # same as
+    # args = [attr for attr, _, func in zip(
+    #   attributes, columns, functions) if func is None]
+    functions_iter = iter(functions)
+    args = tuple(filter(lambda x: not next(functions_iter), attributes))
+
+    # same as
+    # kwargs = {attr: func for attr, _, func
+    #           in zip(attributes, columns, functions)
+    #           if func is not None}
+    functions_iter = iter(functions)
+    kwargs = dict(filter(lambda x: next(functions_iter),
+                         zip(attributes, functions)))
+    return args, kwargs
+
+
+def _get_name(dset):
+    """
+    If a dataset's name consists of numbers only, pad the number with
+    zeros. Otherwise, return the name unmodified.
+    """
+    regexp = re.compile(r'[a-zA-Z]+')
+    name = getattr(dset, 'name')
+    name = name.split('/')[-1]
+    if regexp.search(name):
+        return name
+    else:
+        return '{:0>5}'.format(name)
+
+
+def _get_directory(dset):
+    return getattr(dset, 'name')
+
+
+def _get_dtype(dset):
+    return str(getattr(dset, 'dtype'))
+
+
+# attributes shown for every Dataset in the VFileInspectionDialog
+PARAMETERS = (
+    FileLoadingParameter(
+        attr='name',
+        column='Name',
+        function=_get_name),
+    FileLoadingParameter(
+        attr='directory',
+        column='Path',
+        function=_get_directory),
+    FileLoadingParameter(
+        attr='shape', column='Shape'),
+    FileLoadingParameter(
+        attr='dtype',
+        column="Type",
+        function=_get_dtype),
+    FileLoadingParameter(
+        attr='chunks', column='Chunks'))
+
+
+def scan_file(filename: str, progress: Optional[Callable] = None) -> Node:
+    """
+    Scans the structure of an HDF5 file for VFileInspectionDialog.load. Safe
+    to call from a worker thread.
+    """
+    args, kwargs = _split_parameters(PARAMETERS)
+    return load_node_from_hdf5(filename, *args, cache_dir=CACHE_DIR,
+                               progress=progress, **kwargs)
+
+
+def _make_dialog_base(filename, dtype, lazy=LAZY_FILE_INSPECTION, root=None):
+    dialog = VFileInspectionDialog(dtype)
+    dialog.load(filename, *PARAMETERS, lazy=lazy, root=root)
     return dialog
 
 
-def make_dialog(filename: str, names: Dict, dtype: DataType) -> QDialog:
-    dialog = _make_dialog_base(filename, dtype)
+def make_dialog(filename: str, names: Dict, dtype: DataType,
+                lazy: bool = LAZY_FILE_INSPECTION,
+                root: Optional[Node] = None) -> QDialog:
+    dialog = _make_dialog_base(filename, dtype, lazy, root)
     for k, v in names.items():
         dialog.add_list_widget(k, v)
     return dialog
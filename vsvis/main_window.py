@@ -26,22 +26,37 @@ from os.path import extsep, join, splitext
 from copy import copy
 # from qtpy import QtCore, QtWidgets, uic
 
-from qtpy.QtCore import Property, Qt, Signal, Slot
+from qtpy.QtCore import Property, Qt, QTimer, Signal, Slot
 from qtpy.QtGui import QIcon, QPixmap
-from qtpy.QtWidgets import QFileDialog, QWidget
+from qtpy.QtWidgets import (
+    QComboBox, QDoubleSpinBox, QFileDialog, QLabel, QPushButton, QSpinBox,
+    QWidget)
 
 from collections import OrderedDict
-from typing import Sequence, Dict, Union
+from typing import Callable, List, Optional, Sequence, Dict, Union
 from vladutils.data_structures import EnumDict
 
-from .file_inspection_dialog import make_dialog
+from .file_inspection_dialog import make_dialog, scan_file
 from .config import (
-    DataType, Shape, EXTENSIONS, FILETYPES, UI_DIR, loadUiType)
-from .datasource import HDF5Request1D, HDF5Request2D, HDF5DataSource
+    DataType, Dimension, Normalization, Projection, Shape, EXTENSIONS,
+    FILETYPES, CACHE_DIR, DEFAULT_COLORMAP, FOLLOW_INTERVAL,
+    FRAME_CACHE_NBYTES, LAZY_FILE_INSPECTION, PLAYBACK_FPS, SWMR_READ,
+    UI_DIR, loadUiType)
+from .cache import FrameCache
+from .chunks import ParallelChunkReader
+from .datasource import (
+    HDF5Request1D, HDF5Request2D, HDF5DataSource, HDF5MultiFileDataSource,
+    image_request)
+from .playback import PlaybackEngine
+from .stats import load_statistics
+from .tiff_datasource import TiffDataSource
 from .models.scene import VGraphicsScene, MarkerFactory
 from .models.table import HDF5TableModel
 from .widgets import VTabWidget, VMarkerOptionsWidget, VErrorMessageBox
 from .controller import Controller
+from .display import COLORMAPS
+from .utils import natural_sort_key
+from .workers import Worker
 
 # TODO: use this same loadUiType function in the rest of the program
 Ui_VMainWindowClass, VMainWindowBaseClass = loadUiType(
@@ -67,10 +82,16 @@ class VMainWindow(VMainWindowBaseClass, Ui_VMainWindowClass):
         return self
 
     def __exit__(self, *args, **kwargs):
+        self.cancel_workers()
+        for worker in list(self._workers):
+            worker.wait()
+        self.playback.shutdown()
         try:
             self.controller.cleanup()
         except AttributeError:
             pass
+        # after the Controller has stopped prefetching
+        self.chunk_reader.shutdown()
 
     def _widget_setup(self):
         self._error_dialog = VErrorMessageBox(self)
@@ -93,8 +114,61 @@ class VMainWindow(VMainWindowBaseClass, Ui_VMainWindowClass):
         scene = VGraphicsScene()
         self.graphics_view.setScene(scene)
 
+        # all datasources share one memory budget for cached frames
+        self.frame_cache = FrameCache(FRAME_CACHE_NBYTES)
+        # and one pool of threads decompressing chunks of large frames
+        self.chunk_reader = ParallelChunkReader()
+
         self.controller = Controller(scene, self.tables_tab_widget, self.marker_options_groupbox)
 
+        # files are opened and scanned by Workers, so that the GUI stays
+        # responsive. their progress is shown in progress_bar.
+        self._workers = set()
+        # Workers that read from the image datasource, e.g. to compute its
+        # statistics, which must stop before it's replaced and closed
+        self._image_workers = set()
+        # position along the Dimensions that aren't projected of the
+        # projection that's shown; see ProjectionEngine.line
+        self._projection_line = None
+        self.cancel_button = QPushButton(self.tr('Cancel'), self)
+        self.cancel_button.setVisible(False)
+        self.statusbar.addPermanentWidget(self.cancel_button)
+        self.progress_bar.setRange(0, 1)
+        self.progress_bar.reset()
+
+        # while following, open files are periodically checked for data
+        # appended by the process writing them
+        self._follow_timer = QTimer(self)
+        self._follow_timer.setInterval(FOLLOW_INTERVAL)
+
+        # movies are played from frames read ahead on worker threads. the
+        # target frame rate is set next to the one achieved, in the status bar
+        self.playback = PlaybackEngine(self.controller.render_frame,
+                                       parent=self)
+        self.fps_label = QLabel(self)
+        self.fps_spinbox = QSpinBox(self)
+        self.fps_spinbox.setRange(1, 240)
+        self.fps_spinbox.setValue(PLAYBACK_FPS)
+        self.fps_spinbox.setSuffix(self.tr(' fps'))
+        self.fps_spinbox.setToolTip(self.tr('Target frame rate of playback'))
+        self.statusbar.addPermanentWidget(self.fps_label)
+        self.statusbar.addPermanentWidget(self.fps_spinbox)
+
+        # gamma and colormap of the displayed frames
+        self.gamma_spinbox = QDoubleSpinBox(self)
+        self.gamma_spinbox.setRange(0.1, 5)
+        self.gamma_spinbox.setSingleStep(0.1)
+        self.gamma_spinbox.setValue(self.controller.lut.gamma)
+        self.gamma_spinbox.setPrefix(self.tr('gamma '))
+        self.gamma_spinbox.setToolTip(self.tr('Gamma of the displayed image'))
+        self.colormap_combobox = QComboBox(self)
+        self.colormap_combobox.addItems(sorted(COLORMAPS))
+        self.colormap_combobox.setCurrentText(DEFAULT_COLORMAP)
+        self.colormap_combobox.setToolTip(
+            self.tr('Colormap of the displayed image'))
+        self.statusbar.addPermanentWidget(self.gamma_spinbox)
+        self.statusbar.addPermanentWidget(self.colormap_combobox)
+
     def _signals_setup(self) -> None:
         self.action_open_ground_truth.triggered.connect(
             lambda: self.open(DataType.GROUND_TRUTH))
@@ -105,23 +179,79 @@ class VMainWindow(VMainWindowBaseClass, Ui_VMainWindowClass):
 
         self.graphics_view_scrollbar.value_changed[int].connect(
             self.controller.set_index)
+        # the navigator moves the scrollbar, which sets the Controller's index
+        self.dimension_navigator.position_changed[object].connect(
+            self._navigate)
+        self.graphics_view_scrollbar.value_changed[int].connect(
+            self._update_navigator)
+        self.graphics_view_scrollbar.value_changed[int].connect(
+            self._update_projection)
+
+        self.cancel_button.clicked.connect(self.cancel_workers)
+
+        # a click on a marker selects its row in the table
+        self.graphics_view.clicked['QPointF', float].connect(
+            self.controller.pick_marker)
+
+        # show downsampled frames while zoomed out
+        self.graphics_view.level_changed[int].connect(
+            self.controller.set_image_level)
+
+        self.action_follow.toggled[bool].connect(self.follow)
+        self.action_stack_contrast.toggled[bool].connect(
+            self.set_stack_contrast)
+        self.action_composite.toggled[bool].connect(
+            self.controller.set_composite)
+        self._projection_actions = {
+            self.action_max_projection: Projection.MAX,
+            self.action_mean_projection: Projection.MEAN,
+            self.action_std_projection: Projection.STD}
+        for action, kind in self._projection_actions.items():
+            action.toggled[bool].connect(
+                lambda checked, kind=kind: self._toggle_projection(
+                    kind, checked))
+        self._follow_timer.timeout.connect(self.refresh)
+
+        self.gamma_spinbox.valueChanged[float].connect(
+            self.controller.set_gamma)
+        self.colormap_combobox.currentTextChanged[str].connect(
+            self.controller.set_colormap)
+
+        self.action_play.toggled[bool].connect(self.play)
+        self.fps_spinbox.valueChanged[int].connect(self.playback.set_fps)
+        self.playback.playing_changed[bool].connect(self._playing_changed)
+        self.playback.frame_ready[int, object].connect(
+            self._show_playback_frame)
+        self.playback.fps_changed[float, float].connect(self._show_fps)
+        self.playback.failed[str, str].connect(self._show_worker_error)
+        # playback frames move the scrollbar with its signals blocked, so
+        # the user scrolling pauses playback
+        self.graphics_view_scrollbar.value_changed[int].connect(
+            lambda index: self.playback.pause())
 
         self.file_loaded[object].connect(self.marker_options_groupbox.enable)
         self.file_loaded[object].connect(
             lambda d: self.menu_open_data.setEnabled(True) if d & DataType.IMAGE else None)
 
-    def _parse_filename(self, filelist: Sequence[str], dtype: DataType) -> str:
+    def _parse_filename(self, filelist: Sequence[str], dtype: DataType
+                        ) -> Union[str, List[str]]:
         """
         Checks for errors in the list of filenames, i.e if list is empty, or if
         list has more than one filename. If the list passes the checks, we
-        proceed to load the file. For now, we reject TIFF files because loading
-        TIFF images is not implemented.
+        proceed to load the file. TIFF files may only hold image data.
+
+        Several HDF5 image files may be selected, in which case they're
+        returned as a list sorted by the numbers in their names, to be loaded
+        as one stack of frames.
         """
         def create_error_dialog(message):
             self._error_dialog.message = message
             self._error_dialog.exec_()
 
         if len(filelist) > 1:
+            if dtype & DataType.IMAGE and \
+                    not any(self._is_tiff(f) for f in filelist):
+                return sorted(filelist, key=natural_sort_key)
             return create_error_dialog(
                 '{} files were selected '.format(len(filelist)) +
                 'but we can only load one file at a time.')
@@ -129,16 +259,18 @@ class VMainWindow(VMainWindowBaseClass, Ui_VMainWindowClass):
             return create_error_dialog('No files were selected.')
         else:
             filename = filelist[0]
-        # temporary to reject loaded tif images because loading them
-        # hasn't been implemented yet
         print('***parsing filename***')
-        filename_ext = splitext(filename)[-1]
-        if filename_ext in EXTENSIONS[DataType.TIFF_IMAGE][0]:
-            create_error_dialog('tiff files not yet supported.')
+        if self._is_tiff(filename) and not dtype & DataType.IMAGE:
+            create_error_dialog('tiff files may only contain image data.')
             return ''
         else:
             return filename
 
+    @staticmethod
+    def _is_tiff(filename: str) -> bool:
+        filename_ext = splitext(filename)[-1].lower()
+        return filename_ext in EXTENSIONS[DataType.TIFF_IMAGE][0]
+
     def open(self, dtype: DataType) -> None:
         """
         Opens a QDialog in which the user selects an HDF5 or TIFF file.
@@ -153,6 +285,11 @@ class VMainWindow(VMainWindowBaseClass, Ui_VMainWindowClass):
         # example filter_ string:
         # Tiff Files (*.tif, *.tiff, *.ome.tif);;HDF5 Files (*.h5, *.hdf5, *.hf5, *.hd5)
         self._file_dialog.setNameFilter(filter_)
+        # images may be split across several HDF5 files
+        if dtype & DataType.IMAGE:
+            self._file_dialog.setFileMode(QFileDialog.ExistingFiles)
+        else:
+            self._file_dialog.setFileMode(QFileDialog.ExistingFile)
         # closing the QDialog returns an enum, either "Accepted" or "Rejected"
         # depending on whether the "Ok" or "Cancel" button was pressed,
         # respectively
@@ -160,10 +297,17 @@ class VMainWindow(VMainWindowBaseClass, Ui_VMainWindowClass):
         if result == QFileDialog.Accepted:
             filename = self._parse_filename(
                 self._file_dialog.selectedFiles(), dtype)
-            if filename:
+            if isinstance(filename, list):
+                # the Datasets picked in the first file are loaded from all
+                self.open_inspection_widget(filename, dtype)
+            elif filename and self._is_tiff(filename):
+                # TIFF pages are images, so there's nothing to inspect
+                self.load(filename, DataType.TIFF_IMAGE, None)
+            elif filename:
                 self.open_inspection_widget(filename, dtype)
 
-    def open_inspection_widget(self, filename: str, dtype: DataType):
+    def open_inspection_widget(self, filename: Union[str, List[str]],
+                               dtype: DataType):
         list_widget_columns = ['name', 'directory']
         ground_truth_titles = OrderedDict(
             [('Ground Truth Coordinates', list_widget_columns)])
@@ -179,28 +323,322 @@ class VMainWindow(VMainWindowBaseClass, Ui_VMainWindowClass):
             (DataType.HDF_IMAGE, image_titles)])
 
         args = list_widget_args[dtype][0]
-        dialog = make_dialog(filename, args, dtype)
+        if LAZY_FILE_INSPECTION:
+            # the dialog reads the file as the user browses it
+            self._exec_inspection_dialog(filename, dtype, args, None)
+        else:
+            self.start_worker(
+                lambda root: self._exec_inspection_dialog(
+                    filename, dtype, args, root),
+                scan_file, self._first_filename(filename))
+
+    @staticmethod
+    def _first_filename(filename: Union[str, List[str]]) -> str:
+        return filename[0] if isinstance(filename, list) else filename
+
+    def _exec_inspection_dialog(self, filename: Union[str, List[str]],
+                                dtype: DataType, names: Dict, root):
+        dialog = make_dialog(
+            self._first_filename(filename), names, dtype, root=root)
         result = dialog.exec_()
         if result == QFileDialog.Accepted:
             self.load(filename, dtype, dialog.get_data('directory'))
 
-    def load(self, filename: str, dtype: DataType, handles: DataFrame):
-        if dtype & DataType.HDF_IMAGE:
-            req = HDF5Request1D(filename, handles, axis=0)
-            self.graphics_view_scrollbar.setEnabled(True)
+    def load(self, filename: Union[str, List[str]], dtype: DataType,
+             handles: DataFrame) -> Worker:
+        """
+        Opens the file on a worker thread. file_loaded is emitted once the
+        datasource is ready and has been handed to the Controller.
+
+        If 'filename' is a list of HDF5 files, the image Datasets in
+        'handles' are loaded from each file and stacked.
+        """
+        return self.start_worker(
+            self._set_datasource, self._create_datasource,
+            filename, dtype, handles, self.frame_cache, self.chunk_reader)
+
+    @staticmethod
+    def _create_datasource(filename: Union[str, List[str]], dtype: DataType,
+                           handles: DataFrame, frame_cache: FrameCache,
+                           chunk_reader: ParallelChunkReader,
+                           progress: Callable):
+        """
+        Opens a datasource and reads what's needed to display it. Runs on a
+        worker thread, so it mustn't touch any widgets.
+        """
+        if dtype == DataType.TIFF_IMAGE:
+            source = TiffDataSource(filename, frame_cache)
+            # the Controller displays whichever image source is loaded
+            dtype = DataType.IMAGE
+        elif isinstance(filename, list) and dtype & DataType.HDF_IMAGE:
+            source = HDF5MultiFileDataSource(
+                filename, np.concatenate(handles), 0, frame_cache,
+                progress=progress, swmr=SWMR_READ)
+        elif dtype & DataType.HDF_IMAGE:
+            req = image_request(filename, handles, SWMR_READ)
+            source = HDF5DataSource(
+                filename, req, frame_cache, swmr=SWMR_READ,
+                chunk_reader=chunk_reader)
         elif dtype & DataType.DATA:
             req = HDF5Request2D(filename, handles)
+            source = HDF5DataSource(
+                filename, req, frame_cache, swmr=SWMR_READ)
         else:
             raise NotImplementedError('Loading {} not yet implemented.'.format(dtype))
 
-        print(filename)
-        print(dtype)
-        print(handles)
-        source = HDF5DataSource(filename, req)
+        try:
+            if dtype & DataType.IMAGE:
+                progress(0, 0)
+                # the first frame is shown as soon as the source is set
+                source.request(0)
+            else:
+                source.load_coordinates(progress)
+            progress(1, 1)
+        except BaseException:
+            source.cleanup()
+            raise
+        return source, dtype
+
+    def _set_datasource(self, result):
+        source, dtype = result
+        # frames may still be read from the datasource that's replaced
+        self.playback.stop()
+        if dtype & DataType.IMAGE:
+            for worker in list(self._image_workers):
+                worker.cancel()
+                worker.wait()
         self.controller.set_datasource(source, dtype)
+        if dtype & DataType.IMAGE:
+            self.graphics_view_scrollbar.setEnabled(True)
+            self._set_navigator(source)
+            self.index_statistics(source)
+            self._uncheck_projections()
         self.graphics_view_scrollbar.setMaximum(len(source) - 1)
         self.file_loaded.emit(dtype)
 
+    def _set_navigator(self, source):
+        """
+        Navigates an image stack with several Dimensions with one scrollbar
+        per Dimension, and other stacks with graphics_view_scrollbar.
+        """
+        frame_index = getattr(source, 'frame_index', None)
+        if frame_index is None:
+            self.dimension_navigator.clear()
+        else:
+            self.dimension_navigator.set_dimensions(
+                frame_index.dimensions, frame_index.shape)
+        self.graphics_view_scrollbar.setVisible(frame_index is None)
+
+    def _frame_index(self):
+        source = self.controller.datasources.get(DataType.IMAGE)
+        return getattr(source, 'frame_index', None)
+
+    @Slot(object)
+    def _navigate(self, position):
+        frame_index = self._frame_index()
+        if frame_index is not None:
+            self.graphics_view_scrollbar.setValue(frame_index.index(position))
+
+    @Slot(int)
+    def _update_navigator(self, index: int):
+        frame_index = self._frame_index()
+        if frame_index is not None:
+            self.dimension_navigator.set_position(frame_index.position(index))
+
+    def index_statistics(self, source) -> Worker:
+        """
+        Computes the intensity statistics of an image datasource on a worker
+        thread, or reads them from their sidecar file, and hands them to the
+        Controller for rescaling frames.
+        """
+        def finished(stats):
+            # the datasource may have been replaced in the meantime
+            if self.controller.datasources.get(DataType.IMAGE) is source:
+                self.controller.set_statistics(stats)
+        worker = self.start_worker(
+            finished, load_statistics, source, CACHE_DIR)
+        self._image_workers.add(worker)
+        return worker
+
+    def show_projection(self, kind: Optional[Projection]) -> Optional[Worker]:
+        """
+        Shows the projection 'kind' of the image stack in place of its
+        frames, computing it on a worker thread unless it's been computed
+        before; or the frames again if 'kind' is None.
+        """
+        engine = self.controller.projections
+        if kind is None or engine is None:
+            self._projection_line = None
+            self.controller.set_projection(None)
+            return None
+
+        index = self.controller.current_index
+        line = self._projection_line = engine.line(index)
+
+        def finished(projection):
+            # another projection, datasource or position along the
+            # Dimensions that aren't projected may have been chosen since
+            if self.controller.projections is engine and \
+                    self._checked_projection() == kind and \
+                    self._projection_line == line:
+                self.controller.set_projection(projection)
+        worker = self.start_worker(
+            finished, engine.project, kind, index=index)
+        self._image_workers.add(worker)
+        return worker
+
+    @Slot(int)
+    def _update_projection(self, index: int):
+        # stacks with several Dimensions have one projection per position
+        # along the Dimensions that aren't projected, e.g. per channel
+        kind = self._checked_projection()
+        engine = self.controller.projections
+        if kind is not None and engine is not None and \
+                not engine.line(index) == self._projection_line:
+            self.show_projection(kind)
+
+    def _checked_projection(self) -> Optional[Projection]:
+        for action, kind in self._projection_actions.items():
+            if action.isChecked():
+                return kind
+        return None
+
+    def _toggle_projection(self, kind: Projection, checked: bool):
+        # at most one projection is checked, but none needs to be
+        if checked:
+            self._uncheck_projections(kind)
+            self.show_projection(kind)
+        elif self._checked_projection() is None:
+            self.show_projection(None)
+
+    def _uncheck_projections(self, keep: Optional[Projection] = None):
+        for action, kind in self._projection_actions.items():
+            if not kind == keep:
+                action.blockSignals(True)
+                action.setChecked(False)
+                action.blockSignals(False)
+
+    @Slot(bool)
+    def set_stack_contrast(self, enable: bool):
+        """
+        Switches between rescaling each frame to its own intensity range and
+        to that of the whole stack.
+        """
+        self.controller.set_normalization(
+            Normalization.STACK if enable else Normalization.FRAME)
+
+    @Slot(bool)
+    def follow(self, enable: bool):
+        """
+        Starts or stops periodically showing data appended to the open files.
+        """
+        if enable:
+            self._follow_timer.start()
+        else:
+            self._follow_timer.stop()
+
+    @Slot(bool)
+    def play(self, enable: bool):
+        """
+        Starts playing the image stack from the current frame, or pauses it.
+        Stacks with several Dimensions are played along T, at the current
+        position along the others.
+        """
+        source = self.controller.datasources.get(DataType.IMAGE)
+        frame_index = self._frame_index()
+        index = self.graphics_view_scrollbar.value()
+        if enable and frame_index is not None:
+            dimension = Dimension.T
+            if dimension not in frame_index.dimensions:
+                dimension = frame_index.dimensions[0]
+            axis = frame_index.axis_of(dimension)
+            self.playback.play(
+                frame_index.position(index)[axis], 0,
+                frames=frame_index.frames_along(index, dimension))
+        elif enable and source is not None:
+            self.playback.play(index, len(source))
+        else:
+            self.playback.pause()
+        # e.g. there was only one frame to play
+        self._playing_changed(self.playback.playing)
+
+    @Slot(bool)
+    def _playing_changed(self, playing: bool):
+        self.action_play.blockSignals(True)
+        self.action_play.setChecked(playing)
+        self.action_play.blockSignals(False)
+        if not playing:
+            self.fps_label.clear()
+
+    @Slot(int, object)
+    def _show_playback_frame(self, index: int, image):
+        scrollbar = self.graphics_view_scrollbar
+        scrollbar.blockSignals(True)
+        scrollbar.setValue(index)
+        scrollbar.blockSignals(False)
+        self._update_navigator(index)
+        self.controller.show_frame(index, image)
+
+    @Slot(float, float)
+    def _show_fps(self, achieved: float, target: float):
+        self.fps_label.setText(
+            self.tr('{:.1f} / {:.0f} fps').format(achieved, target))
+
+    @Slot()
+    def refresh(self):
+        """
+        Shows data appended to the open files, and extends the scrollbar to
+        any new frames.
+        """
+        self.controller.refresh()
+        source = self.controller.datasources.get(DataType.IMAGE)
+        if source is not None:
+            self.graphics_view_scrollbar.setMaximum(len(source) - 1)
+
+    def start_worker(self, on_finished: Callable, function: Callable,
+                     *args, **kwargs) -> Worker:
+        """
+        Runs 'function' on a Worker, showing its progress in progress_bar.
+        'on_finished' is called with its result on the GUI thread.
+        """
+        worker = Worker(function, *args, **kwargs)
+        worker.progress.connect(self._show_progress)
+        worker.finished.connect(on_finished)
+        worker.failed.connect(self._show_worker_error)
+        worker.done.connect(lambda: self._worker_done(worker))
+        self._workers.add(worker)
+        self.cancel_button.setVisible(True)
+        worker.start()
+        return worker
+
+    @Slot()
+    def cancel_workers(self):
+        for worker in self._workers:
+            worker.cancel()
+
+    @Slot(int, int)
+    def _show_progress(self, done: int, total: int):
+        # a range of (0, 0) shows a busy indicator
+        self.progress_bar.setRange(0, total)
+        self.progress_bar.setValue(done)
+
+    @Slot(str, str)
+    def _show_worker_error(self, message: str, detailed: str):
+        self._error_dialog.setInformativeText(message)
+        self._error_dialog.set_traceback(detailed)
+        self._error_dialog.exec_()
+
+    def _worker_done(self, worker: Worker):
+        # the thread has been told to quit; wait for it so that it's not
+        # destroyed while still running
+        worker.wait()
+        self._workers.discard(worker)
+        self._image_workers.discard(worker)
+        if not self._workers:
+            self.cancel_button.setVisible(False)
+            self.progress_bar.setRange(0, 1)
+            self.progress_bar.reset()
+
     @Slot()
     def save(self):
         pass
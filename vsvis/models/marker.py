@@ -18,8 +18,9 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import numpy as np
 from abc import abstractmethod
-from typing import Any, Optional, Union
+from typing import Any, Iterable, Optional, Union
 from functools import partialmethod
 from qtpy.QtCore import QObject, QPointF, QRectF, Qt, Property
 from qtpy.QtGui import QBrush, QColor, QPen, QPainter, QPolygonF
@@ -29,6 +30,7 @@ from qtpy.QtWidgets import (
 from vladutils.data_structures import EnumDict
 
 from ..config import Shape
+from ..spatial import GridIndex
 
 
 class Marker(object):
@@ -229,6 +231,259 @@ class TunableMarker(QGraphicsItem):
         self.update()
 
 
+def array2polygon(points: np.ndarray) -> QPolygonF:
+    """
+    Converts an (n, 2) array of x, y coordinates to a QPolygonF, by writing
+    them into its memory rather than creating a QPointF per point.
+    """
+    polygon = QPolygonF()
+    polygon.fill(QPointF(), len(points))
+    if len(points):
+        buffer = polygon.data()
+        buffer.setsize(len(points) * 2 * np.dtype(np.float64).itemsize)
+        np.frombuffer(buffer, np.float64).reshape(-1, 2)[:] = points
+    return polygon
+
+
+class MarkerLayer(QGraphicsItem):
+    """
+    Draws all the markers of one frame, e.g. its predicted coordinates, as a
+    single QGraphicsItem. Their coordinates, visibility, colors and sizes
+    are held in arrays with one element per marker, rather than in one
+    QGraphicsItem each, so that creating, showing and restyling tens of
+    thousands of markers costs a few array operations.
+
+    Visible filled markers of the same color and size are drawn with one
+    QPainter.drawPoints call: circles as the points of a round pen, and
+    diamonds as those of a square pen, drawn rotated by 45 degrees. Outlined
+    markers of the same color and size are drawn with one
+    QPainter.drawLines call, circles as polygons with sides a few pixels
+    long at the current zoom.
+
+    The markers are indexed by a GridIndex when the layer is created, so
+    that only the markers in the exposed rectangle are considered for
+    painting, and the marker under a position is found with pick.
+
+    Parameters
+    ------------
+    coordinates : np.ndarray
+        (n, 2) array of the x, y coordinates of the markers' centers.
+
+    shape : Shape
+    color : Union[QColor, int]
+    size : float
+    filled : bool
+        Style of all the markers; see MarkerFactory.
+
+    key : int
+        Index of the frame, in the parent VGraphicsGroup.
+    """
+    outline_width = 0.25
+    # approximate length, in pixels, of the sides of outlined circles
+    outline_segment = 4
+
+    def __init__(self, coordinates: np.ndarray, shape: Shape = Shape.CIRCLE,
+                 color: Union[QColor, int] = Qt.red, size: float = 3,
+                 filled: bool = True, key: Optional[int] = None):
+        super().__init__()
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+        self.key = key
+        self.positions = np.array(coordinates, np.float64).reshape(-1, 2)
+        self.index = GridIndex(self.positions)
+        n = len(self.positions)
+        self.visible = np.zeros(n, bool)
+        # QRgb values
+        self.colors = np.empty(n, np.uint32)
+        self.sizes = np.empty(n, np.float32)
+        self._shape = shape
+        self._filled = filled
+        self._rect = QRectF()
+        self.set_marker_color(color)
+        self.set_marker_size(size)
+
+    def __len__(self):
+        return len(self.positions)
+
+    def keys(self):
+        return list(range(len(self)))
+
+    def boundingRect(self) -> QRectF:
+        return self._rect
+
+    def _update_rect(self):
+        self.prepareGeometryChange()
+        if not len(self):
+            self._rect = QRectF()
+            return
+        margin = self.sizes.max() / 2 + self.outline_width
+        (x0, y0), (x1, y1) = self.positions.min(0), self.positions.max(0)
+        self._rect = QRectF(x0 - margin, y0 - margin,
+                            x1 - x0 + 2 * margin, y1 - y0 + 2 * margin)
+
+    def set_visible(self, visible: bool,
+                    indices: Union[int, slice, Iterable[int]] = slice(None)):
+        """
+        Shows or hides the markers at 'indices'.
+        """
+        if not isinstance(indices, (int, slice)):
+            indices = np.fromiter(indices, np.intp)
+        self.visible[indices] = visible
+        self.update()
+
+    def visible_indices(self, rect: Optional[QRectF] = None) -> np.ndarray:
+        """
+        Returns the indices of the visible markers, or of those that overlap
+        'rect' if it's given, in ascending order.
+        """
+        if rect is None or rect.isNull():
+            return np.flatnonzero(self.visible)
+        if not len(self):
+            return np.empty(0, np.intp)
+        margin = self.sizes.max() / 2 + self.outline_width
+        indices = self.index.query_rect(
+            rect.left() - margin, rect.top() - margin,
+            rect.right() + margin, rect.bottom() + margin)
+        return indices[self.visible[indices]]
+
+    def pick(self, x: float, y: float,
+             tolerance: float = 0) -> Optional[int]:
+        """
+        Returns the index of the visible marker nearest to (x, y), if (x, y)
+        is within 'tolerance' of its outline. Hidden markers can't be
+        picked, so that clicking where none are shown picks nothing.
+        """
+        if not len(self):
+            return None
+        radius = self.sizes.max() / 2 + tolerance
+        i = self.index.nearest(x, y, radius, self.visible)
+        if i is None:
+            return None
+        distance = np.hypot(*(self.positions[i] - (x, y)))
+        return i if distance <= self.sizes[i] / 2 + tolerance else None
+
+    def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem,
+              widget: QWidget):
+        # markers entirely outside the exposed area are skipped
+        indices = self.visible_indices(option.exposedRect)
+        if not len(indices):
+            return
+
+        # one batch per combination of color and size
+        styles = self.colors[indices].astype(np.uint64) << 32 | \
+            self.sizes[indices].view(np.uint32)
+        keys, inverse = np.unique(styles, return_inverse=True)
+        for i, key in enumerate(keys):
+            batch = indices[inverse == i]
+            color = QColor.fromRgba(int(self.colors[batch[0]]))
+            size = float(self.sizes[batch[0]])
+            if self._filled:
+                self._paint_points(painter, self.positions[batch], color, size)
+            else:
+                self._paint_outlines(
+                    painter, self.positions[batch], color, size)
+
+    def _paint_points(self, painter: QPainter, positions: np.ndarray,
+                      color: QColor, size: float):
+        pen = QPen(color)
+        painter.save()
+        if self._shape == Shape.DIAMOND:
+            # squares whose diagonal is 'size', in a frame rotated by 45
+            # degrees; the positions are rotated back into it
+            pen.setWidthF(size / np.sqrt(2))
+            pen.setCapStyle(Qt.SquareCap)
+            painter.rotate(45)
+            c = np.sqrt(0.5)
+            positions = positions @ np.array([[c, -c], [c, c]])
+        else:
+            pen.setWidthF(size)
+            pen.setCapStyle(Qt.RoundCap)
+        painter.setPen(pen)
+        painter.drawPoints(array2polygon(positions))
+        painter.restore()
+
+    def _outline(self, size: float, scale: float) -> np.ndarray:
+        """
+        Returns the (k, 2) vertices of the outline of a marker of 'size'
+        centered on the origin: a diamond's 4 corners, or a circle's as a
+        polygon whose sides are about 'outline_segment' pixels long when
+        drawn at 'scale' pixels per unit.
+        """
+        r = size / 2
+        if self._shape == Shape.DIAMOND:
+            k = 4
+        else:
+            k = int(np.clip(np.ceil(np.pi * size * scale /
+                                    self.outline_segment), 8, 64))
+        angles = np.linspace(0, 2 * np.pi, k, endpoint=False)
+        return r * np.column_stack([np.sin(angles), np.cos(angles)])
+
+    def _paint_outlines(self, painter: QPainter, positions: np.ndarray,
+                        color: QColor, size: float):
+        # the sides of all the outlines, as pairs of points, in one
+        # QPainter.drawLines call
+        scale = np.sqrt(abs(painter.worldTransform().determinant()))
+        vertices = self._outline(size, scale)
+        sides = np.stack([vertices, np.roll(vertices, -1, 0)], 1)
+        lines = positions[:, None, None, :] + sides[None]
+        pen = QPen(color)
+        pen.setWidthF(self.outline_width)
+        painter.save()
+        painter.setPen(pen)
+        painter.drawLines(array2polygon(lines.reshape(-1, 2)))
+        painter.restore()
+
+    def get_marker_color(self) -> QColor:
+        """
+        Color that the markers were last set to.
+        """
+        return QColor(self._color)
+
+    def set_marker_color(self, color: Union[QColor, int],
+                         indices: Union[int, slice, Iterable[int]] = slice(
+                             None)):
+        color = QColor(color)
+        if isinstance(indices, slice) and indices == slice(None):
+            self._color = color
+        elif not isinstance(indices, int):
+            indices = np.fromiter(indices, np.intp)
+        self.colors[indices] = color.rgba()
+        self.update()
+
+    def get_marker_fill(self) -> bool:
+        """
+        Whether the markers are filled in or merely outlined.
+        """
+        return self._filled
+
+    def set_marker_fill(self, f: bool):
+        self._filled = bool(f)
+        self.update()
+
+    def get_marker_shape(self) -> Shape:
+        return self._shape
+
+    def set_marker_shape(self, shape: Shape):
+        self._shape = shape
+        self.update()
+
+    def get_marker_size(self) -> float:
+        """
+        Size that the markers were last set to.
+        """
+        return self._size
+
+    def set_marker_size(self, size: float,
+                        indices: Union[int, slice, Iterable[int]] = slice(
+                            None)):
+        if isinstance(indices, slice) and indices == slice(None):
+            self._size = size
+        elif not isinstance(indices, int):
+            indices = np.fromiter(indices, np.intp)
+        self.sizes[indices] = size
+        self._update_rect()
+        self.update()
+
+
 class MarkerFactory(QObject):
     """
     Parameters
@@ -314,3 +569,13 @@ class MarkerFactory(QObject):
         # marker.setPen(self._pen)
         marker.setPos(x, y)
         return marker
+
+    def layer(self, coordinates: np.ndarray,
+              key: Optional[int] = None) -> MarkerLayer:
+        """
+        Create a MarkerLayer of markers at 'coordinates', an (n, 2) array of
+        x, y coordinates, with the properties specified by this Factory. The
+        markers are hidden.
+        """
+        return MarkerLayer(coordinates, self._shape, self.get_marker_color(),
+                           self._size, self.get_marker_fill(), key)
@@ -18,20 +18,29 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import sys
 import numpy as np
 from copy import deepcopy
-from qtpy.QtCore import QObject, Qt, Property, Signal
-from qtpy.QtGui import QColor, QImage, QPixmap
-from qtpy.QtWidgets import QGraphicsItem, QGraphicsItemGroup, QGraphicsScene
+from math import ceil, sqrt
+from qtpy.QtCore import QObject, QPointF, QRectF, Qt, Property, Signal, Slot
+from qtpy.QtGui import QColor, QImage, QPainter, QPixmap
+from qtpy.QtWidgets import (
+    QGraphicsItem, QGraphicsItemGroup, QGraphicsObject, QGraphicsScene,
+    QStyleOptionGraphicsItem, QWidget)
 from itertools import repeat
 from functools import partialmethod, reduce
 from collections import OrderedDict
-from typing import Generator, Iterable, List, Optional, Sequence, TypeVar, Union
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import (Callable, Dict, Generator, Iterable, List, Optional,
+                    Sequence, Tuple, TypeVar, Union)
 from vladutils.data_structures import EnumDict
 from vladutils.iteration import isiterable
 
-from .marker import Marker, MarkerFactory
-from ..config import DataType, MarkerVisible, DATATYPES
+from .marker import Marker, MarkerFactory, MarkerLayer
+from ..cache import FrameBufferPool
+from ..display import DisplayLUT
+from ..config import (DataType, MarkerVisible, DATATYPES, PYRAMID_MAX_LEVEL,
+                      TILE_CACHE_SIZE, TILE_SIZE, TILE_WORKERS)
 
 VGroupType = TypeVar('VGroupType', bound='VGraphicsGroup')
 VSceneType = TypeVar('VSceneType', bound='VSceneType')
@@ -74,6 +83,8 @@ class VGraphicsGroup(QGraphicsItemGroup):
         if isinstance(index, int):
             return self._child_items[index]
         elif isinstance(index, slice):
+            if not self._child_items:
+                return []
             start, stop, step = index.indices(max(self._child_items) + 1)
             keys = set(range(start, stop, step))
             keys.intersection_update(self._child_items)
@@ -193,8 +204,8 @@ class VGraphicsGroup(QGraphicsItemGroup):
         for group in subgroups:
             group.clear()
 
-        markers = (m for m in self._child_items.values()
-                   if isinstance(m, Marker))
+        markers = [m for m in self._child_items.values()
+                   if not isinstance(m, VGraphicsGroup)]
         if markers:
             scene = self.scene()
             for m in markers:
@@ -249,6 +260,205 @@ class VGraphicsGroup(QGraphicsItemGroup):
     get_marker_shape = partialmethod(_get_marker_property, 'get_marker_shape')
 
 
+class VTiledImageItem(QGraphicsObject):
+    """
+    Draws a frame that's too large to convert into a single QPixmap, e.g. a
+    mosaic, in square tiles. Only tiles that intersect the exposed part of
+    the item are read from the datasource, with its 'request_region'
+    method, and converted; the most recently drawn tiles are cached, so
+    panning only loads newly exposed tiles.
+
+    Tiles are read and converted on worker threads, so that painting never
+    waits for the file. Tiles that are still loading are left empty, and
+    the item repaints them as they arrive.
+
+    Like the frames in VGraphicsScene.pixmap, frames of shape (..., x, y)
+    are drawn transposed, with x along the horizontal axis.
+
+    Parameters
+    ------------
+    tile_size : int
+        Width and height of the tiles, in pixels.
+
+    max_tiles : int
+        Number of converted tiles that are cached.
+
+    max_workers : int
+        Number of threads that load tiles.
+
+    Unless display limits are passed to set_frame, the tiles of a frame are
+    rescaled to the minimum and maximum of a subsample of the whole frame
+    of about one tile's size, which is read before its first tile.
+    """
+    tile_loaded = Signal(int, object, object)
+
+    def __init__(self, tile_size: int = TILE_SIZE,
+                 max_tiles: int = TILE_CACHE_SIZE,
+                 max_workers: int = TILE_WORKERS,
+                 parent: Optional[QGraphicsItem] = None):
+        super().__init__(parent)
+        self.setFlag(QGraphicsItem.ItemUsesExtendedStyleOption)
+        self.tile_size = tile_size
+        self.max_tiles = max_tiles
+        self.source = None
+        self.index = 0
+        self._size = (0, 0)
+        self._tiles = OrderedDict()
+        self._limits = dict()
+        # see VGraphicsScene.array2pixmap
+        self.lut: Optional[DisplayLUT] = None
+        # tiles being loaded, and loads that can't be cancelled any more;
+        # results of loads started before the last call to clear or
+        # invalidate are dropped
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._pending: Dict[Tuple[int, int, int], Future] = dict()
+        self._started: List[Future] = []
+        self._generation = 0
+        self.tile_loaded.connect(self._tile_loaded)
+        # number of tiles read from the datasource
+        self.loads = 0
+
+    def __len__(self):
+        return len(self._tiles)
+
+    def set_frame(self, source, index: int, shape: Tuple[int, ...],
+                  limits: Optional[Tuple[float, float]] = None):
+        """
+        Shows frame 'index' of 'source', whose shape is 'shape'. If
+        'limits' are given, the tiles are rescaled to them; see
+        VGraphicsScene.rescale_array.
+        """
+        if source is not self.source:
+            self.clear()
+            self.source = source
+        if limits is not None and not limits == self._limits.get(index):
+            self.invalidate([index])
+            self._limits[index] = limits
+        size = (shape[-2], shape[-1])
+        if not size == self._size:
+            self.prepareGeometryChange()
+            self._size = size
+        self.index = index
+        self.update()
+
+    def invalidate(self, indices: Iterable[int]):
+        """
+        Drops the tiles of frames that changed, e.g. in a file that's being
+        followed.
+        """
+        indices = set(int(i) for i in indices)
+        self.cancel()
+        for key in [k for k in self._tiles if k[0] in indices]:
+            del self._tiles[key]
+        for index in indices:
+            self._limits.pop(index, None)
+        if self.index in indices:
+            self.update()
+
+    def clear(self):
+        self.cancel()
+        self._tiles.clear()
+        self._limits.clear()
+
+    def cancel(self, wait_started: bool = False):
+        """
+        Cancels loads of tiles that haven't started yet, and drops the
+        results of those that have. If 'wait_started', also waits for the
+        latter, e.g. before the datasource that they read from is closed.
+        """
+        self._generation += 1
+        for future in self._pending.values():
+            if not (future.cancel() or future.done()):
+                self._started.append(future)
+        self._pending.clear()
+        if wait_started:
+            wait(self._started)
+        self._started = [f for f in self._started if not f.done()]
+
+    def shutdown(self):
+        self.cancel(wait_started=True)
+        self._executor.shutdown(wait=True)
+
+    def boundingRect(self) -> QRectF:
+        return QRectF(0, 0, *self._size)
+
+    def tiles_in(self, rect: QRectF) -> List[Tuple[int, int]]:
+        """
+        Returns the (column, row) positions of the tiles that intersect
+        'rect', in item coordinates.
+        """
+        rect = rect.intersected(self.boundingRect())
+        if rect.isEmpty():
+            return []
+        t = self.tile_size
+        columns = range(int(rect.left()) // t, ceil(rect.right() / t))
+        rows = range(int(rect.top()) // t, ceil(rect.bottom() / t))
+        return [(c, r) for r in rows for c in columns]
+
+    def paint(self, painter: QPainter, option: QStyleOptionGraphicsItem,
+              widget: Optional[QWidget] = None):
+        if self.source is None:
+            return
+        t = self.tile_size
+        for tile in self.tiles_in(option.exposedRect):
+            key = (self.index, ) + tile
+            pixmap = self._tiles.get(key)
+            if pixmap is None:
+                self._request(key)
+            else:
+                self._tiles.move_to_end(key)
+                painter.drawPixmap(QPointF(tile[0] * t, tile[1] * t), pixmap)
+
+    def _request(self, key: Tuple[int, int, int]):
+        if key in self._pending:
+            return
+        self._pending[key] = self._executor.submit(
+            self._load, self._generation, key, self.source, self._size,
+            self.lut)
+
+    def _load(self, generation: int, key: Tuple[int, int, int], source,
+              size: Tuple[int, int], lut: Optional[DisplayLUT]):
+        """
+        Reads and converts a tile on a worker thread.
+        """
+        index, c, r = key
+        limits = self._limits.get(index)
+        if limits is None:
+            limits = self._frame_limits(source, index, size)
+            # other threads compute the same limits, so there's no need to
+            # lock, but those of a frame that changed since are stale
+            if generation == self._generation:
+                limits = self._limits.setdefault(index, limits)
+        t = self.tile_size
+        region = (slice(c * t, min((c + 1) * t, size[0])),
+                  slice(r * t, min((r + 1) * t, size[1])))
+        arr = source.request_region(index, region)
+        image = VGraphicsScene.array2image(
+            arr.reshape(arr.shape[-2:]).T, True, limits, lut)
+        self.tile_loaded.emit(generation, key, image)
+
+    def _frame_limits(self, source, index: int, size: Tuple[int, int]
+                      ) -> Tuple[float, float]:
+        step = max(ceil(sqrt(size[0] * size[1]) / self.tile_size), 1)
+        sample = source.request_region(
+            index, (slice(None, None, step), ) * 2)
+        return sample.min(), sample.max()
+
+    @Slot(int, object, object)
+    def _tile_loaded(self, generation: int, key: Tuple[int, int, int],
+                     image: QImage):
+        if not generation == self._generation:
+            return
+        del self._pending[key]
+        self._tiles[key] = QPixmap.fromImage(image)
+        self.loads += 1
+        while len(self._tiles) > self.max_tiles:
+            self._tiles.popitem(last=False)
+        if key[0] == self.index:
+            t = self.tile_size
+            self.update(QRectF(key[1] * t, key[2] * t, t, t))
+
+
 class VGraphicsScene(QGraphicsScene):
     """
     Note that is the responsibility of a Controller-type object to coordinate
@@ -261,6 +471,13 @@ class VGraphicsScene(QGraphicsScene):
     def __init__(self, parent: Optional[QObject] = None):
         super().__init__(parent)
         self._display_default_image()
+        # whether set_pixmap has replaced the default image yet
+        self._has_image = False
+        # draws frames that are shown in tiles; see set_tiled_image
+        self._tiled = VTiledImageItem()
+        self._tiled.setFlag(QGraphicsItem.ItemStacksBehindParent)
+        self._tiled.setParentItem(self._pixmap)
+        self._tiled.setVisible(False)
 
         self._groups = dict()
         self.current_index = 0
@@ -283,42 +500,287 @@ class VGraphicsScene(QGraphicsScene):
     def pixmap(self, dummy):
         raise NotImplementedError('Use the set_pixmap method instead.')
 
-    def set_pixmap(self, px: np.ndarray, index: int):
+    def set_pixmap(self, px: QPixmap, index: int):
         """
         If 'px' is the same size as the previous image -- e.g. another image
-        channel or frame in a time series -- propagate the same level of zoom.
+        channel or frame in a time series -- keep the current level of zoom.
+        Otherwise, fit the new image to the views.
+
+        Sizes are compared in scene coordinates, i.e. divided by the
+        pixmaps' devicePixelRatio, so that switching between levels of an
+        image pyramid doesn't count as a change of size.
         """
         old = self._pixmap.pixmap()
-        w, h = old.width(), old.height()
+        w, h = self._logical_size(old)
         self._pixmap.setPixmap(px)
-
-        if not (px.width() == w and px.height() == h):
+        self._tiled.setVisible(False)
+
+        new_w, new_h = self._logical_size(px)
+        # downsampling drops odd rows and columns, so sizes at different
+        # levels agree up to the size of a downsampled pixel
+        tolerance = max(1 / px.devicePixelRatio(),
+                        1 / old.devicePixelRatio(), 1)
+        resized = abs(new_w - w) >= tolerance or abs(new_h - h) >= tolerance
+        if resized or not self._has_image:
+            self._has_image = True
             # https://www.qtcentre.org/threads/20091-Position-in-a-QPixMap-created-from-a-QGraphicsScene?p=98862#post98862
             rect = self._pixmap.sceneBoundingRect()
             self.setSceneRect(rect)
-        # XXX: if size has not changed, not sure we should be calling fit_to_window
-        for view in self.views():
-            view.fit_to_window()
+            for view in self.views():
+                view.fit_to_window()
 
         self.pixmap_changed.emit(index)
 
+    @Property(object)
+    def tiled_image(self) -> VTiledImageItem:
+        return self._tiled
+
+    def set_tiled_image(self, source, index: int, shape: Tuple[int, ...],
+                        limits: Optional[Tuple[float, float]] = None,
+                        lut: Optional[DisplayLUT] = None):
+        """
+        Shows frame 'index' of 'source', of shape (..., x, y), in tiles that
+        are only read where the views show them. 'source' must have a
+        'request_region' method; see HDF5DataSource.
+
+        The pixmap is replaced by a small transparent one of the frame's
+        size in scene coordinates, so that the views' zoom and the markers,
+        which are children of the pixmap, behave as they do for other
+        frames. See VTiledImageItem.set_frame for 'limits', and
+        array2pixmap for 'lut'. Tiles that were drawn with a different
+        DisplayLUT are dropped; the caller must call tiled_image.clear() if
+        it changes the gamma or colormap of the same one.
+        """
+        scale = 2 ** PYRAMID_MAX_LEVEL
+        placeholder = QPixmap(max(ceil(shape[-2] / scale), 1),
+                              max(ceil(shape[-1] / scale), 1))
+        placeholder.fill(Qt.transparent)
+        placeholder.setDevicePixelRatio(placeholder.width() / shape[-2])
+        self.set_pixmap(placeholder, index)
+        if lut is not self._tiled.lut:
+            self._tiled.clear()
+            self._tiled.lut = lut
+        self._tiled.set_frame(source, index, shape, limits)
+        self._tiled.setVisible(True)
+
+    @staticmethod
+    def _logical_size(px: QPixmap):
+        ratio = px.devicePixelRatio()
+        return px.width() / ratio, px.height() / ratio
+
     @staticmethod
-    def rescale_array(array):
+    def rescale_array(array: np.ndarray, out: Optional[np.ndarray] = None,
+                      scratch: Optional[np.ndarray] = None,
+                      limits: Optional[Tuple[float, float]] = None
+                      ) -> np.ndarray:
+        """
+        Linearly rescales an array to the range [0, 255] of a uint8 array.
+
+        Parameters
+        ------------
+        array : np.ndarray
+
+        out : Optional[np.ndarray]
+            uint8 array of the same shape as 'array' to write the result to.
+
+        scratch : Optional[np.ndarray]
+            float32 array of the same shape as 'array', used for the
+            intermediate results.
+
+        limits : Optional[Tuple[float, float]]
+            Values mapped to 0 and 255, e.g. so that the tiles of a frame
+            are rescaled alike. Defaults to the minimum and maximum of
+            'array'; values outside the limits are clipped.
+
+        'array' may be a strided view, e.g. a transposed frame; it's read in
+        place, and the result is written in the memory order of 'out'.
+        """
         # XXX: pixel scaling will eventually be adjustable in the GUI
-        min_ = array.min()
-        max_ = array.max()
-        array = (array - min_) / (max_ - min_) * 256
-        return array
+        if limits is None:
+            min_, max_ = array.min(), array.max()
+        else:
+            min_, max_ = limits
+        scale = 255 / (max_ - min_) if max_ > min_ else 0
+        if out is None:
+            out = np.empty(array.shape, dtype=np.uint8)
+        scratch = np.subtract(array, min_, out=scratch, dtype=np.float32,
+                              casting='unsafe')
+        np.multiply(scratch, scale, out=scratch)
+        if limits is not None:
+            np.clip(scratch, 0, 255, out=scratch)
+        np.copyto(out, scratch, casting='unsafe')
+        return out
 
     @staticmethod
-    def array2pixmap(array: np.ndarray, rescale: bool = True) -> QPixmap:
+    def array2pixmap(array: np.ndarray, rescale: bool = True,
+                     buffers: Optional[FrameBufferPool] = None,
+                     limits: Optional[Tuple[float, float]] = None,
+                     lut: Optional[DisplayLUT] = None) -> QPixmap:
+        """
+        Converts a 2D array to a grayscale QPixmap. A uint8 array whose rows
+        are contiguous in memory, e.g. a frame memory-mapped from an HDF5
+        file, is passed to QImage without being copied.
+
+        If 'lut' is given, the array is shown with its gamma and colormap.
+        Arrays of 8 and 16 bit integers are then converted by looking their
+        values up in its table, rather than by rescale_array.
+
+        If 'buffers' is given, the rescaled image is written into arrays
+        from the pool, which are handed back once the QPixmap (which holds
+        its own copy of the pixels) has been created. See rescale_array
+        for 'limits'.
+        """
         # https://github.com/sjara/brainmix/blob/master/brainmix/gui/numpy2qimage.py
+        borrowed = []
+
+        def acquire(dtype):
+            if buffers is None:
+                buffer = np.empty(array.shape, dtype)
+            else:
+                buffer = buffers.acquire(array.shape, dtype)
+            borrowed.append(buffer)
+            return buffer
+
+        # the QImage shares the memory of 'pixels' or of the borrowed arrays
+        qimage, pixels = VGraphicsScene._array2qimage(
+            array, rescale, acquire, limits, lut)
+        pixmap = QPixmap.fromImage(qimage)
+        if buffers is not None:
+            for buffer in borrowed:
+                buffers.release(buffer)
+        return pixmap
+
+    @staticmethod
+    def array2image(array: np.ndarray, rescale: bool = True,
+                    limits: Optional[Tuple[float, float]] = None,
+                    lut: Optional[DisplayLUT] = None) -> QImage:
+        """
+        Converts a 2D array to a QImage like array2pixmap. The QImage holds
+        its own copy of the pixels; unlike a QPixmap, it may be created on
+        a worker thread.
+        """
+        borrowed = []
+
+        def acquire(dtype):
+            borrowed.append(np.empty(array.shape, dtype))
+            return borrowed[-1]
+
+        qimage, pixels = VGraphicsScene._array2qimage(
+            array, rescale, acquire, limits, lut)
+        return qimage.copy()
+
+    @staticmethod
+    def _array2qimage(array: np.ndarray, rescale: bool, acquire: Callable,
+                      limits: Optional[Tuple[float, float]],
+                      lut: Optional[DisplayLUT]
+                      ) -> Tuple[QImage, np.ndarray]:
+        """
+        Returns a QImage of 'array', and the array whose memory it may share
+        other than those returned by 'acquire', which is called with the
+        dtype of each intermediate array of the shape of 'array'.
+        """
+        if rescale and lut is not None and lut.supports(array.dtype):
+            return lut.to_qimage(array, limits, acquire(np.uint8)), array
         if rescale:
-            array = VGraphicsScene.rescale_array(array)
-        array = np.require(array, np.uint8, 'C')
-        w, h = array.shape
-        qimage = QImage(array.data, w, h, QImage.Format_Grayscale8)
-        return QPixmap.fromImage(qimage)
+            array = VGraphicsScene.rescale_array(
+                array, acquire(np.uint8), acquire(np.float32), limits)
+        if not (array.dtype == np.uint8 and array.strides[1] == 1):
+            array = np.require(array, np.uint8, 'C')
+        if lut is None:
+            h, w = array.shape
+            qimage = QImage(array.ctypes.data, w, h, array.strides[0],
+                            QImage.Format_Grayscale8)
+        else:
+            qimage = lut.to_qimage(array, (0, 255), acquire(np.uint8))
+        return qimage, array
+
+    @staticmethod
+    def composite2pixmap(planes: Sequence[np.ndarray],
+                         luts: Sequence[DisplayLUT],
+                         limits: Optional[Sequence[Optional[
+                             Tuple[float, float]]]] = None,
+                         buffers: Optional[FrameBufferPool] = None
+                         ) -> QPixmap:
+        """
+        Blends 2D arrays of the same shape, e.g. the channels of a frame,
+        into an RGB QPixmap. Each plane is looked up in the RGB table of its
+        DisplayLUT, with its own limits (see rescale_array), and the colors
+        are added up, saturating at white.
+
+        Planes of 8 and 16 bit integers are looked up directly; others are
+        rescaled to uint8 first. If 'buffers' is given, the intermediate
+        arrays are taken from it.
+        """
+        borrowed = []
+
+        def acquire(shape, dtype):
+            if buffers is None:
+                return np.empty(shape, dtype)
+            buffer = buffers.acquire(shape, dtype)
+            borrowed.append(buffer)
+            return buffer
+
+        pixels = VGraphicsScene._composite(planes, luts, limits, acquire)
+        h, w = pixels.shape
+        qimage = QImage(pixels.ctypes.data, w, h, pixels.strides[0],
+                        QImage.Format_RGB32)
+        pixmap = QPixmap.fromImage(qimage)
+        for buffer in borrowed:
+            buffers.release(buffer)
+        return pixmap
+
+    @staticmethod
+    def composite2image(planes: Sequence[np.ndarray],
+                        luts: Sequence[DisplayLUT],
+                        limits: Optional[Sequence[Optional[
+                            Tuple[float, float]]]] = None) -> QImage:
+        """
+        Blends 'planes' into an RGB QImage like composite2pixmap, which may
+        be created on a worker thread.
+        """
+        pixels = VGraphicsScene._composite(
+            planes, luts, limits, lambda shape, dtype: np.empty(shape, dtype))
+        h, w = pixels.shape
+        return QImage(pixels.ctypes.data, w, h, pixels.strides[0],
+                      QImage.Format_RGB32).copy()
+
+    @staticmethod
+    def _composite(planes: Sequence[np.ndarray], luts: Sequence[DisplayLUT],
+                   limits: Optional[Sequence[Optional[Tuple[float, float]]]],
+                   acquire: Callable) -> np.ndarray:
+        """
+        Returns the pixels of the blend of 'planes', as uint32 values in the
+        layout of QImage.Format_RGB32. 'acquire' is called with the shape and
+        dtype of each intermediate array.
+        """
+        h, w = planes[0].shape
+        if limits is None:
+            limits = [None] * len(planes)
+        total = acquire((h, w, 3), np.uint16)
+        total.fill(0)
+        rgb = acquire((h, w, 3), np.uint8)
+        for plane, lut, lim in zip(planes, luts, limits):
+            if not lut.supports(plane.dtype):
+                plane = VGraphicsScene.rescale_array(plane, limits=lim)
+                lim = (0, 255)
+            elif lim is None:
+                lim = (plane.min(), plane.max())
+            unsigned = np.dtype('u{}'.format(plane.dtype.itemsize))
+            np.take(lut.rgb_table(plane.dtype, lim), plane.view(unsigned),
+                    axis=0, out=rgb)
+            np.add(total, rgb, out=total)
+        np.minimum(total, 255, out=total)
+
+        # QImage.Format_RGB32 stores 0xffRRGGBB in native byte order
+        pixels = acquire((h, w), np.uint32)
+        channels = pixels.view(np.uint8).reshape(h, w, 4)
+        if sys.byteorder == 'little':
+            channels[..., 3] = 255
+            np.copyto(channels[..., 2::-1], total, casting='unsafe')
+        else:
+            channels[..., 0] = 255
+            np.copyto(channels[..., 1:], total, casting='unsafe')
+        return pixels
 
     @Property(object)
     def groups(self):
@@ -352,77 +814,61 @@ class VGraphicsScene(QGraphicsScene):
             self._groups[k].clear()
 
     def has_markers(self, dtype: DataType,
-                    index: Optional[int] = None) -> Union[bool, List[int]]:
+                    index: Optional[int] = None) -> bool:
         """
-        Tests for the existence of a VGraphicsGroup in this Scene.
-
-        To test for the existence of a top-level group, set 'index' paramter to
-        None.
+        Tests for the existence of a top-level VGraphicsGroup in this Scene,
+        or, if 'index' is given, of the MarkerLayer of frame 'index' in it.
         """
         if index is None:
             return dtype in self._groups
-        else:
-            group = self._groups[dtype]
-
-        try:
-            subgroup = group[index]
-        except KeyError:
-            return False
-        else:
-            return subgroup.keys()
+        return index in self._groups[dtype]
 
     def get_markers(
             self, dtype: DataType, index: int,
-            visible: MarkerVisible = MarkerVisible.either) -> Sequence[Marker]:
-
+            visible: MarkerVisible = MarkerVisible.either) -> np.ndarray:
+        """
+        Returns the indices of the markers of frame 'index', in its
+        MarkerLayer, that are shown, hidden or either.
+        """
         try:
-            group = self._groups[dtype]
+            layer = self._groups[dtype][index]
         except KeyError:
-            # dummy expression to keep the return type consistent
-            return []
-        else:
-            # note that each member of the 'groups' generator is a list
-            if not visible ^ MarkerVisible.either:
-                return group[index][slice(None)]
-            elif visible & MarkerVisible.true:
-                return [m for m in group[index] if m.isVisible()]
-            elif visible & MarkerVisible.false:
-                return [m for m in group[index] if not m.isVisible()]
+            return np.empty(0, np.intp)
+        if not visible ^ MarkerVisible.either:
+            return np.arange(len(layer))
+        elif visible & MarkerVisible.true:
+            return np.flatnonzero(layer.visible)
+        elif visible & MarkerVisible.false:
+            return np.flatnonzero(~layer.visible)
 
     def reset_markers(self, dtype: DataType, index: int,
-                      markers: Iterable[Marker], vis: bool = False) -> bool:
+                      layer: MarkerLayer) -> bool:
         """
-        Deletes existing Markers and adds new Markers with the passed-in
-        coordinates.
+        Replaces the MarkerLayer of frame 'index', if any, with 'layer'.
         """
         if dtype in self._groups:
             group = self._groups[dtype]
         else:
             raise KeyError('{} top level group not created.'.format(
                 repr(dtype)))
-
-        try:
-            subgroup = group[index]
-        except KeyError:
-            subgroup = VGraphicsGroup(index, dtype)
-            subgroup.setParentItem(group)
-        finally:
-            return subgroup.replace_child_items(markers, vis)
+        group.add_child_item(layer, index)
+        return True
 
     def delete_markers(self, dtype: DataType,
                        index: Union[int, slice, Sequence[int]]) -> bool:
         """
-        Delete all child items from a VGraphicsGroup.
+        Deletes the MarkerLayers of the frames at 'index'.
         """
         try:
-            group = self._groups[dtype][index]
+            group = self._groups[dtype]
+            layers = group[index]
         except KeyError:
             return False
-        else:
-            for k in group.keys():
-                group.delete_child_item(k)
-            # self.markers_changed.emit(index, dtype)
-            return True
+        if isinstance(index, int):
+            layers = [layers]
+        for layer in layers:
+            group.delete_child_item(layer.key)
+        return True
 
     def set_markers_visible(
             self, dtype: DataType, index: int, visible: bool,
@@ -439,32 +885,38 @@ class VGraphicsScene(QGraphicsScene):
             Whether to make the marker visible (=True) or invisible (=False).
 
         mindex : Union[int, slice, Iterable[int]]
-            Marker index within the Group.
+            Marker index within the MarkerLayer.
 
         Returns
         ------------
         success : bool
-            Whether the markers were successfully added, i.e. returns False if
-            there is no VMarkerGroup at index, 'index'. Returns True unless
-            another exception is encountered.
+            Whether the markers were successfully shown or hidden, i.e.
+            returns False if there is no MarkerLayer at index, 'index'.
+            Returns True unless another exception is encountered.
         """
-        print('getting group: {}'.format(repr(dtype)))
-        print('mindex: {}'.format(mindex))
         group = self._groups[dtype]
         try:
-            subgroup = group[index]
+            layer = group[index]
         except KeyError:
             return False
         else:
-            print('subgroup: {}'.format(subgroup))
-            if isinstance(mindex, int):
-                marker = subgroup[mindex]
-                marker.setVisible(visible)
-            else:
-                for marker in subgroup[mindex]:
-                    marker.setVisible(visible)
+            layer.set_visible(visible, mindex)
             return True
 
+    def pick_marker(self, dtype: DataType, index: int, pos: QPointF,
+                    tolerance: float = 0) -> Optional[int]:
+        """
+        Returns the index of the marker of frame 'index' at 'pos', within
+        'tolerance' of its outline, or None; see MarkerLayer.pick.
+        """
+        try:
+            layer = self._groups[dtype][index]
+        except KeyError:
+            return None
+        # layers are children of the pixmap, which may be moved
+        pos = layer.mapFromScene(pos)
+        return layer.pick(pos.x(), pos.y(), tolerance)
+
     def count_markers(self, dtype: DataType, index: int) -> Union[bool, int]:
         if dtype in self._groups:
             group = self._groups[dtype]
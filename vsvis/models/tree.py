@@ -19,14 +19,18 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import pickle
+import h5py
 import numpy as np
 from collections import OrderedDict
-from typing import Union, Sequence, Optional, Dict, Iterator
+from typing import Callable, Union, Sequence, Optional, Dict, Iterator
 from qtpy.QtCore import QObject, QMimeData, QAbstractItemModel, QModelIndex, Qt
 # from qtpy.QtWidgets import QWidget
 from anytree import Node
 from ordered_set import OrderedSet
 
+from ..config import SWMR_READ
+from ..registry import file_registry
+
 
 class NodeTreeModel(QAbstractItemModel):
     def __init__(self, root: Node, parent: QObject = None):
@@ -177,3 +181,108 @@ class DraggableTreeModel(NodeTreeModel):
         mime = QMimeData()
         mime.setData('application/node', pickle.dumps(data))
         return mime
+
+
+class LazyHDF5TreeModel(DraggableTreeModel):
+    """
+    A DraggableTreeModel of an HDF5 file's Groups and Datasets that lists a
+    Group's members only once the Group is expanded in the view, via
+    canFetchMore/fetchMore. A Dataset's attributes are read only when
+    they're displayed or encoded, e.g. when the Dataset is selected or
+    hovered over. Opening a file thus takes the same time regardless of how
+    many Datasets it has.
+
+    Nodes have 'h5path', 'is_group', 'fetched' and 'loaded' attributes in
+    addition to those read from the file.
+
+    Parameters
+    ------------
+    filename : str
+        HDF5 file.
+
+    encodable : Sequence[str]
+        See DraggableTreeModel.
+
+    args : Sequence[str]
+        h5py.Dataset attributes to store in each Dataset's node.
+
+    kwargs : Dict[str, Callable]
+        Functions that take an h5py.Dataset, whose results are stored in
+        each Dataset's node under the keyword's name.
+
+    parent : Optional[QObject]
+    """
+    def __init__(self, filename: str, encodable: Sequence[str],
+                 args: Sequence[str] = (),
+                 kwargs: Optional[Dict[str, Callable]] = None,
+                 parent: Optional[QObject] = None):
+        root = Node('root', h5path='/', is_group=True, fetched=False,
+                    loaded=True)
+        super().__init__(root, encodable, parent)
+        self.filename = filename
+        self.args = args
+        self.kwargs = dict() if kwargs is None else kwargs
+
+    def hasChildren(self, parent: QModelIndex = QModelIndex()) -> bool:
+        node = self.get_node(parent)
+        if not node.is_group:
+            return False
+        # an unexpanded Group may have children; we don't know yet
+        return not node.fetched or bool(node.children)
+
+    def canFetchMore(self, parent: QModelIndex) -> bool:
+        node = self.get_node(parent)
+        return node.is_group and not node.fetched
+
+    def fetchMore(self, parent: QModelIndex):
+        node = self.get_node(parent)
+        if not self.canFetchMore(parent):
+            return
+
+        with file_registry.open(self.filename, SWMR_READ) as h5file:
+            group = h5file[node.h5path]
+            members = [(key, group.get(key, getclass=True) is h5py.Group)
+                       for key in group]
+        node.fetched = True
+        if not members:
+            return
+
+        self.beginInsertRows(parent, 0, len(members) - 1)
+        base = node.h5path.rstrip('/') + '/'
+        for row, (key, is_group) in enumerate(members):
+            Node(key, parent=node, row=row, h5path=base + key,
+                 is_group=is_group, fetched=False, loaded=is_group)
+        self.endInsertRows()
+
+    def data(self, index: QModelIndex, role: int) -> Union[str, None]:
+        if not index.isValid():
+            return None
+        node = index.internalPointer()
+
+        if role == Qt.DisplayRole:
+            # a 'name' attribute loaded from the file replaces the node's
+            # name, so display the name of the h5py object instead
+            return node.h5path.rsplit('/', 1)[-1]
+        elif role == Qt.ToolTipRole and not node.is_group:
+            self._load_attributes([node])
+            return ', '.join('{}: {}'.format(attr, getattr(node, attr, ''))
+                             for attr in self.encodable)
+
+    def _load_attributes(self, nodes: Sequence[Node]):
+        nodes = [n for n in nodes if not n.loaded]
+        if not nodes:
+            return
+        with file_registry.open(self.filename, SWMR_READ) as h5file:
+            for node in nodes:
+                dset = h5file[node.h5path]
+                for k, fn in self.kwargs.items():
+                    setattr(node, k, fn(dset))
+                for arg in self.args:
+                    setattr(node, arg, getattr(dset, arg))
+                node.loaded = True
+
+    def get_nodes_as_dict(self, indices: Sequence[QModelIndex],
+                          keys: Optional[Union[Dict, Sequence]]=None) -> Dict[str, str]:
+        nodes = [self.get_node(index) for index in indices]
+        self._load_attributes(nodes)
+        return self._encode_nodes(nodes, keys)
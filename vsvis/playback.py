@@ -0,0 +1,239 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import time
+import traceback
+from collections import deque
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Sequence
+from qtpy.QtCore import QObject, Qt, QTimer, Signal, Slot
+from qtpy.QtGui import QImage
+
+from .config import (PLAYBACK_FPS, PLAYBACK_QUEUE_SIZE,
+                     PLAYBACK_REPORT_INTERVAL, PLAYBACK_WORKERS)
+
+
+class PlaybackEngine(QObject):
+    """
+    Plays a stack of frames at a target frame rate. Frames ahead of the one
+    being shown are read and converted to QImages on a pool of worker
+    threads, at most 'queue_size' of them at a time.
+
+    Which frame is shown is set by the clock, not by how fast frames are
+    converted: on every tick of the timer, the latest converted frame that
+    is due is shown, and earlier ones are dropped, so that playback doesn't
+    lag behind the target frame rate by more than the time it takes to
+    convert a frame. The achieved frame rate, and the
+    target, are reported with fps_changed.
+
+    Parameters
+    ------------
+    render : Callable[[int], QImage]
+        Returns the QImage of the frame at an index. Called on the worker
+        threads, e.g. Controller.render_frame.
+
+    fps : float
+        Target frame rate, in frames per second.
+
+    queue_size : int
+        Number of frames converted ahead of the one being shown.
+
+    max_workers : int
+        Number of worker threads.
+    """
+    #                 index, QImage
+    frame_ready = Signal(int, object)
+    #                  achieved, target
+    fps_changed = Signal(float, float)
+    playing_changed = Signal(bool)
+    # like Worker.failed, if a frame can't be rendered
+    failed = Signal(str, str)
+
+    def __init__(self, render: Callable[[int], QImage],
+                 fps: float = PLAYBACK_FPS,
+                 queue_size: int = PLAYBACK_QUEUE_SIZE,
+                 max_workers: int = PLAYBACK_WORKERS,
+                 parent: Optional[QObject] = None):
+        super().__init__(parent)
+        self.render = render
+        self.queue_size = queue_size
+        self._executor = ThreadPoolExecutor(max_workers)
+        # frames being converted, or converted and waiting to be shown
+        self._futures: Dict[int, Future] = dict()
+        # dropped frames that were already being converted
+        self._discarded: List[Future] = []
+
+        self._timer = QTimer(self)
+        self._timer.setTimerType(Qt.PreciseTimer)
+        self._timer.timeout.connect(self._tick)
+
+        self.length = 0
+        # the indices of the frames played, if not 0 to length - 1
+        self._frames: Optional[Sequence[int]] = None
+        # frames skipped since playback started
+        self.dropped = 0
+        self.achieved_fps = 0.
+        # the clock: frame 'start_index' was due at 'start_time'
+        self._start_index = 0
+        self._start_time = 0.
+        self._next_index = 0
+        # times that frames were shown in the last second
+        self._shown = deque()
+        self._last_report = 0.
+        self.set_fps(fps)
+
+    @property
+    def playing(self) -> bool:
+        return self._timer.isActive()
+
+    @Slot(int)
+    @Slot(float)
+    def set_fps(self, fps: float):
+        if not fps > 0:
+            raise ValueError('fps must be positive.')
+        self.fps = float(fps)
+        self._timer.setInterval(max(1, int(1000 / self.fps)))
+        if self.playing:
+            # keep playing from the frame that's due now
+            self._set_clock(self._due(time.monotonic()))
+
+    def play(self, start: int, length: int,
+             frames: Optional[Sequence[int]] = None):
+        """
+        Plays frames from 'start', which is taken to be shown already, to
+        the last of 'length' frames; from the first if 'start' is the last.
+        If given, 'frames' are the indices of the frames to play, e.g. the
+        time points of one Z plane of an N-D stack, and 'start' counts
+        through them.
+        """
+        self.pause()
+        if frames is not None:
+            length = len(frames)
+        if length < 2:
+            return
+        self.length = length
+        self._frames = frames
+        if start >= length - 1:
+            start = 0
+        self.dropped = 0
+        self.achieved_fps = 0.
+        self._shown.clear()
+        self._set_clock(start)
+        self._next_index = start + 1
+        self._fill(start + 1)
+        self._timer.start()
+        self.playing_changed.emit(True)
+
+    @Slot()
+    def pause(self):
+        """
+        Stops playback, and cancels frames that aren't being converted yet.
+        """
+        if not self.playing:
+            return
+        self._timer.stop()
+        for future in self._futures.values():
+            self._discard(future)
+        self._futures.clear()
+        self.playing_changed.emit(False)
+
+    def stop(self):
+        """
+        Stops playback, and waits for the frames being converted, e.g.
+        before the datasource they're read from is closed.
+        """
+        self.pause()
+        wait(self._discarded)
+        self._discarded.clear()
+
+    def shutdown(self):
+        self.stop()
+        self._executor.shutdown(wait=True)
+
+    def _set_clock(self, index: int):
+        self._start_index = index
+        self._start_time = time.monotonic()
+
+    def _due(self, now: float) -> int:
+        # rounded, so that ticks a little early don't show the same frame
+        return self._start_index + round((now - self._start_time) * self.fps)
+
+    def _discard(self, future: Future):
+        if not (future.cancel() or future.done()):
+            self._discarded = [f for f in self._discarded if not f.done()]
+            self._discarded.append(future)
+
+    def _fill(self, start: int):
+        stop = min(start + self.queue_size, self.length)
+        for i in range(start, stop):
+            if i not in self._futures:
+                self._futures[i] = self._executor.submit(
+                    self.render, self._frame(i))
+
+    def _frame(self, step: int) -> int:
+        return step if self._frames is None else int(self._frames[step])
+
+    @Slot()
+    def _tick(self):
+        now = time.monotonic()
+        due = min(self._due(now), self.length - 1)
+        ready = [i for i, future in self._futures.items()
+                 if i <= due and future.done() and not future.cancelled()]
+        shown = max(ready) if ready else None
+        image = None
+        if shown is not None:
+            try:
+                image = self._futures[shown].result()
+            except Exception as e:
+                detailed = traceback.format_exc()
+                self.stop()
+                self.failed.emit(str(e), detailed)
+                return
+        # frames that are due and weren't converted in time are dropped,
+        # unless they're being converted, when they may still be shown late
+        last = self._next_index - 1 if shown is None else shown
+        for i in [i for i in self._futures if i <= due]:
+            if i <= last or not self._futures[i].running():
+                self._discard(self._futures.pop(i))
+
+        if shown is not None:
+            self.dropped += shown - self._next_index
+            self._next_index = shown + 1
+            self._shown.append(now)
+            self.frame_ready.emit(self._frame(shown), image)
+        self._report(now)
+
+        if due == self.length - 1 and not self._futures:
+            self.pause()
+        else:
+            self._fill(due + 1)
+
+    def _report(self, now: float):
+        while self._shown and now - self._shown[0] > 1:
+            self._shown.popleft()
+        if now - self._last_report < PLAYBACK_REPORT_INTERVAL:
+            return
+        span = self._shown[-1] - self._shown[0] if self._shown else 0
+        if span > 0:
+            self.achieved_fps = (len(self._shown) - 1) / span
+        else:
+            self.achieved_fps = 0.
+        self._last_report = now
+        self.fps_changed.emit(self.achieved_fps, self.fps)
@@ -0,0 +1,217 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import time
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+from math import ceil, exp
+from typing import Dict, List, Mapping
+
+from .config import (
+    PREFETCH_LOOKAHEAD, PREFETCH_MAX_WINDOW, PREFETCH_WINDOW, Dimension)
+
+
+class Prefetcher(object):
+    """
+    Loads frames ahead of the one being displayed on a pool of worker
+    threads, so that they're already in the datasources' caches by the time
+    they are requested.
+
+    The Prefetcher follows the user's scrolling: it prefetches in the
+    direction of the last index change, with the same step size, and
+    cancels pending work when the direction reverses. The faster the user
+    scrolls, the further ahead it loads, so that it stays 'lookahead'
+    seconds ahead of the current index.
+
+    If a datasource's frames are navigated along several Dimensions (see
+    HDF5DataSource.frame_index), the Prefetcher follows the Dimension that
+    was scrolled last, T to begin with, and loads the frames ahead along it
+    at the current position along the others, e.g. the next time points of
+    the same Z plane and channel, rather than the next flat indices.
+
+    Parameters
+    ------------
+    datasources : Mapping
+        Datasources to prefetch from, e.g. Controller.datasources. The
+        mapping is read every time frames are prefetched, so datasources
+        added to it later are prefetched too.
+
+    window : int
+        Number of frames to load ahead of the current index, at least.
+
+    max_window : int
+        Number of frames to load ahead of the current index, at most.
+
+    lookahead : float
+        Seconds of scrolling, at the current rate, to load frames for.
+
+    max_workers : int
+        Number of worker threads.
+    """
+    def __init__(self, datasources: Mapping, window: int = PREFETCH_WINDOW,
+                 max_window: int = PREFETCH_MAX_WINDOW,
+                 lookahead: float = PREFETCH_LOOKAHEAD,
+                 max_workers: int = 2):
+        self.datasources = datasources
+        self.window = window
+        self.max_window = max_window
+        self.lookahead = lookahead
+        self._executor = ThreadPoolExecutor(max_workers)
+        self._futures: Dict[int, Future] = dict()
+        # prefetches that were dropped after they had started
+        self._started: List[Future] = []
+
+        self.direction = 1
+        # number of frames per index change
+        self.stride = 1
+        # the Dimension being scrolled, for frames with several
+        self.dimension = Dimension.T
+        # index changes per second, smoothed over about the last
+        # 'lookahead' seconds
+        self.rate = 0.
+        self._last_index = None
+        self._last_time = None
+
+    def update(self, index: int) -> List[int]:
+        """
+        Record that 'index' is the current index, and prefetch the frames
+        ahead of it. Returns the indices that are being prefetched.
+        """
+        now = time.monotonic()
+        frame_index = self._frame_index()
+        if self._last_index is not None and index != self._last_index:
+            step = self._step(frame_index, self._last_index, index)
+        else:
+            step = 0
+        if step:
+            direction = 1 if step > 0 else -1
+            if not direction == self.direction:
+                self.cancel()
+            self.direction = direction
+            self.stride = abs(step)
+            elapsed = now - self._last_time
+            if elapsed > 0:
+                # the weight of the old rate decays with the time since the
+                # last change, so that a pause ends a fast scrub
+                if self.lookahead > 0:
+                    alpha = exp(-elapsed / self.lookahead)
+                else:
+                    alpha = 0.
+                self.rate = alpha * self.rate + (1 - alpha) / elapsed
+        self._last_index = index
+        self._last_time = now
+
+        if self.window < 1 or not self.datasources:
+            return []
+
+        steps = [self.direction * self.stride * i
+                 for i in range(1, self.frames_ahead() + 1)]
+        if frame_index is None:
+            length = max(len(source) for source in self.datasources.values())
+            targets = [t for t in (index + s for s in steps)
+                       if 0 <= t < length]
+        elif not 0 <= index < frame_index.length:
+            targets = []
+        else:
+            dimension = self._dimension(frame_index)
+            along = frame_index.frames_along(index, dimension)
+            i = frame_index.position(index)[frame_index.axis_of(dimension)]
+            targets = [int(along[i + s]) for s in steps
+                       if 0 <= i + s < len(along)]
+
+        # work outside the new window is stale
+        for i in list(self._futures):
+            future = self._futures[i]
+            if future.done() or i not in targets:
+                self._drop(self._futures.pop(i))
+
+        for t in targets:
+            if t not in self._futures:
+                self._futures[t] = self._executor.submit(self._load, t)
+        return targets
+
+    def frames_ahead(self) -> int:
+        """
+        Number of frames loaded ahead of the current index at the current
+        scrolling rate: between window and max_window.
+        """
+        if self.window < 1:
+            return 0
+        wanted = ceil(self.rate * self.lookahead)
+        return max(self.window, min(wanted, self.max_window))
+
+    def _frame_index(self):
+        for source in list(self.datasources.values()):
+            frame_index = getattr(source, 'frame_index', None)
+            if frame_index is not None:
+                return frame_index
+        return None
+
+    def _dimension(self, frame_index) -> Dimension:
+        if self.dimension in frame_index.dimensions:
+            return self.dimension
+        return frame_index.dimensions[0]
+
+    def _step(self, frame_index, last: int, index: int) -> int:
+        """
+        Returns the number of frames moved from 'last' to 'index', along the
+        Dimension that was scrolled if the frames have several, or 0 if
+        several Dimensions changed at once.
+        """
+        if frame_index is None:
+            return index - last
+        if max(last, index) >= frame_index.length:
+            return 0
+        moved = [(dimension, b - a) for dimension, a, b in zip(
+            frame_index.dimensions, frame_index.position(last),
+            frame_index.position(index)) if not a == b]
+        if not len(moved) == 1:
+            return 0
+        dimension, step = moved[0]
+        if not dimension == self.dimension:
+            self.cancel()
+            self.dimension = dimension
+        return step
+
+    def _drop(self, future: Future):
+        if not (future.cancel() or future.done()):
+            self._started = [f for f in self._started if not f.done()]
+            self._started.append(future)
+
+    def _load(self, index: int):
+        for source in list(self.datasources.values()):
+            if source is not None and index < len(source):
+                source.request(index)
+
+    def cancel(self, wait_started: bool = False):
+        """
+        Cancel prefetches that haven't started yet. If 'wait_started', also
+        wait for those that have, e.g. before the files that they read from
+        are closed; prefetches can't be interrupted once they've started.
+        """
+        for future in self._futures.values():
+            self._drop(future)
+        self._futures.clear()
+        if wait_started:
+            wait(self._started)
+            self._started.clear()
+
+    def shutdown(self):
+        self.cancel(wait_started=True)
+        self._executor.shutdown(wait=True)
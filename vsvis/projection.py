@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .config import (
+    PROJECTION_BLOCK_NBYTES, PROJECTION_WORKERS, Dimension, Projection)
+
+"""
+Intensity projections of a whole stack of frames, e.g. the maximum over
+time, computed block by block so that the stack never has to fit in memory.
+"""
+
+# a partially reduced projection: the number of frames it covers, and their
+# maximum, or their mean and sum of squared deviations from it
+Partial = Tuple[int, np.ndarray, Optional[np.ndarray]]
+
+
+def _reduce(block: np.ndarray, kind: Projection, axis: int) -> Partial:
+    n = block.shape[axis]
+    if kind == Projection.MAX:
+        return n, block.max(axis, keepdims=True), None
+    mean = block.mean(axis, dtype=np.float64, keepdims=True)
+    if kind == Projection.MEAN:
+        return n, mean, None
+    deviations = np.subtract(block, mean, dtype=np.float64)
+    np.square(deviations, out=deviations)
+    return n, mean, deviations.sum(axis, keepdims=True)
+
+
+def _combine(a: Optional[Partial], b: Partial, kind: Projection) -> Partial:
+    """
+    Merges two partial projections, using Chan et al.'s pairwise update
+    for the mean and the sum of squared deviations.
+    """
+    if a is None:
+        return b
+    na, xa, m2a = a
+    nb, xb, m2b = b
+    n = na + nb
+    if kind == Projection.MAX:
+        return n, np.maximum(xa, xb, out=xa), None
+    delta = xb - xa
+    mean = xa + delta * (nb / n)
+    if kind == Projection.MEAN:
+        return n, mean, None
+    return n, mean, m2a + m2b + np.square(delta) * (na * nb / n)
+
+
+def _finish(partial: Partial, kind: Projection) -> np.ndarray:
+    n, x, m2 = partial
+    if kind == Projection.MAX:
+        return x
+    elif kind == Projection.MEAN:
+        return x.astype(np.float32)
+    return np.sqrt(m2 / n).astype(np.float32)
+
+
+class ProjectionEngine(object):
+    """
+    Computes maximum, mean and standard deviation projections of an image
+    datasource along its stacking axis, e.g. time, and caches them.
+
+    Frames of datasources navigated along several Dimensions (see
+    HDF5DataSource.frame_index) are projected along T, or along Z if there
+    is no T, at one position along the other Dimensions; e.g. each channel
+    and Z plane has its own projection over time. They're read in blocks
+    with the datasource's 'read_line' method.
+
+    Datasources with 'frame_blocks' and 'read_block' methods, such as
+    HDF5DataSource, HDF5MultiFileDataSource and TiffDataSource, are read in
+    blocks, aligned to their chunks and bypassing their frame cache; other
+    datasources are read frame by frame and stacked into blocks. Blocks are
+    read and reduced on a pool of threads, and at most twice as many blocks
+    as there are threads are held in memory at once.
+
+    Parameters
+    ------------
+    source
+        Image datasource.
+
+    max_workers : int
+        Number of threads.
+
+    block_nbytes : int
+        Approximate size of the blocks.
+    """
+    def __init__(self, source, max_workers: int = PROJECTION_WORKERS,
+                 block_nbytes: int = PROJECTION_BLOCK_NBYTES):
+        self.source = source
+        self.max_workers = max_workers
+        self.block_nbytes = block_nbytes
+        self._results: Dict[Tuple[Projection, Optional[Tuple[int, ...]]],
+                            np.ndarray] = dict()
+
+    def __contains__(self, kind: Projection) -> bool:
+        return any(k == kind for k, _ in self._results)
+
+    @property
+    def dimension(self) -> Optional[Dimension]:
+        """
+        The Dimension that frames navigated along several Dimensions are
+        projected along, or None if the datasource has a single stacking
+        axis or neither a T nor a Z Dimension.
+        """
+        frame_index = getattr(self.source, 'frame_index', None)
+        if frame_index is None:
+            return None
+        for dimension in (Dimension.T, Dimension.Z):
+            if dimension in frame_index.dimensions:
+                return dimension
+        return None
+
+    def line(self, index: int) -> Optional[Tuple[int, ...]]:
+        """
+        Returns the position of frame 'index' along the Dimensions that
+        aren't projected, which frames with the same projection share, or
+        None if all frames share one.
+        """
+        dimension = self.dimension
+        if dimension is None:
+            return None
+        frame_index = self.source.frame_index
+        position = list(frame_index.position(index))
+        del position[frame_index.axis_of(dimension)]
+        return tuple(position)
+
+    def clear(self):
+        """
+        Forgets the computed projections, e.g. after frames were appended
+        to the stack.
+        """
+        self._results.clear()
+
+    def project(self, kind: Projection, progress: Optional[Callable] = None,
+                index: int = 0) -> np.ndarray:
+        """
+        Returns the projection 'kind' of the stack, shaped like a frame.
+        The maximum has the frames' dtype, the mean and standard deviation
+        are float32.
+
+        Parameters
+        ------------
+        kind : Projection
+
+        progress : Optional[Callable]
+            Called with the number of blocks reduced so far and the total
+            number of blocks. May raise, e.g. to cancel the computation.
+
+        index : int
+            A frame whose projection is returned, for frames navigated
+            along several Dimensions; see line.
+        """
+        key = (kind, self.line(index))
+        result = self._results.get(key)
+        if result is None:
+            result = self._results[key] = self._project(
+                kind, progress, index)
+        return result
+
+    def _plan(self, index: int
+              ) -> Tuple[List[Tuple[int, int]], Callable, int]:
+        """
+        Returns the blocks, (start, stop), the function that reads a block,
+        and the axis along which a block's frames are concatenated.
+        """
+        source = self.source
+        frame_index = getattr(source, 'frame_index', None)
+        if frame_index is not None:
+            dimension = self.dimension
+            if dimension is None:
+                raise TypeError('Only stacks with a T or Z Dimension can be '
+                                'projected.')
+            n = frame_index.shape[frame_index.axis_of(dimension)]
+            shape, dtype = source.frame_info(index)
+            frame_nbytes = max(int(np.prod(shape)) * dtype.itemsize, 1)
+            length = max(self.block_nbytes // frame_nbytes, 1)
+
+            def read_line(start, stop):
+                return source.read_line(index, dimension, start, stop)
+            return ([(b, min(b + length, n)) for b in range(0, n, length)],
+                    read_line, 0)
+
+        if hasattr(source, 'frame_blocks'):
+            try:
+                blocks = source.frame_blocks(self.block_nbytes)
+            except TypeError:
+                pass
+            else:
+                return blocks, source.read_block, source.axis
+
+        n = len(source)
+        if not n:
+            return [], None, 0
+        frame_nbytes = max(source.request(0).nbytes, 1)
+        length = max(self.block_nbytes // frame_nbytes, 1)
+
+        def read_block(start, stop):
+            return np.concatenate(
+                [source.request(i) for i in range(start, stop)], axis=0)
+        return ([(b, min(b + length, n)) for b in range(0, n, length)],
+                read_block, 0)
+
+    def _project(self, kind: Projection, progress: Optional[Callable],
+                 index: int) -> np.ndarray:
+        blocks, read_block, axis = self._plan(index)
+        if not blocks:
+            raise ValueError('Cannot project an empty stack.')
+
+        def task(block):
+            return _reduce(read_block(*block), kind, axis)
+
+        total = None
+        done = 0
+        pending = set()
+        with ThreadPoolExecutor(self.max_workers) as pool:
+            try:
+                for i, block in enumerate(blocks):
+                    pending.add(pool.submit(task, block))
+                    # bound the number of blocks in memory
+                    if len(pending) < 2 * self.max_workers and \
+                            i < len(blocks) - 1:
+                        continue
+                    while pending:
+                        finished, pending = wait(
+                            pending, return_when=FIRST_COMPLETED)
+                        for future in finished:
+                            total = _combine(total, future.result(), kind)
+                            done += 1
+                            if progress is not None:
+                                progress(done, len(blocks))
+                        if i < len(blocks) - 1:
+                            break
+            except BaseException:
+                for future in pending:
+                    future.cancel()
+                raise
+        return _finish(total, kind)
@@ -0,0 +1,117 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+from itertools import count
+from typing import Optional, Tuple
+
+from .cache import FrameCache
+from .config import FRAME_CACHE_NBYTES, PYRAMID_MAX_LEVEL
+
+# distinguishes the cache entries of different ImagePyramid objects
+_tokens = count()
+
+
+def downsample(array: np.ndarray) -> np.ndarray:
+    """
+    Halves the size of the last two axes of 'array' by averaging blocks of
+    2x2 pixels. A trailing odd row or column is dropped. Integer arrays are
+    rounded back to their dtype.
+    """
+    h, w = array.shape[-2:]
+    a = array[..., :h - h % 2, :w - w % 2]
+    out = a[..., 0::2, 0::2].astype(np.float32)
+    out += a[..., 1::2, 0::2]
+    out += a[..., 0::2, 1::2]
+    out += a[..., 1::2, 1::2]
+    out *= 0.25
+    if np.issubdtype(array.dtype, np.integer):
+        np.rint(out, out=out)
+    return out.astype(array.dtype, copy=False)
+
+
+class ImagePyramid(object):
+    """
+    Frames of an image datasource at successively halved resolutions. Level
+    0 is the datasource's frame; level L is 2**L times smaller along each
+    image axis. Levels are computed on demand and cached.
+
+    Level L is computed from every 2**(L - 1)th pixel of the frame along
+    each image axis, averaged in blocks of 2x2. If the datasource has
+    'frame_info' and 'request_region' methods, as HDF5DataSource does, only
+    those pixels are read, so showing a large frame zoomed out never reads
+    all of it. Otherwise the frame is requested whole and subsampled.
+
+    Parameters
+    ------------
+    source
+        Image datasource with a 'request' method, whose frames' last two
+        axes are the image axes.
+
+    cache : Optional[FrameCache]
+        Cache of the computed levels; usually the datasource's.
+
+    max_level : int
+        Highest level that's computed.
+    """
+    def __init__(self, source, cache: Optional[FrameCache] = None,
+                 max_level: int = PYRAMID_MAX_LEVEL):
+        self.source = source
+        self.cache = FrameCache(FRAME_CACHE_NBYTES) if cache is None else cache
+        self.max_level = max_level
+        # shape of the last full-resolution frame, which the sizes of
+        # downsampled frames are relative to
+        self.full_shape: Optional[Tuple[int, ...]] = None
+        self._token = next(_tokens)
+
+    def __len__(self):
+        return len(self.source)
+
+    def request(self, index: int, level: int = 0) -> np.ndarray:
+        """
+        Returns the frame at 'index' at the given level, or at the highest
+        level that's available if the frame is too small to be downsampled
+        that often.
+        """
+        level = min(level, self.max_level)
+        if level <= 0:
+            frame = self.source.request(index)
+            self.full_shape = frame.shape
+            return frame
+
+        key = (self._token, index, level)
+        frame = self.cache.get(key)
+        if frame is not None:
+            return frame
+        sample = self._subsample(index, 2 ** (level - 1))
+        if min(sample.shape[-2:]) < 2:
+            return sample
+        return self.cache.put(key, downsample(sample))
+
+    def _subsample(self, index: int, step: int) -> np.ndarray:
+        region = (slice(None, None, step), ) * 2
+        frame_info = getattr(self.source, 'frame_info', None)
+        request_region = getattr(self.source, 'request_region', None)
+        if frame_info is None or request_region is None:
+            frame = self.source.request(index)
+            self.full_shape = frame.shape
+            return frame[(Ellipsis, ) + region]
+        self.full_shape, _ = frame_info(index)
+        return request_region(index, region)
@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import h5py
+from contextlib import contextmanager
+from threading import RLock
+from typing import Dict, Iterator, List, Tuple
+
+
+class HDF5FileRegistry(object):
+    """
+    Shares open h5py.File handles, and therefore their chunk caches, between
+    everything that reads the same HDF5 file, e.g. the image, ground truth
+    and predicted datasources and the file inspection dialog.
+
+    Each call to 'acquire' must be paired with a call to 'release'; the file
+    is closed when its last user releases it. Files are identified by their
+    real path and whether they're read in SWMR mode.
+    """
+    def __init__(self):
+        self._lock = RLock()
+        # (path, swmr) -> [h5py.File, number of users]
+        self._files: Dict[Tuple[str, bool], List] = dict()
+
+    def __len__(self) -> int:
+        return len(self._files)
+
+    @staticmethod
+    def _key(filename: str, swmr: bool) -> Tuple[str, bool]:
+        return os.path.realpath(filename), bool(swmr)
+
+    def acquire(self, filename: str, swmr: bool = False,
+                **kwargs) -> h5py.File:
+        """
+        Returns the file opened for reading, opening it if nobody else has.
+
+        Parameters
+        ------------
+        filename : str
+
+        swmr : bool
+            Whether to read the file in SWMR mode.
+
+        kwargs
+            Passed to h5py.File, e.g. 'rdcc_nbytes'. They only apply if the
+            file isn't open yet; otherwise they're ignored.
+        """
+        key = self._key(filename, swmr)
+        with self._lock:
+            try:
+                entry = self._files[key]
+            except KeyError:
+                h5file = h5py.File(filename, 'r', swmr=swmr, **kwargs)
+                entry = self._files[key] = [h5file, 0]
+            entry[1] += 1
+            return entry[0]
+
+    def release(self, h5file: h5py.File) -> bool:
+        """
+        Gives up one use of a file returned by 'acquire', closing it if it
+        was the last one. Returns whether the file was closed.
+        """
+        with self._lock:
+            for key, entry in self._files.items():
+                if entry[0] is h5file:
+                    break
+            else:
+                raise ValueError('{} was not acquired from this '
+                                 'registry.'.format(h5file))
+            entry[1] -= 1
+            if entry[1] > 0:
+                return False
+            del self._files[key]
+            h5file.close()
+            return True
+
+    @contextmanager
+    def open(self, filename: str, swmr: bool = False,
+             **kwargs) -> Iterator[h5py.File]:
+        """
+        Context manager that acquires the file and releases it on exit.
+        """
+        h5file = self.acquire(filename, swmr, **kwargs)
+        try:
+            yield h5file
+        finally:
+            self.release(h5file)
+
+    def refcount(self, filename: str, swmr: bool = False) -> int:
+        with self._lock:
+            entry = self._files.get(self._key(filename, swmr))
+            return 0 if entry is None else entry[1]
+
+
+# registry shared by the whole application
+file_registry = HDF5FileRegistry()
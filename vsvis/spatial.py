@@ -0,0 +1,161 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+from typing import Optional
+
+from .config import SPATIAL_INDEX_DENSITY
+
+
+class GridIndex(object):
+    """
+    A uniform grid over 2D points, e.g. the coordinates of the markers of a
+    frame, for finding the points in a rectangle, and the point nearest to
+    a position, without testing every point.
+
+    The points are bucketed into square cells, sized so that there are
+    'density' points per cell on average, and sorted by cell, one row of
+    cells after another. The points of consecutive cells in a row are then
+    a contiguous slice of the sorted order, which starts at the offset of
+    the first cell's points in 'starts'. A rectangle query takes one slice
+    per row of cells that it covers, and a nearest point query searches
+    rings of cells outwards from the position's cell, until no closer point
+    can be found; both take time proportional to the number of points near
+    the result, rather than to the number of points.
+
+    Parameters
+    ------------
+    points : np.ndarray
+        (n, 2) array of x, y coordinates.
+
+    density : float
+        Average number of points per cell.
+    """
+    def __init__(self, points: np.ndarray,
+                 density: float = SPATIAL_INDEX_DENSITY):
+        self.points = np.asarray(points, np.float64).reshape(-1, 2)
+        n = len(self.points)
+        if n:
+            self.origin = self.points.min(0)
+            extent = self.points.max(0) - self.origin
+        else:
+            self.origin = np.zeros(2)
+            extent = np.zeros(2)
+        # points along a line, or at a single position, still fill a row
+        area = np.prod(np.maximum(extent, 1))
+        self.cell_size = float(np.sqrt(area * density / max(n, 1)))
+        # number of cells along x and y
+        self.shape = (extent // self.cell_size).astype(np.intp) + 1
+
+        cells = self._cells(self.points)
+        ids = cells[:, 1] * self.shape[0] + cells[:, 0]
+        self.order = np.argsort(ids, kind='stable')
+        self.starts = np.searchsorted(
+            ids[self.order], np.arange(np.prod(self.shape) + 1))
+
+    def __len__(self):
+        return len(self.points)
+
+    def _cells(self, points: np.ndarray) -> np.ndarray:
+        cells = (points - self.origin) // self.cell_size
+        return np.clip(cells, 0, self.shape - 1).astype(np.intp)
+
+    def _cell_of(self, x: float, y: float) -> np.ndarray:
+        # unlike _cells, positions outside the grid aren't clipped to it
+        return ((np.array([x, y]) - self.origin) //
+                self.cell_size).astype(np.intp)
+
+    def _gather(self, rows: np.ndarray, first: np.ndarray,
+                last: np.ndarray) -> np.ndarray:
+        """
+        Returns the indices of the points in cells 'first' to 'last', along
+        x, of each of 'rows'. Spans outside the grid are clipped to it.
+        """
+        nx, ny = self.shape
+        first = np.maximum(first, 0)
+        last = np.minimum(last, nx - 1)
+        valid = (rows >= 0) & (rows < ny) & (first <= last)
+        rows, first, last = rows[valid], first[valid], last[valid]
+        begins = self.starts[rows * nx + first]
+        lengths = self.starts[rows * nx + last + 1] - begins
+        # consecutive offsets within each span
+        offsets = np.repeat(begins - np.cumsum(lengths) + lengths, lengths)
+        return self.order[offsets + np.arange(lengths.sum())]
+
+    def query_rect(self, x0: float, y0: float,
+                   x1: float, y1: float) -> np.ndarray:
+        """
+        Returns the indices of the points in the rectangle from (x0, y0) to
+        (x1, y1), edges included, in ascending order.
+        """
+        if not len(self) or x1 < x0 or y1 < y0:
+            return np.empty(0, np.intp)
+        (cx0, cy0), (cx1, cy1) = self._cell_of(x0, y0), self._cell_of(x1, y1)
+        rows = np.arange(max(cy0, 0), min(cy1, self.shape[1] - 1) + 1)
+        candidates = self._gather(rows, np.full_like(rows, cx0),
+                                  np.full_like(rows, cx1))
+        x, y = self.points[candidates].T
+        inside = (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1)
+        return np.sort(candidates[inside])
+
+    def nearest(self, x: float, y: float, max_distance: float = np.inf,
+                mask: Optional[np.ndarray] = None) -> Optional[int]:
+        """
+        Returns the index of the point nearest to (x, y), or None if there
+        are no points within 'max_distance' of it. If 'mask', a boolean
+        array with one element per point, is given, only the points where
+        it's True are considered.
+        """
+        if not len(self):
+            return None
+        cx, cy = self._cell_of(x, y)
+        nx, ny = self.shape
+        # rings before the first and after the last lie outside the grid
+        first_ring = max(-cx, cx - nx + 1, -cy, cy - ny + 1, 0)
+        last_ring = max(cx, nx - 1 - cx, cy, ny - 1 - cy, 0)
+        best, best_d2 = None, max_distance ** 2
+        for ring in range(first_ring, last_ring + 1):
+            # points in ring r are at least r - 1 cells from the position
+            if ring > 0 and ((ring - 1) * self.cell_size) ** 2 > best_d2:
+                break
+            if ring == 0:
+                rows = np.array([cy])
+                first, last = np.array([cx]), np.array([cx])
+            else:
+                # the top and bottom rows of the ring, whole, and the cells
+                # at either end of the rows in between
+                sides = np.arange(cy - ring + 1, cy + ring)
+                rows = np.concatenate([[cy - ring, cy + ring], sides, sides])
+                first = np.concatenate([
+                    [cx - ring] * 2, np.full(2 * len(sides), cx - ring)])
+                first[2 + len(sides):] = cx + ring
+                last = np.concatenate([
+                    [cx + ring] * 2, np.full(2 * len(sides), cx + ring)])
+                last[2:2 + len(sides)] = cx - ring
+            candidates = self._gather(rows, first, last)
+            if mask is not None:
+                candidates = candidates[mask[candidates]]
+            if not len(candidates):
+                continue
+            d2 = ((self.points[candidates] - (x, y)) ** 2).sum(1)
+            i = d2.argmin()
+            if d2[i] < best_d2 or (best is None and d2[i] == best_d2):
+                best, best_d2 = int(candidates[i]), d2[i]
+        return best
@@ -0,0 +1,358 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import hashlib
+import os
+import numpy as np
+from itertools import chain
+from typing import Callable, Iterator, Optional, Sequence, Tuple
+
+from .config import (
+    CACHE_DIR, STATS_BINS, STATS_BLOCK_NBYTES, STATS_PERCENTILES)
+
+"""
+An index of the intensity statistics of every frame of an image datasource,
+computed in one pass over the stack, so that frames can be rescaled for
+display without looking at their pixels again.
+"""
+
+
+class FrameStatistics(object):
+    """
+    Per-frame minimum, maximum, percentiles and histograms of a stack of
+    frames, and, for stacks of 8 and 16 bit integers, the histogram of the
+    whole stack.
+
+    Parameters
+    ------------
+    q : Sequence[float]
+        Percentiles, in [0, 100], stored for each frame.
+
+    minimum, maximum : np.ndarray
+        Of each frame.
+
+    percentiles : np.ndarray
+        Array of shape (frames, len(q)).
+
+    histograms : np.ndarray
+        Array of shape (frames, bins). Each frame's bins evenly divide the
+        range from its minimum to its maximum.
+
+    counts : Optional[np.ndarray]
+        Number of pixels in the stack with each value, starting at 'offset'.
+    """
+    def __init__(self, q: Sequence[float], minimum: np.ndarray,
+                 maximum: np.ndarray, percentiles: np.ndarray,
+                 histograms: np.ndarray, counts: Optional[np.ndarray] = None,
+                 offset: int = 0):
+        self.q = np.asarray(q, dtype=np.float64)
+        self.minimum = minimum
+        self.maximum = maximum
+        self.percentiles = percentiles
+        self.histograms = histograms
+        self.counts = counts
+        self.offset = offset
+        # limits of the whole stack, by percentiles
+        self._stack_limits = dict()
+
+    def __len__(self):
+        return len(self.minimum)
+
+    def histogram(self, index: int) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns the counts and bin edges of the histogram of frame 'index'.
+        """
+        counts = self.histograms[index]
+        edges = np.linspace(self.minimum[index], self.maximum[index],
+                            len(counts) + 1)
+        return counts, edges
+
+    def limits(self, index: Optional[int] = None, low: float = 0,
+               high: float = 100) -> Tuple[float, float]:
+        """
+        Returns the 'low' and 'high' percentiles of frame 'index', or of the
+        whole stack if 'index' is None.
+
+        Percentiles of a frame between those in self.q are interpolated.
+        Those of the stack are exact if the stack's histogram is known;
+        otherwise, they're bounded by the lowest and highest of the frames'.
+        Either is computed once per pair of percentiles.
+        """
+        q = np.concatenate([[0], self.q, [100]])
+        if index is not None:
+            values = np.concatenate([[self.minimum[index]],
+                                     self.percentiles[index],
+                                     [self.maximum[index]]])
+            return (float(np.interp(low, q, values)),
+                    float(np.interp(high, q, values)))
+
+        key = (float(low), float(high))
+        limits = self._stack_limits.get(key)
+        if limits is not None:
+            return limits
+        if self.counts is not None:
+            low, high = _percentiles_from_counts(self.counts, (low, high))
+            limits = float(low + self.offset), float(high + self.offset)
+        else:
+            # interpolating is linear in the values, so every frame is
+            # interpolated at once by weighting the columns of 'values'
+            values = np.column_stack(
+                [self.minimum, self.percentiles, self.maximum])
+            basis = np.eye(len(q))
+            weights = [np.array([np.interp(p, q, e) for e in basis])
+                       for p in key]
+            limits = (float((values @ weights[0]).min()),
+                      float((values @ weights[1]).max()))
+        self._stack_limits[key] = limits
+        return limits
+
+    def save(self, filename: str, key: str):
+        """
+        Writes the statistics to an npz file, tagged with 'key', e.g. a
+        description of the files they were computed from.
+        """
+        arrays = dict(key=np.array(key), q=self.q, minimum=self.minimum,
+                      maximum=self.maximum, percentiles=self.percentiles,
+                      histograms=self.histograms, offset=np.array(self.offset))
+        if self.counts is not None:
+            arrays['counts'] = self.counts
+        # write to a temporary file first so that readers never see a
+        # partially written file
+        temp_filename = filename + '.tmp'
+        with open(temp_filename, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temp_filename, filename)
+
+    @classmethod
+    def load(cls, filename: str, key: Optional[str] = None
+             ) -> Optional['FrameStatistics']:
+        """
+        Reads statistics written by save. Returns None if the file can't be
+        read, or if 'key' is given and doesn't match the file's.
+        """
+        try:
+            with np.load(filename) as f:
+                if key is not None and not str(f['key']) == key:
+                    return None
+                return cls(f['q'], f['minimum'], f['maximum'],
+                           f['percentiles'], f['histograms'],
+                           f['counts'] if 'counts' in f else None,
+                           int(f['offset']))
+        except (OSError, KeyError, ValueError):
+            return None
+
+
+def _percentiles_from_counts(counts: np.ndarray,
+                             q: Sequence[float]) -> np.ndarray:
+    """
+    Percentiles of the values whose histogram is 'counts', one bin per
+    value, using the nearest-rank method.
+    """
+    cumulative = np.cumsum(counts)
+    ranks = np.asarray(q, dtype=np.float64) / 100 * (cumulative[-1] - 1)
+    return np.searchsorted(cumulative, ranks, side='right')
+
+
+def _value_range(dtype: np.dtype) -> Optional[Tuple[int, int]]:
+    """
+    Returns the offset and number of values of integer dtypes small enough
+    to bin every value, and None for other dtypes.
+    """
+    if dtype.kind in 'ui' and dtype.itemsize <= 2:
+        info = np.iinfo(dtype)
+        return int(info.min), int(info.max) - int(info.min) + 1
+    return None
+
+
+def _blocks(source, index: int) -> Iterator[np.ndarray]:
+    """
+    Yields the frame at 'index' in blocks of rows along its second to last
+    axis, each of at most STATS_BLOCK_NBYTES, if 'source' can read regions
+    of frames; otherwise, the whole frame.
+    """
+    frame_info = getattr(source, 'frame_info', None)
+    request_region = getattr(source, 'request_region', None)
+    if frame_info is None or request_region is None:
+        yield source.request(index)
+        return
+    shape, dtype = frame_info(index)
+    if len(shape) < 2:
+        yield source.request(index)
+        return
+    row_nbytes = int(np.prod(shape[:-2] + shape[-1:])) * dtype.itemsize
+    rows = max(STATS_BLOCK_NBYTES // max(row_nbytes, 1), 1)
+    for start in range(0, shape[-2], rows):
+        yield request_region(
+            index, (slice(start, start + rows), slice(None)))
+
+
+def _frames(source) -> Iterator[Iterator[np.ndarray]]:
+    """
+    Yields an iterator over the blocks of each frame of 'source', in order.
+    Datasources with 'frame_blocks' and 'read_block' methods are read in
+    blocks of whole frames aligned to their chunks, so that each chunk is
+    read and decompressed once, and each frame is a single block. Other
+    datasources are read frame by frame; see _blocks.
+    """
+    if hasattr(source, 'frame_blocks'):
+        try:
+            blocks = source.frame_blocks(STATS_BLOCK_NBYTES)
+        except TypeError:
+            pass
+        else:
+            head = (slice(None), ) * source.axis
+            for start, stop in blocks:
+                block = source.read_block(start, stop)
+                for j in range(stop - start):
+                    yield iter([block[head + (slice(j, j + 1), )]])
+            return
+    for i in range(len(source)):
+        yield _blocks(source, i)
+
+
+def compute_statistics(source, progress: Optional[Callable] = None,
+                       q: Sequence[float] = STATS_PERCENTILES,
+                       bins: int = STATS_BINS) -> FrameStatistics:
+    """
+    Computes the FrameStatistics of every frame of 'source', an image
+    datasource, in a single pass over the stack.
+
+    The stack is streamed in blocks of frames aligned to its chunks where
+    the datasource supports it (see _frames), or else in blocks of rows of
+    each frame. Frames of 8 and 16 bit integers are binned by value; their
+    minimum, maximum, percentiles and histograms are computed from those
+    counts. Frames of other dtypes are gathered whole.
+
+    Parameters
+    ------------
+    source
+        Image datasource.
+
+    progress : Optional[Callable]
+        Called with the number of frames done and the total number of
+        frames.
+
+    q : Sequence[float]
+        Percentiles to store for each frame.
+
+    bins : int
+        Number of bins of each frame's histogram.
+    """
+    n = len(source)
+    minimum = np.empty(n, dtype=np.float64)
+    maximum = np.empty(n, dtype=np.float64)
+    percentiles = np.empty((n, len(q)), dtype=np.float64)
+    histograms = np.zeros((n, bins), dtype=np.int64)
+    total = None
+    offset = 0
+
+    for i, blocks in enumerate(_frames(source)):
+        first = next(blocks)
+        value_range = _value_range(first.dtype)
+        if value_range is None:
+            frame = np.concatenate(list(chain([first], blocks)), axis=-2)
+            minimum[i], maximum[i] = frame.min(), frame.max()
+            percentiles[i] = np.percentile(frame, q)
+            histograms[i], _ = np.histogram(
+                frame, bins, (minimum[i], maximum[i]))
+        else:
+            offset, nvalues = value_range
+            counts = np.zeros(nvalues, dtype=np.int64)
+            for block in chain([first], blocks):
+                values = block.ravel()
+                if offset:
+                    values = values.astype(np.int32) - offset
+                counts += np.bincount(values, minlength=nvalues)
+            nonzero = np.flatnonzero(counts)
+            minimum[i] = nonzero[0] + offset
+            maximum[i] = nonzero[-1] + offset
+            percentiles[i] = _percentiles_from_counts(counts, q) + offset
+            values = np.arange(nonzero[0], nonzero[-1] + 1) + offset
+            histograms[i], _ = np.histogram(
+                values, bins, (minimum[i], maximum[i]),
+                weights=counts[nonzero[0]:nonzero[-1] + 1])
+            if total is None:
+                total = counts
+            else:
+                total += counts
+        if progress is not None:
+            progress(i + 1, n)
+
+    return FrameStatistics(q, minimum, maximum, percentiles, histograms,
+                           total, offset)
+
+
+def statistics_key(source) -> str:
+    """
+    Describes the data that 'source' reads: its files' names, sizes and
+    modification times, its Datasets, and its length.
+    """
+    filenames = getattr(source, 'filenames', None)
+    if filenames is None:
+        filenames = [source.filename]
+    files = []
+    for filename in filenames:
+        stat = os.stat(filename)
+        files.append((os.path.abspath(filename), stat.st_size,
+                      stat.st_mtime_ns))
+    names = [str(name) for name in
+             np.ravel(getattr(source, 'dataset_names', []))]
+    return repr((files, names, len(source)))
+
+
+def _statistics_filename(cache_dir: str, key: str) -> str:
+    digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, digest + '.stats.npz')
+
+
+def load_statistics(source, cache_dir: Optional[str] = CACHE_DIR,
+                    progress: Optional[Callable] = None) -> FrameStatistics:
+    """
+    Returns the FrameStatistics of 'source', computing them if they aren't
+    saved in a sidecar file in 'cache_dir' yet. The sidecar is only reused
+    while the source's files are unchanged.
+
+    Parameters
+    ------------
+    source
+        Image datasource.
+
+    cache_dir : Optional[str]
+        Directory of the sidecar files. If None, the statistics are always
+        computed.
+
+    progress : Optional[Callable]
+        See compute_statistics.
+    """
+    if cache_dir is None:
+        return compute_statistics(source, progress)
+    key = statistics_key(source)
+    filename = _statistics_filename(cache_dir, key)
+    stats = FrameStatistics.load(filename, key)
+    if stats is None:
+        stats = compute_statistics(source, progress)
+        # failing to save the statistics isn't an error; they'll just be
+        # computed again next time
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            stats.save(filename, key)
+        except OSError:
+            pass
+    return stats
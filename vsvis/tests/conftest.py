@@ -46,5 +46,18 @@ def pytest_runtest_setup(item):
         if previousfailed is not None:
             pytest.xfail("previous test failed (%s)" % previousfailed.name)
 
+
+@pytest.fixture(autouse=True)
+def cache_dir(tmpdir, monkeypatch):
+    """
+    Keeps the sidecar files written while testing out of the user's cache
+    directory.
+    """
+    from .. import file_inspection_dialog, main_window
+    cache_dir = str(tmpdir.join('cache'))
+    monkeypatch.setattr(file_inspection_dialog, 'CACHE_DIR', cache_dir)
+    monkeypatch.setattr(main_window, 'CACHE_DIR', cache_dir)
+    return cache_dir
+
 # also see this for tests with dependencies:
 # https://stackoverflow.com/questions/50584294/how-to-control-the-incremental-test-case-in-pytest
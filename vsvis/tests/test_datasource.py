@@ -0,0 +1,740 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import os
+import struct
+import subprocess
+import sys
+import threading
+import pytest
+import h5py
+import numpy as np
+from os.path import join
+
+from ..cache import FrameBufferPool, FrameCache
+from ..chunks import ParallelChunkReader, supports_direct_chunks
+from ..config import DataType, Dimension, TEST_DIR
+from ..datasource import (
+    CSRCoordinates, HDF5FilePool, HDF5MultiFileDataSource, HDF5Request1D,
+    HDF5Request2D, HDF5RequestND, HDF5DataSource, chunk_cache_size,
+    image_request, memmap_dataset)
+from .. import prefetch
+from ..prefetch import Prefetcher
+from ..registry import HDF5FileRegistry, file_registry
+from ..tiff_datasource import TiffDataSource
+
+
+@pytest.fixture
+def stacked_h5file(tmpdir):
+    """
+    HDF5 file with three image Datasets of different lengths along axis 0.
+    Pixel values equal the frame's index in the virtual stack.
+    """
+    filename = str(tmpdir.join('stacked.h5'))
+    lengths = (4, 1, 3)
+    with h5py.File(filename, 'w') as h5file:
+        start = 0
+        for i, n in enumerate(lengths):
+            data = np.arange(start, start + n, dtype=np.uint16)
+            data = np.broadcast_to(data[:, None, None], (n, 8, 6))
+            h5file.create_dataset('/image/{}'.format(i), data=data)
+            start += n
+    names = [['/image/{}'.format(i)] for i in range(len(lengths))]
+    return filename, names, sum(lengths)
+
+
+class TestHDF5Request1D(object):
+    def test_length(self, stacked_h5file):
+        filename, names, length = stacked_h5file
+        req = HDF5Request1D(filename, names, axis=0)
+        assert req.length == length
+
+    def test_locate(self, stacked_h5file):
+        filename, names, length = stacked_h5file
+        req = HDF5Request1D(filename, names, axis=0)
+        assert req.locate(0) == (0, 0)
+        assert req.locate(3) == (0, 3)
+        assert req.locate(4) == (1, 0)
+        assert req.locate(5) == (2, 0)
+        assert req.locate(-1) == (2, 2)
+
+        name, sl = req(6)
+        assert name == '/image/2'
+        assert sl == (slice(1, 2), )
+
+    def test_out_of_range(self, stacked_h5file):
+        filename, names, length = stacked_h5file
+        req = HDF5Request1D(filename, names, axis=0)
+        with pytest.raises(IndexError):
+            req(length)
+        with pytest.raises(IndexError):
+            req(-length - 1)
+
+    def test_datasource(self, stacked_h5file):
+        filename, names, length = stacked_h5file
+        req = HDF5Request1D(filename, names, axis=0)
+        with HDF5DataSource(filename, req) as source:
+            assert len(source) == length
+            for index in range(-length, length):
+                frame = source.request(index)
+                assert frame.shape == (1, 8, 6)
+                assert np.all(frame == index % length)
+
+
+class TestFrameCache(object):
+    def test_lru_eviction(self):
+        frame = np.zeros(10, dtype=np.uint8)
+        cache = FrameCache(maxbytes=3 * frame.nbytes)
+        for i in range(3):
+            cache.put(i, frame.copy())
+        assert cache.get(0) is not None
+        cache.put(3, frame.copy())
+
+        # key 1 is the least recently used
+        assert 1 not in cache
+        assert 0 in cache and 2 in cache and 3 in cache
+        assert cache.nbytes == 3 * frame.nbytes
+        assert cache.evictions == 1
+
+    def test_oversized(self):
+        cache = FrameCache(maxbytes=4)
+        cache.put(0, np.zeros(5, dtype=np.uint8))
+        assert len(cache) == 0
+
+    def test_datasource_hits(self, stacked_h5file):
+        filename, names, length = stacked_h5file
+        req = HDF5Request1D(filename, names, axis=0)
+        cache = FrameCache(maxbytes=2**20)
+        with HDF5DataSource(filename, req, cache, memmap=False) as source:
+            first = source.request(2)
+            assert cache.misses == 1 and cache.hits == 0
+            assert source.request(2) is first
+            assert cache.hits == 1
+            assert not first.flags.writeable
+
+
+class TestPrefetcher(object):
+    def test_direction(self, stacked_h5file):
+        filename, names, length = stacked_h5file
+        req = HDF5Request1D(filename, names, axis=0)
+        with HDF5DataSource(filename, req, memmap=False) as source:
+            # scrolling as fast as the test runs doesn't widen the window
+            prefetcher = Prefetcher({DataType.IMAGE: source}, window=2,
+                                    lookahead=0)
+            try:
+                assert prefetcher.update(3) == [4, 5]
+                assert prefetcher.update(5) == [7]
+                # reversing direction
+                assert prefetcher.update(4) == [3, 2]
+                assert prefetcher.direction == -1
+            finally:
+                prefetcher.shutdown()
+            assert (filename, '/image/2', ((0, 1, None), )) in source.cache
+
+    def test_rate(self):
+        sources = {DataType.IMAGE: list(range(100))}
+        prefetcher = Prefetcher(sources, window=2, max_window=10,
+                                lookahead=0.5)
+        prefetcher._load = lambda index: None
+        try:
+            assert prefetcher.frames_ahead() == 2
+            prefetcher.rate = 8.
+            assert prefetcher.frames_ahead() == 4
+            prefetcher.rate = 1000.
+            assert prefetcher.frames_ahead() == 10
+            assert len(prefetcher.update(50)) == 10
+            prefetcher.window = 0
+            assert prefetcher.frames_ahead() == 0
+        finally:
+            prefetcher.shutdown()
+
+    def test_rate_decays(self, monkeypatch):
+        now = [0.]
+        monkeypatch.setattr(prefetch.time, 'monotonic', lambda: now[0])
+        prefetcher = Prefetcher({DataType.IMAGE: list(range(1000))},
+                                window=8, max_window=32, lookahead=0.5)
+        prefetcher._load = lambda index: None
+        try:
+            # a one-second scrub at 100 frames per second
+            for i in range(101):
+                prefetcher.update(i)
+                now[0] += 0.01
+            assert prefetcher.frames_ahead() == 32
+            # one step after a pause
+            now[0] += 30
+            assert len(prefetcher.update(101)) == 8
+            assert prefetcher.rate < 1
+        finally:
+            prefetcher.shutdown()
+
+    def test_cancel_waits(self):
+        started = threading.Event()
+        release = threading.Event()
+        done = []
+
+        def load(index):
+            started.set()
+            release.wait(5)
+            done.append(index)
+
+        prefetcher = Prefetcher({DataType.IMAGE: list(range(10))}, window=1)
+        prefetcher._load = load
+        prefetcher.update(0)
+        assert started.wait(5)
+        threading.Timer(0.1, release.set).start()
+        prefetcher.cancel(wait_started=True)
+        # the read that had started finished before cancel returned
+        assert done == [1]
+        prefetcher.shutdown()
+
+
+class TestMemmap(object):
+    def test_contiguous(self, stacked_h5file):
+        filename, names, length = stacked_h5file
+        with h5py.File(filename, 'r') as h5file:
+            mapped = memmap_dataset(h5file['/image/0'])
+            assert isinstance(mapped, np.memmap)
+            assert np.all(mapped == h5file['/image/0'][()])
+
+        req = HDF5Request1D(filename, names, axis=0)
+        with HDF5DataSource(filename, req, memmap=True) as source:
+            frame = source.request(5)
+            assert isinstance(frame, np.memmap)
+            assert np.all(frame == 5)
+            assert len(source.cache) == 0
+
+    def test_compressed(self, tmpdir):
+        filename = str(tmpdir.join('compressed.h5'))
+        with h5py.File(filename, 'w') as h5file:
+            h5file.create_dataset('data', data=np.ones((2, 4, 4)),
+                                  compression='gzip')
+            assert memmap_dataset(h5file['data']) is None
+
+
+class TestTiffDataSource(object):
+    filename = join(TEST_DIR, 'data', 'test.tif')
+
+    def test_pages(self):
+        with TiffDataSource(self.filename) as source:
+            assert len(source) == 3
+            frame = source.request(-1)
+            assert frame.shape == (1, 128, 128)
+            assert frame.dtype.kind == 'u' and frame.dtype.itemsize == 2
+            with pytest.raises(IndexError):
+                source.request(3)
+
+    def test_samples(self, tmpdir):
+        # a single uncompressed RGB page of 3 rows and 2 columns
+        data = np.arange(18, dtype=np.uint8).reshape(3, 2, 3)
+        tags = [(256, 3, 1, 2), (257, 3, 1, 3), (258, 3, 1, 8),
+                (259, 3, 1, 1), (273, 4, 1, 8), (277, 3, 1, 3),
+                (278, 3, 1, 3), (279, 4, 1, data.nbytes)]
+        ifd = 8 + data.nbytes
+        header = struct.pack('<2sHI', b'II', 42, ifd)
+        entries = b''.join(struct.pack('<HHII', *tag) for tag in tags)
+        filename = str(tmpdir.join('rgb.tif'))
+        with open(filename, 'wb') as f:
+            f.write(header + data.tobytes()
+                    + struct.pack('<H', len(tags)) + entries
+                    + struct.pack('<I', 0))
+
+        with TiffDataSource(filename) as source:
+            frame = source.request(0)
+            assert frame.shape == (1, 2, 3)
+            assert np.all(frame[0] == data[..., 0].T)
+        with TiffDataSource(filename, sample=2) as source:
+            assert np.all(source.request(0)[0] == data[..., 2].T)
+        with TiffDataSource(filename, sample=3) as source:
+            with pytest.raises(IndexError):
+                source.request(0)
+
+
+class TestChunkedReads(object):
+    @pytest.fixture
+    def chunked_h5file(self, tmpdir):
+        filename = str(tmpdir.join('chunked.h5'))
+        data = np.arange(10, dtype=np.uint16)
+        data = np.broadcast_to(data[:, None, None], (10, 64, 32))
+        with h5py.File(filename, 'w') as h5file:
+            h5file.create_dataset('data', data=data, chunks=(4, 32, 32),
+                                  compression='gzip')
+        return filename
+
+    def test_chunk_cache_size(self, chunked_h5file):
+        kwargs = chunk_cache_size(chunked_h5file, ['data'], 0)
+        # one frame spans two chunks
+        assert kwargs['rdcc_nbytes'] >= 2 * 4 * 32 * 32 * 2
+        assert kwargs['rdcc_nslots'] >= 200
+
+    def test_chunk_aligned_block(self, chunked_h5file):
+        req = HDF5Request1D(chunked_h5file, [['data']], axis=0)
+        with HDF5DataSource(chunked_h5file, req) as source:
+            assert np.all(source.request(9) == 9)
+            # the last chunk only holds two frames
+            assert len(source.cache) == 2
+            assert np.all(source.request(5) == 5)
+            assert len(source.cache) == 6
+            assert source.cache.misses == 2
+            for i in range(4, 8):
+                assert np.all(source.request(i) == i)
+            assert source.cache.misses == 2
+            # cached frames don't keep the block they were read from alive
+            frames = [source.request(i) for i in range(4, 8)]
+            assert all(frame.base is None for frame in frames)
+
+    def test_read_into_chunk_aligned(self, chunked_h5file):
+        req = HDF5Request1D(chunked_h5file, [['data']], axis=0)
+        with HDF5DataSource(chunked_h5file, req) as source:
+            out = np.empty(*source.frame_info(1))
+            assert source.read_into(1, out) is out
+            assert np.all(out == 1)
+            # the rest of the chunk was cached rather than thrown away
+            assert len(source.cache) == 4
+            source.read_into(2, out)
+            assert np.all(out == 2)
+            assert source.cache.misses == 1
+
+
+class TestCSRCoordinates(object):
+    filename = join(TEST_DIR, 'data', 'test.h5')
+
+    def test_predicted(self):
+        names = [['/predicted/coordinates/{}'.format(i),
+                  '/predicted/probabilities/{}'.format(i)] for i in range(3)]
+        with h5py.File(self.filename, 'r') as h5file:
+            coordinates = CSRCoordinates.from_hdf5(h5file, names)
+            assert len(coordinates) == 3
+            for i, (xy, prob) in enumerate(names):
+                frame = coordinates[i]
+                assert frame.shape == (h5file[xy].shape[0], 3)
+                assert np.all(frame[:, :2] == h5file[xy][()])
+                assert np.all(frame[:, 2] == h5file[prob][()])
+                # frames are views of the concatenated array
+                assert frame.base is coordinates.values
+
+    def test_datasource(self):
+        names = [['/ground_truth/{}'.format(i)] for i in range(3)]
+        req = HDF5Request2D(self.filename, names)
+        with HDF5DataSource(self.filename, req) as source:
+            assert len(source) == 3
+            frame = source.request(1)
+            assert frame.dtype == np.float32
+            assert frame.shape[1] == 2
+            assert np.all(frame == source.h5file['/ground_truth/1'][()])
+
+
+def _append(filename, code):
+    """
+    Runs 'code' in another process with the HDF5 file open as 'h5file', as a
+    writer appending to a file being followed would.
+    """
+    script = ('import h5py, numpy as np\n'
+              'with h5py.File({!r}, "r+", libver="latest") as h5file:\n'
+              '    {}\n').format(filename, code)
+    env = dict(os.environ, HDF5_USE_FILE_LOCKING='FALSE')
+    subprocess.run([sys.executable, '-c', script], check=True, env=env)
+
+
+class TestRefresh(object):
+    @pytest.fixture
+    def growing_h5file(self, tmpdir):
+        filename = str(tmpdir.join('growing.h5'))
+        with h5py.File(filename, 'w', libver='latest') as h5file:
+            h5file.create_dataset(
+                '/image/data', data=np.zeros((2, 8, 6), dtype=np.uint16),
+                maxshape=(None, 8, 6), chunks=(1, 8, 6))
+            for i in range(3):
+                h5file.create_dataset(
+                    '/coordinates/{}'.format(i),
+                    data=np.full((i, 2), i, dtype=np.float32),
+                    maxshape=(None, 2), chunks=(4, 2))
+        return filename
+
+    def test_frames_appended(self, growing_h5file):
+        req = HDF5Request1D(growing_h5file, [['/image/data']], axis=0,
+                            swmr=True)
+        with HDF5DataSource(growing_h5file, req, swmr=True) as source:
+            assert len(source) == 2
+            source.request(1)
+            _append(growing_h5file,
+                    'd = h5file["/image/data"]; d.resize((5, 8, 6)); '
+                    'd[2:] = 7')
+            assert np.array_equal(source.refresh(), [2, 3, 4])
+            assert len(source) == 5
+            assert np.all(source.request(4) == 7)
+            assert not len(source.refresh())
+
+    def test_earlier_dataset_grows(self, stacked_h5file):
+        filename, names, length = stacked_h5file
+        req = HDF5Request1D(filename, names, axis=0)
+        with h5py.File(filename, 'r') as h5file:
+            datasets = [h5file[n] for n in req.dataset_names]
+            # nothing changed, so the first new frame is past the end
+            assert req.refresh(datasets) == length
+            req._offsets[1:] -= 1
+            # as if the first Dataset grew by a frame, moving later frames
+            assert req.refresh(datasets) == 3
+        assert req.length == length
+
+    def test_coordinates_appended(self, growing_h5file):
+        names = [['/coordinates/{}'.format(i)] for i in range(3)]
+        req = HDF5Request2D(growing_h5file, names)
+        with HDF5DataSource(growing_h5file, req, swmr=True) as source:
+            assert len(source.request(1)) == 1
+            _append(growing_h5file,
+                    'd = h5file["/coordinates/1"]; d.resize((3, 2)); '
+                    'd[1:] = 5')
+            assert np.array_equal(source.refresh(), [1])
+            assert np.array_equal(source.request(1)[:, 0], [1, 5, 5])
+            assert np.array_equal(source.request(2), np.full((2, 2), 2))
+
+    def test_coordinates_appended_in_place(self, growing_h5file):
+        names = [['/coordinates/{}'.format(i)] for i in range(3)]
+        req = HDF5Request2D(growing_h5file, names)
+        with HDF5DataSource(growing_h5file, req, swmr=True) as source:
+            coordinates = source.coordinates
+            for n in (4, 5):
+                _append(growing_h5file,
+                        'd = h5file["/coordinates/2"]; d.resize(({}, 2)); '
+                        'd[2:] = 9'.format(n))
+                before = coordinates.values
+                assert np.array_equal(source.refresh(), [2])
+                assert np.array_equal(source.request(2)[:, 0],
+                                      [2, 2] + [9] * (n - 2))
+            # the buffer grown by the first refresh had room for the row
+            # appended by the second one
+            assert np.shares_memory(before, coordinates.values)
+            assert np.array_equal(source.request(1), [[1, 1]])
+
+
+class TestMultiFile(object):
+    @pytest.fixture
+    def h5files(self, tmpdir):
+        """
+        Five files with two frames each; pixel values equal the frame's
+        index in the virtual stack.
+        """
+        filenames = []
+        for i in range(5):
+            filename = str(tmpdir.join('block{}.h5'.format(i)))
+            data = np.arange(2 * i, 2 * i + 2, dtype=np.uint16)
+            with h5py.File(filename, 'w') as h5file:
+                h5file['/image/data'] = np.broadcast_to(
+                    data[:, None, None], (2, 8, 6))
+            filenames.append(filename)
+        return filenames
+
+    def test_pool_eviction(self, h5files):
+        pool = HDF5FilePool(2)
+        for filename in h5files[:3]:
+            pool.file(filename)
+        assert len(pool) == 2
+        assert h5files[0] not in pool
+        # using a file makes it the most recently used one
+        pool.file(h5files[1])
+        pool.file(h5files[3])
+        assert h5files[1] in pool and h5files[2] not in pool
+        pool.close()
+        assert len(pool) == 0
+
+    def test_stack(self, h5files):
+        with HDF5MultiFileDataSource(h5files, ['/image/data'],
+                                     max_open_files=2) as source:
+            assert len(source) == 10
+            assert len(source.pool) == 2
+            for i in range(len(source)):
+                frame = source.request(i)
+                assert frame.shape == (1, 8, 6)
+                assert np.all(frame == i)
+                assert len(source.pool) <= 2
+            # indexing the stack and then scrolling through it opens each
+            # file once per pass, not once per frame
+            assert source.pool.opens == 5 + 5
+            assert np.all(source.request(-1) == 9)
+
+    def test_progress(self, h5files):
+        calls = []
+        with HDF5MultiFileDataSource(
+                h5files, ['/image/data'],
+                progress=lambda done, total: calls.append((done, total))):
+            pass
+        assert calls[-1] == (5, 5)
+
+
+class TestFileRegistry(object):
+    def test_refcount(self, stacked_h5file):
+        filename, names, length = stacked_h5file
+        registry = HDF5FileRegistry()
+        a = registry.acquire(filename)
+        b = registry.acquire(filename)
+        assert a is b
+        assert registry.refcount(filename) == 2
+        assert not registry.release(a)
+        assert b['/image/0'].shape == (4, 8, 6)
+        assert registry.release(b)
+        assert len(registry) == 0
+        with pytest.raises(ValueError):
+            registry.release(a)
+
+    def test_shared_by_datasources(self, stacked_h5file):
+        filename, names, length = stacked_h5file
+        image = HDF5DataSource(
+            filename, HDF5Request1D(filename, names, axis=0))
+        data = HDF5DataSource(filename, HDF5Request2D(filename, names))
+        assert image.h5file is data.h5file
+        assert file_registry.refcount(filename) == 2
+        image.cleanup()
+        # cleaning up twice doesn't release the file on data's behalf
+        image.cleanup()
+        assert file_registry.refcount(filename) == 1
+        assert data.h5file['/image/0'].shape == (4, 8, 6)
+        data.cleanup()
+        assert file_registry.refcount(filename) == 0
+
+    def test_larger_chunk_cache(self, tmpdir):
+        filename = str(tmpdir.join('chunked.h5'))
+        with h5py.File(filename, 'w') as h5file:
+            h5file.create_dataset('/image', data=np.zeros((4, 8, 6)),
+                                  chunks=(2, 8, 6))
+        nbytes = 64 * 2**20
+        with HDF5DataSource(filename, HDF5Request2D(filename, [['/image']])):
+            req = HDF5Request1D(filename, [['/image']], axis=0)
+            with HDF5DataSource(filename, req, rdcc_nbytes=nbytes,
+                                memmap=False) as source:
+                dset = source._get_dataset('/image')
+                cache = dset.id.get_access_plist().get_chunk_cache()
+                assert cache[1] == nbytes
+
+
+class TestParallelChunkReader(object):
+    @pytest.fixture
+    def compressed_h5file(self, tmpdir):
+        filename = str(tmpdir.join('compressed.h5'))
+        rng = np.random.RandomState(0)
+        with h5py.File(filename, 'w') as h5file:
+            h5file.create_dataset(
+                '/shuffled', data=rng.randint(0, 4096, (3, 50, 70)),
+                dtype=np.uint16, chunks=(1, 16, 16), compression='gzip',
+                shuffle=True)
+            # partly written, big-endian, with a fill value
+            dset = h5file.create_dataset(
+                '/sparse', shape=(4, 40, 40), dtype='>i4', chunks=(2, 16, 16),
+                compression='gzip', fillvalue=-3)
+            dset[0, :20, :] = 7
+            h5file.create_dataset('/lzf', data=np.zeros((2, 8, 8)),
+                                  chunks=(1, 8, 8), compression='lzf')
+        return filename
+
+    @pytest.fixture
+    def reader(self):
+        reader = ParallelChunkReader(max_workers=4)
+        yield reader
+        reader.shutdown()
+
+    def test_supported(self, compressed_h5file):
+        with h5py.File(compressed_h5file, 'r') as h5file:
+            assert supports_direct_chunks(h5file['/shuffled'])
+            assert supports_direct_chunks(h5file['/sparse'])
+            assert not supports_direct_chunks(h5file['/lzf'])
+
+    @pytest.mark.parametrize('name, selection', [
+        ('/shuffled', (slice(1, 2), )),
+        ('/shuffled', (slice(0, 3), slice(5, 37), slice(20, 70))),
+        ('/sparse', (slice(0, 4), )),
+        ('/sparse', (slice(0, 1), slice(10, 30), slice(0, 5)))])
+    def test_read(self, compressed_h5file, reader, name, selection):
+        with h5py.File(compressed_h5file, 'r') as h5file:
+            dset = h5file[name]
+            expected = dset[selection]
+            actual = reader.read(dset, selection)
+        assert actual.dtype == expected.dtype
+        assert np.array_equal(actual, expected)
+
+    def test_read_into(self, compressed_h5file, reader):
+        with h5py.File(compressed_h5file, 'r') as h5file:
+            dset = h5file['/shuffled']
+            out = np.empty((1, 50, 70), dtype=np.uint16)
+            assert reader.read(dset, (slice(2, 3), ), out) is out
+            assert np.array_equal(out, dset[2:3])
+            with pytest.raises(ValueError):
+                reader.read(dset, (slice(0, 2), ), out)
+
+    def test_datasource(self, compressed_h5file, reader):
+        req = HDF5Request1D(compressed_h5file, [['/shuffled']], axis=0)
+        with HDF5DataSource(compressed_h5file, req,
+                            chunk_reader=reader) as source, \
+                h5py.File(compressed_h5file, 'r') as h5file:
+            for i in range(len(source)):
+                assert np.array_equal(source.request(i),
+                                      h5file['/shuffled'][i:i + 1])
+
+
+class TestReadInto(object):
+    def test_buffer_pool(self):
+        pool = FrameBufferPool(maxbuffers=1)
+        a = pool.acquire((8, 6), np.uint16)
+        pool.release(a)
+        assert pool.acquire((8, 6), np.uint16) is a
+        assert pool.acquire((8, 6), np.uint8) is not a
+        assert pool.allocations == 2
+
+    @pytest.mark.parametrize('memmap', [True, False])
+    def test_read_into(self, stacked_h5file, memmap):
+        filename, names, length = stacked_h5file
+        req = HDF5Request1D(filename, names, axis=0)
+        with HDF5DataSource(filename, req, memmap=memmap) as source:
+            shape, dtype = source.frame_info(5)
+            assert shape == (1, 8, 6)
+            out = np.empty(shape, dtype=dtype)
+            for i in range(length):
+                assert source.read_into(i, out) is out
+                assert np.all(out == i)
+            # frames read into buffers aren't cached
+            assert len(source.cache) == 0
+            cached = source.request(2)
+            source.read_into(2, out)
+            assert np.array_equal(out, cached)
+            with pytest.raises(ValueError):
+                source.read_into(0, np.empty((8, 6), dtype=dtype))
+
+
+class TestRequestRegion(object):
+    @pytest.fixture
+    def mosaic_h5file(self, tmpdir):
+        filename = str(tmpdir.join('mosaic.h5'))
+        data = np.arange(3 * 40 * 30, dtype=np.uint16).reshape(3, 40, 30)
+        with h5py.File(filename, 'w') as h5file:
+            h5file.create_dataset('/image/data', data=data, chunks=(1, 8, 8))
+        return filename, data
+
+    @pytest.mark.parametrize('memmap', [True, False])
+    def test_region(self, mosaic_h5file, memmap):
+        filename, data = mosaic_h5file
+        req = HDF5Request1D(filename, [['/image/data']], axis=0)
+        region = (slice(8, 24), slice(16, 30))
+        with HDF5DataSource(filename, req, memmap=memmap) as source:
+            arr = source.request_region(1, region)
+            assert np.array_equal(arr, data[1:2, 8:24, 16:30])
+            # regions aren't cached
+            assert len(source.cache) == 0
+            source.request(2)
+            arr = source.request_region(2, region)
+            assert np.array_equal(arr, data[2:3, 8:24, 16:30])
+
+    def test_multifile(self, mosaic_h5file):
+        filename, data = mosaic_h5file
+        with HDF5MultiFileDataSource([filename], ['/image/data']) as source:
+            assert source.frame_info(0) == ((1, 40, 30), np.uint16)
+            arr = source.request_region(0, (slice(0, 5), slice(-3, None)))
+            assert np.array_equal(arr, data[0:1, 0:5, -3:])
+
+
+class TestRequestND(object):
+    @pytest.fixture
+    def nd_h5file(self, tmpdir):
+        """
+        Dataset of shape [T, Z, C, x, y] whose pixels equal 100 * t + 10 * z
+        + c.
+        """
+        filename = str(tmpdir.join('nd.h5'))
+        t, z, c = np.meshgrid(np.arange(4), np.arange(3), np.arange(2),
+                              indexing='ij')
+        values = (100 * t + 10 * z + c).astype(np.uint16)
+        data = np.broadcast_to(values[..., None, None], (4, 3, 2, 8, 6))
+        with h5py.File(filename, 'w') as h5file:
+            dset = h5file.create_dataset('/image/nd', data=data)
+            for i, label in enumerate(['t', 'z', 'c']):
+                dset.dims[i].label = label
+        return filename
+
+    def test_index(self, nd_h5file):
+        req = HDF5RequestND(nd_h5file, '/image/nd')
+        assert req.dimensions == (Dimension.T, Dimension.Z, Dimension.C)
+        assert req.length == 24
+        assert req.position(req.index((2, 1, 1))) == (2, 1, 1)
+        assert req.position(-1) == (3, 2, 1)
+        with pytest.raises(IndexError):
+            req.position(24)
+        with pytest.raises(ValueError):
+            HDF5RequestND(nd_h5file, '/image/nd', [Dimension.T])
+
+    def test_datasource(self, nd_h5file):
+        req = image_request(nd_h5file, [['/image/nd']])
+        assert isinstance(req, HDF5RequestND)
+        with HDF5DataSource(nd_h5file, req, memmap=False) as source:
+            assert source.frame_index is req
+            assert len(source) == 24
+            frame = source.request(req.index((3, 2, 1)))
+            assert frame.shape == (1, 1, 1, 8, 6)
+            assert np.all(frame == 321)
+            # frames at other positions stay cached
+            for z in range(3):
+                source.request(req.index((1, z, 0)))
+            assert len(source.cache) == 4
+
+    def test_channels(self, nd_h5file):
+        req = HDF5RequestND(nd_h5file, '/image/nd')
+        with HDF5DataSource(nd_h5file, req, memmap=False) as source:
+            assert source.channels == 2
+            planes = source.request_channels(req.index((3, 1, 1)))
+            assert planes.shape == (2, 8, 6)
+            assert np.all(planes[0] == 310) and np.all(planes[1] == 311)
+            # one hyperslab, cached once
+            assert len(source.cache) == 1
+            source.request_channels(req.index((3, 1, 0)))
+            assert len(source.cache) == 1
+
+    def test_prefetch(self, nd_h5file):
+        req = HDF5RequestND(nd_h5file, '/image/nd')
+        assert list(req.frames_along(req.index((1, 2, 1)), Dimension.T)) == [
+            req.index((t, 2, 1)) for t in range(4)]
+        with HDF5DataSource(nd_h5file, req, memmap=False) as source:
+            prefetcher = Prefetcher({DataType.IMAGE: source}, window=2,
+                                    lookahead=0)
+            prefetcher._load = lambda index: None
+            try:
+                # the next time points, rather than the next channel
+                assert prefetcher.update(req.index((0, 2, 1))) == [
+                    req.index((1, 2, 1)), req.index((2, 2, 1))]
+                # scrolling through Z
+                assert prefetcher.update(req.index((0, 1, 1))) == [
+                    req.index((0, 0, 1))]
+                assert prefetcher.dimension == Dimension.Z
+                assert prefetcher.direction == -1
+                # jumps along several Dimensions keep following Z
+                assert prefetcher.update(req.index((3, 2, 0))) == [
+                    req.index((3, 1, 0)), req.index((3, 0, 0))]
+            finally:
+                prefetcher.shutdown()
+
+    def test_unlabelled(self, tmpdir):
+        filename = str(tmpdir.join('tz.h5'))
+        with h5py.File(filename, 'w') as h5file:
+            h5file['data'] = np.zeros((2, 3, 4, 5), dtype=np.uint8)
+        req = image_request(filename, [['data']])
+        assert req.dimensions == (Dimension.T, Dimension.Z)
+        with HDF5DataSource(filename, req) as source:
+            assert source.channels == 1
+            with pytest.raises(TypeError):
+                source.request_channels(0)
+        # stacks of frames keep using HDF5Request1D
+        with h5py.File(filename, 'a') as h5file:
+            h5file['stack'] = np.zeros((2, 4, 5), dtype=np.uint8)
+        assert isinstance(image_request(filename, [['stack']]), HDF5Request1D)
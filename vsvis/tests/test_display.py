@@ -0,0 +1,119 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import pytest
+import numpy as np
+from qtpy.QtGui import QImage
+
+from ..cache import FrameBufferPool
+from ..display import DisplayLUT, colormap
+from ..models.scene import VGraphicsScene
+
+
+class TestDisplayLUT(object):
+    @pytest.mark.parametrize('dtype', [np.uint8, np.uint16, np.int16])
+    def test_map(self, dtype):
+        array = np.array([[-5, 0], [100, 200]]).astype(dtype)
+        lut = DisplayLUT()
+        limits = (0, 200)
+        expected = VGraphicsScene.rescale_array(array, limits=limits)
+        levels = lut.map(array, limits)
+        assert levels.dtype == np.uint8
+        assert np.abs(levels.astype(int) - expected).max() <= 1
+
+    def test_transposed(self):
+        array = np.arange(12, dtype=np.uint16).reshape(3, 4)
+        out = np.empty((4, 3), dtype=np.uint8)
+        lut = DisplayLUT()
+        assert lut.map(array.T, out=out) is out
+        assert np.array_equal(out, lut.map(array).T)
+
+    def test_tables_cached(self):
+        lut = DisplayLUT(maxtables=2)
+        table = lut.table(np.uint16, (0, 1000))
+        assert lut.table(np.uint16, (0, 1000)) is table
+        lut.table(np.uint16, (0, 2000))
+        lut.table(np.uint8, (0, 100))
+        assert lut.table(np.uint16, (0, 1000)) is not table
+
+    def test_gamma(self):
+        lut = DisplayLUT(gamma=2)
+        levels = lut.map(np.array([[0, 25, 100]], dtype=np.uint8), (0, 100))
+        assert levels.tolist() == [[0, 128, 255]]
+        with pytest.raises(ValueError):
+            lut.set_gamma(0)
+
+    def test_formats(self, qtbot):
+        lut = DisplayLUT()
+        array = np.array([[0, 65535]], dtype=np.uint16)
+        qimage = lut.to_qimage(array, (0, 65535))
+        assert qimage.format() == QImage.Format_Grayscale16
+        assert lut.to_qimage(array).format() == QImage.Format_Grayscale8
+        lut.set_colormap('hot')
+        qimage = lut.to_qimage(array)
+        assert qimage.format() == QImage.Format_Indexed8
+        assert qimage.colorTable()[-1] == lut.color_table[-1]
+        assert colormap('hot')[-1].tolist() == [255, 255, 255]
+        with pytest.raises(ValueError):
+            lut.set_colormap('nonexistent')
+
+    def test_array2pixmap(self, qtbot):
+        buffers = FrameBufferPool()
+        lut = DisplayLUT(colormap='red')
+        image = np.arange(48, dtype=np.uint16).reshape(8, 6).T
+        pixmap = VGraphicsScene.array2pixmap(image, True, buffers, None, lut)
+        assert (pixmap.width(), pixmap.height()) == (8, 6)
+        color = pixmap.toImage().pixelColor(7, 5)
+        assert (color.red(), color.green(), color.blue()) == (255, 0, 0)
+        # floats are rescaled, then shown with the colormap
+        pixmap = VGraphicsScene.array2pixmap(image.astype(float), lut=lut)
+        assert pixmap.toImage().pixelColor(7, 5).red() == 255
+
+
+class TestComposite(object):
+    def test_blend(self, qtbot):
+        red = np.array([[0, 100], [100, 100]], dtype=np.uint16)
+        green = np.array([[0, 0], [10, 20]], dtype=np.uint8)
+        luts = [DisplayLUT(colormap='red'), DisplayLUT(colormap='green')]
+        buffers = FrameBufferPool()
+        pixmap = VGraphicsScene.composite2pixmap(
+            [red, green], luts, [(0, 100), (0, 20)], buffers)
+        image = pixmap.toImage()
+        assert image.format() == QImage.Format_RGB32
+        colors = [[image.pixelColor(x, y).getRgb()[:3] for x in range(2)]
+                  for y in range(2)]
+        assert colors == [[(0, 0, 0), (255, 0, 0)],
+                          [(255, 128, 0), (255, 255, 0)]]
+
+    def test_saturation(self, qtbot):
+        plane = np.full((3, 2), 200, dtype=np.uint8)
+        luts = [DisplayLUT(colormap='gray'), DisplayLUT(colormap='gray')]
+        pixmap = VGraphicsScene.composite2pixmap(
+            [plane, plane.astype(np.float32)], luts, [(0, 255), (0, 255)])
+        color = pixmap.toImage().pixelColor(1, 2)
+        assert (pixmap.width(), pixmap.height()) == (2, 3)
+        assert color.getRgb()[:3] == (255, 255, 255)
+
+    def test_rgb_table(self):
+        lut = DisplayLUT(colormap='magenta')
+        rgb = lut.rgb_table(np.uint16, (0, 100))
+        assert rgb.shape == (65536, 3)
+        assert rgb[100].tolist() == [255, 0, 255]
+        assert lut.rgb_table(np.uint16, (0, 100)) is rgb
@@ -160,3 +160,34 @@ class TestVFileInspectionDialog(AbstractTest):
         assert len(tree_view.selectedIndexes()) == 2
         assert table_model.rowCount() == 2
         # assert 0
+
+
+class TestLazyVFileInspectionDialog(TestVFileInspectionDialog):
+    def create_complete_widget(self, qtbot):
+        widget = self.create(qtbot, DataType.PREDICTED)
+        widget.load(self.h5file, *self.parameters, lazy=True)
+        widget.add_list_widget('title_1', widget.attributes[:2])
+        widget.add_list_widget('title_2', widget.attributes[:2])
+        return widget
+
+    def test_fetch(self, qtbot):
+        widget = self.create_complete_widget(qtbot)
+        tree_model = widget.file_structure_tree_view.model()
+        root = QModelIndex()
+        assert tree_model.canFetchMore(root)
+        tree_model.fetchMore(root)
+        assert tree_model.rowCount(root) == 3
+
+        image = tree_model.index(1, 0, root)
+        assert tree_model.hasChildren(image)
+        assert tree_model.rowCount(image) == 0
+        tree_model.fetchMore(image)
+        assert tree_model.rowCount(image) == 1
+
+        data = tree_model.index(0, 0, image)
+        assert not tree_model.hasChildren(data)
+        node = tree_model.get_node(data)
+        assert not hasattr(node, 'shape')
+        as_dict = tree_model.get_nodes_as_dict([data])
+        assert as_dict['shape'] == ['(3, 128, 128)']
+        assert as_dict['directory'] == ['/image/data']
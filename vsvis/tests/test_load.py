@@ -18,16 +18,20 @@ GNU General Public License for more details.
 You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
+import time
+import h5py
+import numpy as np
 import pytest
 import pytestqt
 from os.path import join
 
 from ..main_window import VMainWindow
-from ..config import TEST_DIR, DataType
+from ..config import TEST_DIR, DataType, Dimension
 
 
 folder = join(TEST_DIR, 'data')
 filename = join(folder, 'test.h5')
+tiffilename = join(folder, 'test.tif')
 
 @pytest.fixture
 def main_window(qtbot):
@@ -43,7 +47,140 @@ class TestLoadImage(object):
     """
     def test_load(self, main_window):
         widget, qtbot = main_window
-        widget.load(filename, DataType.IMAGE, [['/image/data']])
+        with qtbot.waitSignal(widget.file_loaded, timeout=5000):
+            widget.load(filename, DataType.IMAGE, [['/image/data']])
+        assert widget.graphics_view_scrollbar.maximum() == 2
+
+    def test_statistics(self, main_window):
+        widget, qtbot = main_window
+        with qtbot.waitSignal(widget.file_loaded, timeout=5000):
+            widget.load(filename, DataType.IMAGE, [['/image/data']])
+        controller = widget.controller
+        qtbot.waitUntil(lambda: controller.statistics is not None)
+        assert len(controller.statistics) == 3
+        widget.action_stack_contrast.setChecked(True)
+        assert controller.display_limits(0) == controller.statistics.limits()
+
+    def test_replace_while_indexing(self, main_window):
+        widget, qtbot = main_window
+        with qtbot.waitSignal(widget.file_loaded, timeout=5000):
+            widget.load(filename, DataType.IMAGE, [['/image/data']])
+        indexing = set(widget._image_workers)
+        with qtbot.waitSignal(widget.file_loaded, timeout=5000):
+            widget.load(filename, DataType.IMAGE, [['/image/data']])
+        # the workers reading the first datasource stopped before it closed
+        assert all(w.thread.isFinished() for w in indexing)
+
+    def test_projection(self, main_window):
+        widget, qtbot = main_window
+        with qtbot.waitSignal(widget.file_loaded, timeout=5000):
+            widget.load(filename, DataType.IMAGE, [['/image/data']])
+        controller = widget.controller
+        widget.action_max_projection.setChecked(True)
+        qtbot.waitUntil(lambda: controller.projection is not None)
+        widget.action_mean_projection.setChecked(True)
+        assert not widget.action_max_projection.isChecked()
+        qtbot.waitUntil(lambda: controller.projection.dtype == 'float32')
+        widget.action_mean_projection.setChecked(False)
+        assert controller.projection is None
+
+    def test_dimensions(self, main_window, tmpdir):
+        widget, qtbot = main_window
+        nd_filename = str(tmpdir.join('nd.h5'))
+        with h5py.File(nd_filename, 'w') as h5file:
+            h5file['/image/nd'] = np.zeros((4, 3, 8, 6), dtype=np.uint16)
+        with qtbot.waitSignal(widget.file_loaded, timeout=5000):
+            widget.load(nd_filename, DataType.IMAGE, [['/image/nd']])
+        navigator = widget.dimension_navigator
+        assert navigator.dimensions == (Dimension.T, Dimension.Z)
+        assert not widget.graphics_view_scrollbar.isVisibleTo(widget)
+        navigator._scrollbars[1].setValue(2)
+        assert widget.controller.current_index == 2
+        navigator._scrollbars[0].setValue(1)
+        assert widget.controller.current_index == 5
+        widget.graphics_view_scrollbar.setValue(7)
+        assert navigator.position == (2, 1)
+
+    def test_composite(self, main_window, tmpdir):
+        widget, qtbot = main_window
+        nd_filename = str(tmpdir.join('channels.h5'))
+        data = np.arange(2 * 3 * 8 * 6, dtype=np.uint16).reshape(2, 3, 8, 6)
+        with h5py.File(nd_filename, 'w') as h5file:
+            dset = h5file.create_dataset('/image/nd', data=data)
+            dset.dims[0].label = 'T'
+            dset.dims[1].label = 'C'
+        with qtbot.waitSignal(widget.file_loaded, timeout=5000):
+            widget.load(nd_filename, DataType.IMAGE, [['/image/nd']])
+        widget.action_composite.setChecked(True)
+        controller = widget.controller
+        assert len(controller.channel_luts) == 3
+        pixmap = controller.scene.pixmap.pixmap()
+        assert not pixmap.toImage().isGrayscale()
+        controller.set_channel_limits(1, (0, 10))
+        assert controller.channel_display_limits(0, 1) == (0, 10)
+
+    def test_projection_dimensions(self, main_window, tmpdir):
+        widget, qtbot = main_window
+        nd_filename = str(tmpdir.join('channels.h5'))
+        # [T, C, x, y]; channel c is c at every time point
+        data = np.zeros((4, 2, 8, 6), dtype=np.uint16)
+        data[:, 1] = 1
+        with h5py.File(nd_filename, 'w') as h5file:
+            dset = h5file.create_dataset('/image/nd', data=data)
+            dset.dims[0].label = 'T'
+            dset.dims[1].label = 'C'
+        with qtbot.waitSignal(widget.file_loaded, timeout=5000):
+            widget.load(nd_filename, DataType.IMAGE, [['/image/nd']])
+        controller = widget.controller
+        widget.action_max_projection.setChecked(True)
+        qtbot.waitUntil(lambda: controller.projection is not None)
+        assert np.all(controller.projection == 0)
+        # moving to the other channel shows its own projection
+        widget.dimension_navigator._scrollbars[1].setValue(1)
+        qtbot.waitUntil(lambda: np.all(controller.projection == 1))
+        # but moving in time doesn't compute another one
+        workers = len(widget._workers)
+        widget.dimension_navigator._scrollbars[0].setValue(3)
+        assert len(widget._workers) == workers
+
+    def test_load_several_files(self, main_window):
+        widget, qtbot = main_window
+        with qtbot.waitSignal(widget.file_loaded, timeout=5000):
+            widget.load([filename, filename], DataType.IMAGE,
+                        [['/image/data']])
+        assert widget.graphics_view_scrollbar.maximum() == 5
+
+    def test_load_tiff(self, main_window):
+        widget, qtbot = main_window
+        with qtbot.waitSignal(widget.file_loaded, timeout=5000):
+            widget.load(tiffilename, DataType.TIFF_IMAGE, None)
+        assert widget.graphics_view_scrollbar.maximum() == 2
+
+    def test_follow(self, main_window):
+        widget, qtbot = main_window
+        with qtbot.waitSignal(widget.file_loaded, timeout=5000):
+            widget.load(filename, DataType.IMAGE, [['/image/data']])
+        widget.action_follow.setChecked(True)
+        assert widget._follow_timer.isActive()
+        # nothing was appended to the file
+        widget.refresh()
+        assert widget.graphics_view_scrollbar.maximum() == 2
+        widget.action_follow.setChecked(False)
+
+    def test_play(self, main_window):
+        widget, qtbot = main_window
+        with qtbot.waitSignal(widget.file_loaded, timeout=5000):
+            widget.load(filename, DataType.IMAGE, [['/image/data']])
+        with qtbot.waitSignal(widget.playback.playing_changed, timeout=5000):
+            widget.action_play.setChecked(True)
+        assert widget.action_play.isChecked()
+        with qtbot.waitSignal(widget.playback.playing_changed, timeout=5000):
+            pass
+        # playback stops at the last frame
+        assert not widget.action_play.isChecked()
+        assert widget.graphics_view_scrollbar.value() == \
+            widget.controller.current_index == 2
+        assert not widget._follow_timer.isActive()
 
 
 class TestLoadData(object):
@@ -52,7 +189,29 @@ class TestLoadData(object):
     """
     def test_load(self, main_window):
         widget, qtbot = main_window
-        widget.load(filename, DataType.GROUND_TRUTH,
-                    [['/ground_truth/0'],
-                     ['/ground_truth/1'],
-                     ['/ground_truth/2']])
+        with qtbot.waitSignal(widget.file_loaded, timeout=5000):
+            widget.load(filename, DataType.GROUND_TRUTH,
+                        [['/ground_truth/0'],
+                         ['/ground_truth/1'],
+                         ['/ground_truth/2']])
+
+
+class TestWorkers(object):
+    """
+    Tests for running and cancelling Workers from the main window.
+    """
+    def test_cancel(self, main_window):
+        widget, qtbot = main_window
+
+        def wait_for_cancel(progress):
+            # the Worker checks for cancellation whenever progress is reported
+            while True:
+                progress(0, 0)
+                time.sleep(0.01)
+
+        worker = widget.start_worker(lambda result: None, wait_for_cancel)
+        assert widget.cancel_button.isVisibleTo(widget)
+        with qtbot.waitSignal(worker.cancelled, timeout=1000):
+            widget.cancel_button.click()
+        qtbot.waitUntil(lambda: not widget._workers)
+        assert not widget.cancel_button.isVisibleTo(widget)
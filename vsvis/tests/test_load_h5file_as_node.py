@@ -23,9 +23,11 @@ import pytest
 import pandas as pd
 import os
 import h5py
+import shutil
 from abc import ABC
 
 from ..config import TEST_DIR
+from .. import utils
 from ..utils import load_node_from_hdf5
 
 
@@ -33,8 +35,8 @@ class Test(object):
     filename = os.path.join(TEST_DIR, 'data', 'test.h5')
 
     @pytest.mark.dependency
-    def test_no_extra_args(self):
-        root = load_node_from_hdf5(self.filename)
+    def test_no_extra_args(self, tmpdir):
+        root = load_node_from_hdf5(self.filename, cache_dir=str(tmpdir))
 
         assert root.parent is None
         assert root.name == 'root'
@@ -45,9 +47,10 @@ class Test(object):
         assert dset1_1.name == 'data'
 
     @pytest.mark.dependency(depends=['Test::test_no_extra_args'])
-    def test_with_args(self):
+    def test_with_args(self, tmpdir):
         args = ['shape', 'dtype']
-        root = load_node_from_hdf5(self.filename, *args)
+        root = load_node_from_hdf5(self.filename, *args,
+                                   cache_dir=str(tmpdir))
 
         grp0 = root.children[0]
         dset0_0 = grp0.children[0]
@@ -64,9 +67,10 @@ class Test(object):
         assert str(dset21_1.dtype) == 'float32'
 
     @pytest.mark.dependency(depends=['Test::test_no_extra_args'])
-    def test_with_kwargs(self):
+    def test_with_kwargs(self, tmpdir):
         kwargs = {'directory': lambda item: getattr(item, 'name')}
-        root = load_node_from_hdf5(self.filename, **kwargs)
+        root = load_node_from_hdf5(self.filename, cache_dir=str(tmpdir),
+                                   **kwargs)
 
         grp0 = root.children[0]
         dset0_0 = grp0.children[0]
@@ -82,3 +86,53 @@ class Test(object):
 
         assert dset21_2.name == '2'
         assert dset21_2.directory == '/predicted/probabilities/2'
+
+
+class TestStructureCache(object):
+    filename = os.path.join(TEST_DIR, 'data', 'test.h5')
+
+    def test_reuse(self, tmpdir, monkeypatch):
+        filename = str(tmpdir.join('test.h5'))
+        shutil.copy(self.filename, filename)
+        cache_dir = str(tmpdir.join('cache'))
+
+        root = load_node_from_hdf5(filename, 'shape', cache_dir=cache_dir)
+        assert len(os.listdir(cache_dir)) == 1
+
+        def scan(*args):
+            raise AssertionError('file was scanned again')
+
+        with monkeypatch.context() as m:
+            m.setattr(utils, '_scan_hdf5', scan)
+            cached = load_node_from_hdf5(
+                filename, 'shape', cache_dir=cache_dir)
+        dset0_0 = cached.children[0].children[0]
+        assert dset0_0.shape == root.children[0].children[0].shape
+        assert dset0_0.row == 0
+        assert [c.name for c in cached.children] == \
+            [c.name for c in root.children]
+
+        # requesting other attributes invalidates the cache
+        root = load_node_from_hdf5(filename, 'dtype', cache_dir=cache_dir)
+        assert str(root.children[0].children[0].dtype) == 'float32'
+
+    def test_modified(self, tmpdir, monkeypatch):
+        filename = str(tmpdir.join('test.h5'))
+        shutil.copy(self.filename, filename)
+        cache_dir = str(tmpdir.join('cache'))
+        load_node_from_hdf5(filename, cache_dir=cache_dir)
+
+        with h5py.File(filename, 'a') as h5file:
+            h5file.create_group('new')
+        root = load_node_from_hdf5(filename, cache_dir=cache_dir)
+        assert len(root.children) == 4
+
+    def test_stale(self, tmpdir):
+        cache_dir = str(tmpdir.join('cache'))
+        load_node_from_hdf5(self.filename, cache_dir=cache_dir)
+        # a pickle of a class that no longer exists
+        cache_filename = os.path.join(cache_dir, os.listdir(cache_dir)[0])
+        with open(cache_filename, 'wb') as f:
+            f.write(b'cvsvis.utils\nRemovedClass\n.')
+        root = load_node_from_hdf5(self.filename, cache_dir=cache_dir)
+        assert len(root.children) == 3
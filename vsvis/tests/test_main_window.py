@@ -22,12 +22,14 @@ import pytestqt
 import pytest
 import h5py
 from os.path import abspath, dirname, join
-from qtpy.QtCore import Qt, QPoint
+import numpy as np
+from qtpy.QtCore import Qt, QPoint, QPointF
 from qtpy.QtTest import QTest
 from qtpy.QtWidgets import QAction
 
 from ..main_window import VMainWindow
-from ..config import TEST_DIR
+from ..config import DataType, TEST_DIR
+from ..models.marker import MarkerLayer
 
 
 class TestMainWindowCreate(object):
@@ -41,6 +43,69 @@ class TestMainWindowCreate(object):
             qtbot.add_widget(widget)
 
 
+class TestDisplayOptions(object):
+    def test_gamma_colormap(self, qtbot):
+        with VMainWindow() as widget:
+            qtbot.add_widget(widget)
+            lut = widget.controller.lut
+            widget.gamma_spinbox.setValue(2)
+            assert lut.gamma == 2
+            widget.colormap_combobox.setCurrentText('hot')
+            assert lut.colormap == 'hot'
+
+
+class TestParseFilename(object):
+    def test_natural_order(self, qtbot):
+        filelist = ['block_10.h5', 'block_2.h5', 'block_1.h5']
+        with VMainWindow() as widget:
+            qtbot.add_widget(widget)
+            assert widget._parse_filename(filelist, DataType.IMAGE) == \
+                ['block_1.h5', 'block_2.h5', 'block_10.h5']
+
+
+class TestPickMarker(object):
+    """
+    Tests for selecting the table row of a marker by clicking on it.
+    """
+    def test_click(self, qtbot):
+        with VMainWindow() as widget:
+            widget.show()
+            qtbot.add_widget(widget)
+            view = widget.graphics_view
+            with qtbot.waitSignal(view.clicked, timeout=1000) as blocker:
+                qtbot.mouseClick(view.viewport(), Qt.LeftButton,
+                                 pos=QPoint(5, 5))
+            pos, tolerance = blocker.args
+            assert pos == view.mapToScene(QPoint(5, 5))
+            assert tolerance > 0
+
+    def test_select_row(self, qtbot):
+        with VMainWindow() as widget:
+            qtbot.add_widget(widget)
+            controller = widget.controller
+            dtype = DataType.PREDICTED
+            coordinates = np.array([[10., 10., 0.5], [30., 30., 0.9]])
+            controller.tabwidget.add_tab(dtype, 'Predicted', ['x', 'y', 'p'])
+            controller.tabwidget.setModel(dtype, coordinates)
+            controller._add_top_level_group(dtype)
+            layer = MarkerLayer(coordinates[:, :2], size=4)
+            controller.scene.reset_markers(dtype, 0, layer)
+            layer.set_visible(True, [1])
+            # markers of DataTypes that aren't shown aren't picked
+            assert controller.pick_marker(QPointF(30, 31)) is None
+            controller._visible_marker_dtypes |= dtype
+            assert controller.pick_marker(QPointF(30, 31)) == (dtype, 1)
+            table = controller.tabwidget.tables[dtype]
+            rows = table.selectionModel().selectedRows()
+            assert [index.row() for index in rows] == [1]
+            assert controller.pick_marker(QPointF(20, 20)) is None
+            # nor are hidden markers, and the selection is kept
+            assert not layer.visible[0]
+            assert controller.pick_marker(QPointF(10, 11)) is None
+            rows = table.selectionModel().selectedRows()
+            assert [index.row() for index in rows] == [1]
+
+
 @pytest.fixture()
 def menu_test_fixture(qtbot):
     """
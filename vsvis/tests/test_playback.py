@@ -0,0 +1,136 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import pytest
+import time
+from qtpy.QtGui import QImage
+
+from ..playback import PlaybackEngine
+
+
+def render(index, delay=0.):
+    time.sleep(delay)
+    image = QImage(4, 4, QImage.Format_Grayscale8)
+    image.fill(index)
+    return image
+
+
+@pytest.fixture
+def shown():
+    return []
+
+
+def make_engine(shown, *args, **kwargs):
+    engine = PlaybackEngine(*args, **kwargs)
+    engine.frame_ready.connect(lambda index, image: shown.append(index))
+    return engine
+
+
+class TestPlaybackEngine(object):
+    def test_play(self, qtbot, shown):
+        engine = make_engine(shown, render, fps=100)
+        with qtbot.waitSignal(engine.playing_changed, timeout=5000) as blocker:
+            engine.play(2, 20)
+        assert blocker.args == [True]
+        with qtbot.waitSignal(engine.playing_changed, timeout=5000) as blocker:
+            pass
+        assert blocker.args == [False]
+        # the first frame is taken to be shown already
+        assert shown == sorted(set(shown))
+        assert shown[0] >= 3 and shown[-1] == 19
+        assert len(shown) + engine.dropped == 17
+        engine.shutdown()
+
+    def test_restart_at_end(self, qtbot, shown):
+        engine = make_engine(shown, render, fps=100)
+        engine.play(9, 10)
+        assert engine.playing and engine._start_index == 0
+        engine.shutdown()
+        assert not engine.playing
+
+    def test_frames(self, qtbot, shown):
+        rendered = []
+
+        def record(index):
+            rendered.append(index)
+            return render(index)
+
+        engine = make_engine(shown, record, fps=100)
+        with qtbot.waitSignal(engine.playing_changed, timeout=5000):
+            engine.play(1, 0, frames=[3, 9, 15, 21])
+        with qtbot.waitSignal(engine.playing_changed, timeout=5000):
+            pass
+        # frames are rendered and shown by their indices, from the second
+        assert set(rendered) <= {15, 21}
+        assert set(shown) <= {15, 21} and shown[-1] == 21
+        engine.shutdown()
+
+    def test_drop_frames(self, qtbot, shown):
+        # frames are converted at about 20 fps, and played at 100 fps
+        engine = make_engine(
+            shown, lambda index: render(index, 0.05), fps=100, max_workers=1)
+        start = time.monotonic()
+        with qtbot.waitSignal(engine.playing_changed, timeout=5000):
+            engine.play(0, 50)
+        with qtbot.waitSignal(engine.playing_changed, timeout=5000):
+            pass
+        # playback keeps to the clock, rather than waiting for frames
+        assert time.monotonic() - start < 1.5
+        assert engine.dropped > 0
+        assert shown == sorted(set(shown))
+        engine.shutdown()
+
+    def test_fps(self, qtbot, shown):
+        engine = make_engine(shown, render, fps=50)
+        engine.play(0, 1000)
+        with qtbot.waitSignal(engine.fps_changed, timeout=5000) as blocker:
+            pass
+        with qtbot.waitSignal(engine.fps_changed, timeout=5000) as blocker:
+            pass
+        achieved, target = blocker.args
+        assert target == 50
+        assert 0 < achieved < 75
+        engine.set_fps(25)
+        assert engine._timer.interval() == 40
+        with pytest.raises(ValueError):
+            engine.set_fps(0)
+        engine.shutdown()
+
+    def test_pause(self, qtbot, shown):
+        engine = make_engine(shown, render, fps=50)
+        engine.play(0, 1000)
+        with qtbot.waitSignal(engine.playing_changed, timeout=1000):
+            engine.pause()
+        assert not engine.playing
+        assert not engine._futures
+        count = len(shown)
+        qtbot.wait(100)
+        assert len(shown) == count
+        engine.shutdown()
+
+    def test_failed(self, qtbot, shown):
+        def fail(index):
+            raise OSError('unreadable frame')
+        engine = make_engine(shown, fail, fps=50)
+        with qtbot.waitSignal(engine.failed, timeout=5000) as blocker:
+            engine.play(0, 10)
+        assert blocker.args[0] == 'unreadable frame'
+        assert not engine.playing and not shown
+        engine.shutdown()
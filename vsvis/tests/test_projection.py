@@ -0,0 +1,212 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import pytest
+import struct
+import zlib
+import h5py
+import numpy as np
+
+from ..config import Dimension, Projection
+from ..datasource import (
+    HDF5DataSource, HDF5MultiFileDataSource, HDF5Request1D, HDF5RequestND)
+from ..projection import ProjectionEngine
+from ..tiff_datasource import TiffDataSource
+
+
+class ArraySource(object):
+    def __init__(self, frames):
+        self.frames = frames
+        self.requests = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def request(self, index):
+        self.requests += 1
+        return self.frames[index]
+
+
+@pytest.fixture
+def stack():
+    state = np.random.RandomState(0)
+    return state.randint(0, 1000, (37, 16, 12)).astype(np.uint16)
+
+
+@pytest.fixture
+def chunked_source(tmpdir, stack):
+    """
+    HDF5DataSource over a chunked and a contiguous Dataset.
+    """
+    filename = str(tmpdir.join('stack.h5'))
+    with h5py.File(filename, 'w') as h5file:
+        h5file.create_dataset('/image/0', data=stack[:20], chunks=(4, 16, 12))
+        h5file.create_dataset('/image/1', data=stack[20:])
+    req = HDF5Request1D(filename, [['/image/0'], ['/image/1']], axis=0)
+    with HDF5DataSource(filename, req) as source:
+        yield source
+
+
+@pytest.fixture
+def multifile_source(tmpdir, stack):
+    """
+    HDF5MultiFileDataSource over two files, chunked along the stack.
+    """
+    filenames = [str(tmpdir.join('{}.h5'.format(i))) for i in range(2)]
+    for filename, part in zip(filenames, (stack[:20], stack[20:])):
+        with h5py.File(filename, 'w') as h5file:
+            h5file.create_dataset('/image/data', data=part,
+                                  chunks=(4, 16, 12))
+    with HDF5MultiFileDataSource(filenames, ['/image/data']) as source:
+        yield source
+
+
+@pytest.fixture
+def tiff_source(tmpdir, stack):
+    """
+    TiffDataSource over deflate-compressed pages, one per frame.
+    """
+    filename = str(tmpdir.join('stack.tif'))
+    content = bytearray(struct.pack('<2sHI', b'II', 42, 0))
+    previous = 4
+    for frame in stack:
+        # the TIFF is row-major: frames are (x, y)
+        strip = zlib.compress(frame.T.tobytes())
+        offset = len(content)
+        content += strip
+        ifd = len(content)
+        struct.pack_into('<I', content, previous, ifd)
+        tags = [(256, 3, 1, frame.shape[0]), (257, 3, 1, frame.shape[1]),
+                (258, 3, 1, 16), (259, 3, 1, 8), (273, 4, 1, offset),
+                (277, 3, 1, 1), (278, 3, 1, frame.shape[1]),
+                (279, 4, 1, len(strip))]
+        content += struct.pack('<H', len(tags))
+        content += b''.join(struct.pack('<HHII', *tag) for tag in tags)
+        previous = len(content)
+        content += struct.pack('<I', 0)
+    with open(filename, 'wb') as f:
+        f.write(content)
+    with TiffDataSource(filename) as source:
+        yield source
+
+
+EXPECTED = {Projection.MAX: lambda s: s.max(axis=0),
+            Projection.MEAN: lambda s: s.mean(axis=0),
+            Projection.STD: lambda s: s.std(axis=0)}
+
+
+class TestFrameBlocks(object):
+    def test_chunk_aligned(self, chunked_source, stack):
+        frame_nbytes = 16 * 12 * 2
+        blocks = chunked_source.frame_blocks(5 * frame_nbytes)
+        # whole chunks of 4 frames, then blocks of 5 contiguous frames
+        assert blocks == [(0, 4), (4, 8), (8, 12), (12, 16), (16, 20),
+                          (20, 25), (25, 30), (30, 35), (35, 37)]
+        assert np.array_equal(chunked_source.read_block(20, 25), stack[20:25])
+        with pytest.raises(ValueError):
+            chunked_source.read_block(16, 24)
+
+
+    def test_multifile(self, multifile_source, stack):
+        blocks = multifile_source.frame_blocks(5 * 16 * 12 * 2)
+        assert blocks == [(0, 4), (4, 8), (8, 12), (12, 16), (16, 20),
+                          (20, 24), (24, 28), (28, 32), (32, 36), (36, 37)]
+        assert multifile_source.axis == 0
+        assert np.array_equal(multifile_source.read_block(20, 24),
+                              stack[20:24])
+        with pytest.raises(ValueError):
+            multifile_source.read_block(16, 24)
+        assert len(multifile_source.cache) == 0
+
+    def test_tiff(self, tiff_source, stack):
+        blocks = tiff_source.frame_blocks(5 * 16 * 12 * 2)
+        assert blocks[0] == (0, 5) and blocks[-1] == (35, 37)
+        assert np.array_equal(tiff_source.request(3)[0], stack[3])
+        assert len(tiff_source.cache) == 1
+        assert np.array_equal(tiff_source.read_block(0, 5), stack[:5])
+        # pages read in blocks aren't cached
+        assert len(tiff_source.cache) == 1
+
+
+class TestProjectionEngine(object):
+    @pytest.mark.parametrize('kind', list(EXPECTED))
+    def test_blocks(self, chunked_source, stack, kind):
+        engine = ProjectionEngine(chunked_source, 3, 16 * 12 * 2 * 5)
+        steps = []
+        projection = engine.project(kind, lambda *args: steps.append(args))
+        assert projection.shape == (1, 16, 12)
+        assert np.allclose(projection[0], EXPECTED[kind](stack), rtol=1e-5)
+        assert steps[-1] == (9, 9)
+        # blocks aren't cached
+        assert len(chunked_source.cache) == 0
+
+    @pytest.mark.parametrize('name', ['multifile_source', 'tiff_source'])
+    def test_uncached(self, request, stack, name):
+        source = request.getfixturevalue(name)
+        engine = ProjectionEngine(source, 2, 16 * 12 * 2 * 5)
+        projection = engine.project(Projection.MEAN)
+        assert np.allclose(projection[0], stack.mean(axis=0), rtol=1e-5)
+        # the frames being shown stay in the cache
+        assert len(source.cache) == 0
+
+    def test_frames(self, stack):
+        source = ArraySource(stack[:, None])
+        engine = ProjectionEngine(source, 2, 16 * 12 * 2 * 4)
+        projection = engine.project(Projection.STD)
+        assert np.allclose(projection[0], stack.std(axis=0), rtol=1e-5)
+        requests = source.requests
+        # results are cached
+        assert engine.project(Projection.STD) is projection
+        assert source.requests == requests
+        engine.clear()
+        assert Projection.STD not in engine
+
+    def test_cancel(self, stack):
+        engine = ProjectionEngine(ArraySource(stack[:, None]), 2, 1)
+
+        def progress(done, total):
+            raise KeyboardInterrupt()
+        with pytest.raises(KeyboardInterrupt):
+            engine.project(Projection.MAX, progress)
+        assert Projection.MAX not in engine
+
+    def test_dimensions(self, tmpdir):
+        # [T, Z, C, x, y]; channel 0 is 7 at T=1, channel 1 is 1000
+        data = np.zeros((3, 2, 2, 4, 5), dtype=np.uint16)
+        data[1, :, 0] = 7
+        data[:, :, 1] = 1000
+        filename = str(tmpdir.join('nd.h5'))
+        with h5py.File(filename, 'w') as h5file:
+            h5file['/image/nd'] = data
+        req = HDF5RequestND(filename, '/image/nd')
+        with HDF5DataSource(filename, req) as source:
+            engine = ProjectionEngine(source, 2, 4 * 5 * 2)
+            assert engine.dimension == Dimension.T
+            # projected over time, separately for each Z plane and channel
+            index = req.index((2, 1, 0))
+            assert engine.line(index) == (1, 0)
+            projection = engine.project(Projection.MAX, index=index)
+            assert projection.shape == (1, 4, 5)
+            assert np.all(projection == 7)
+            index = req.index((0, 1, 1))
+            assert np.all(engine.project(Projection.MAX, index=index) == 1000)
+            assert np.allclose(engine.project(Projection.MEAN, index=0), 7 / 3)
+            # blocks aren't cached
+            assert len(source.cache) == 0
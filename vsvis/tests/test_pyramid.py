@@ -0,0 +1,112 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import numpy as np
+
+from ..config import PYRAMID_MAX_LEVEL
+from ..pyramid import ImagePyramid, downsample
+from ..widgets import VGraphicsView
+
+
+class ArraySource(object):
+    def __init__(self, frames):
+        self.frames = frames
+        self.requests = 0
+
+    def __len__(self):
+        return len(self.frames)
+
+    def request(self, index):
+        self.requests += 1
+        return self.frames[index]
+
+
+class RegionSource(ArraySource):
+    def __init__(self, frames):
+        super().__init__(frames)
+        self.regions = []
+
+    def frame_info(self, index):
+        return self.frames[index].shape, self.frames[index].dtype
+
+    def request_region(self, index, region):
+        self.regions.append(region)
+        return self.frames[index][(Ellipsis, ) + tuple(region)]
+
+
+class TestDownsample(object):
+    def test_mean(self):
+        array = np.arange(16, dtype=np.float32).reshape(1, 4, 4)
+        out = downsample(array)
+        assert out.shape == (1, 2, 2)
+        assert out[0, 0, 0] == np.mean([0, 1, 4, 5])
+
+    def test_odd_shape(self):
+        array = np.ones((5, 7), dtype=np.uint16)
+        out = downsample(array)
+        assert out.shape == (2, 3)
+        assert out.dtype == np.uint16
+        assert np.all(out == 1)
+
+
+class TestImagePyramid(object):
+    def test_levels(self):
+        frames = np.random.randint(0, 1000, (3, 1, 64, 32), dtype=np.uint16)
+        source = ArraySource(frames)
+        pyramid = ImagePyramid(source)
+        assert pyramid.request(1).shape == (1, 64, 32)
+        assert pyramid.full_shape == (1, 64, 32)
+        assert pyramid.request(1, 2).shape == (1, 16, 8)
+        assert np.array_equal(pyramid.request(1, 1),
+                              downsample(frames[1]))
+        # levels are cached
+        pyramid.request(1, 2)
+        assert source.requests == 3
+
+    def test_subsampled_reads(self):
+        frames = np.random.randint(0, 1000, (3, 1, 64, 32), dtype=np.uint16)
+        source = RegionSource(frames)
+        pyramid = ImagePyramid(source)
+        level = pyramid.request(2, 3)
+        assert level.shape == (1, 8, 4)
+        assert np.array_equal(level, downsample(frames[2][:, ::4, ::4]))
+        assert pyramid.full_shape == (1, 64, 32)
+        # only every 4th pixel was read, and the full frame never was
+        assert source.regions == [(slice(None, None, 4), ) * 2]
+        assert source.requests == 0
+
+    def test_small_frame(self):
+        source = ArraySource(np.ones((1, 1, 4, 4), dtype=np.uint8))
+        pyramid = ImagePyramid(source, max_level=10)
+        assert pyramid.request(0, 10).shape == (1, 1, 1)
+
+
+class TestViewLevel(object):
+    def test_level_changed(self, qtbot):
+        view = VGraphicsView()
+        qtbot.addWidget(view)
+        with qtbot.waitSignal(view.level_changed) as blocker:
+            view.scale(0.25, 0.25)
+        assert blocker.args == [2]
+        assert view.level == 2
+        view.scale(4, 4)
+        assert view.level == 0
+        view.scale(2 ** -20, 2 ** -20)
+        assert view.level == PYRAMID_MAX_LEVEL
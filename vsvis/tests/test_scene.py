@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import pytest
+import numpy as np
+
+from qtpy.QtCore import QPointF, QRectF, Qt
+from qtpy.QtGui import QColor, QImage, QPainter
+from qtpy.QtWidgets import QStyleOptionGraphicsItem
+
+from ..cache import FrameBufferPool
+from ..config import DataType, MarkerVisible, Shape
+from ..models.marker import MarkerLayer, array2polygon
+from ..models.scene import VGraphicsScene, VTiledImageItem
+
+
+class TestArray2Pixmap(object):
+    def test_rescale(self):
+        array = np.array([[10, 20], [30, 1010]], dtype=np.uint16)
+        out = VGraphicsScene.rescale_array(array)
+        assert out.dtype == np.uint8
+        assert out.min() == 0 and out.max() == 255
+
+    def test_rescale_transposed(self):
+        array = np.arange(12, dtype=np.uint16).reshape(3, 4)
+        out = np.empty((4, 3), dtype=np.uint8)
+        VGraphicsScene.rescale_array(array.T, out)
+        assert np.array_equal(out, np.require(
+            VGraphicsScene.rescale_array(array).T, requirements='C'))
+
+    def test_limits(self):
+        array = np.array([[0, 50], [100, 200]], dtype=np.uint16)
+        out = VGraphicsScene.rescale_array(array, limits=(50, 100))
+        assert out.tolist() == [[0, 0], [255, 255]]
+
+    def test_buffers_reused(self, qtbot):
+        buffers = FrameBufferPool()
+        image = np.arange(48, dtype=np.uint16).reshape(1, 8, 6).squeeze().T
+        for _ in range(3):
+            pixmap = VGraphicsScene.array2pixmap(image, True, buffers)
+        assert (pixmap.width(), pixmap.height()) == (8, 6)
+        # one uint8 image and one float32 scratch array
+        assert buffers.allocations == 2
+
+
+class ArraySource(object):
+    def __init__(self, frames):
+        self.frames = frames
+        self.regions = []
+
+    def request_region(self, index, region):
+        self.regions.append(region)
+        return self.frames[index][(Ellipsis, ) + region]
+
+
+class TestTiledImageItem(object):
+    def paint(self, item, rect):
+        option = QStyleOptionGraphicsItem()
+        option.exposedRect = rect
+        image = QImage(100, 80, QImage.Format_ARGB32)
+        painter = QPainter(image)
+        item.paint(painter, option)
+        painter.end()
+
+    def load(self, qtbot, item, rect, loads):
+        self.paint(item, rect)
+        qtbot.waitUntil(lambda: item.loads == loads)
+
+    def test_exposed_tiles(self, qtbot):
+        frames = np.arange(2 * 100 * 80, dtype=np.uint16)
+        frames = frames.reshape(2, 1, 100, 80)
+        source = ArraySource(frames)
+        item = VTiledImageItem(tile_size=32, max_tiles=6)
+        item.set_frame(source, 0, frames.shape[1:])
+        assert item.boundingRect() == QRectF(0, 0, 100, 80)
+        assert item.tiles_in(QRectF(90, 70, 50, 50)) == [(2, 2), (3, 2)]
+
+        self.load(qtbot, item, QRectF(0, 0, 40, 20), 2)
+        # the limits come from a subsample of the whole frame, read first
+        assert source.regions[0] == (slice(None, None, 3), ) * 2
+        assert item._limits[0] == (0, frames[0, :, ::3, ::3].max())
+        assert (slice(0, 32), slice(0, 32)) in source.regions
+        # the tiles that arrived are drawn without loading them again
+        self.paint(item, QRectF(0, 0, 40, 20))
+        assert not item._pending
+        # panning only loads the newly exposed tiles
+        self.load(qtbot, item, QRectF(10, 0, 60, 20), 3)
+        self.load(qtbot, item, QRectF(0, 0, 100, 80), 12)
+        assert len(item) == 6
+
+        item.set_frame(source, 1, frames.shape[1:], (0, 1))
+        self.load(qtbot, item, QRectF(0, 0, 10, 10), 13)
+        item.invalidate([1])
+        self.load(qtbot, item, QRectF(0, 0, 10, 10), 14)
+        item.shutdown()
+
+    def test_cancel(self, qtbot):
+        frames = np.zeros((1, 1, 100, 80), dtype=np.uint16)
+        item = VTiledImageItem(tile_size=32)
+        item.set_frame(ArraySource(frames), 0, frames.shape[1:], (0, 1))
+        self.paint(item, QRectF(0, 0, 100, 80))
+        item.cancel(wait_started=True)
+        assert not item._pending and not item._started
+        # results of loads that were cancelled are dropped
+        qtbot.wait(50)
+        assert item.loads == 0 and len(item) == 0
+        item.shutdown()
+
+    def test_scene(self, qtbot):
+        frames = np.zeros((1, 1, 300, 200), dtype=np.uint16)
+        scene = VGraphicsScene()
+        scene.set_tiled_image(ArraySource(frames), 0, frames.shape[1:])
+        assert scene.tiled_image.isVisible()
+        assert scene.sceneRect().width() == pytest.approx(300, abs=32)
+        scene.set_pixmap(scene.array2pixmap(frames[0, 0].T), 0)
+        assert not scene.tiled_image.isVisible()
+
+
+class TestMarkerLayer(object):
+    red = QColor(Qt.red).rgba()
+
+    def paint(self, item, rect=QRectF(0, 0, 40, 40)):
+        option = QStyleOptionGraphicsItem()
+        option.exposedRect = rect
+        image = QImage(40, 40, QImage.Format_ARGB32)
+        image.fill(0)
+        painter = QPainter(image)
+        item.paint(painter, option, None)
+        painter.end()
+        return image
+
+    def test_array2polygon(self):
+        points = np.array([[1.5, 2], [3, 4.25]])
+        polygon = array2polygon(points)
+        assert [(p.x(), p.y()) for p in polygon] == [(1.5, 2), (3, 4.25)]
+        assert array2polygon(np.empty((0, 2))).isEmpty()
+
+    def test_paint(self, qtbot):
+        layer = MarkerLayer([[10, 10], [30, 30]], Shape.CIRCLE, Qt.red, 6)
+        assert len(layer) == 2 and not layer.visible.any()
+        assert layer.boundingRect().contains(QRectF(7, 7, 26, 26))
+        assert self.paint(layer).pixel(10, 10) == 0
+        layer.set_visible(True, [0])
+        image = self.paint(layer)
+        assert image.pixel(10, 10) == self.red
+        assert image.pixel(30, 30) == 0
+        # markers outside the exposed area aren't drawn
+        assert self.paint(layer, QRectF(20, 20, 20, 20)).pixel(10, 10) == 0
+
+    def test_diamond(self, qtbot):
+        layer = MarkerLayer([[20, 20]], Shape.DIAMOND, Qt.red, 10)
+        layer.set_visible(True)
+        image = self.paint(layer)
+        assert image.pixel(20, 20) == self.red
+        assert image.pixel(20, 16) == self.red
+        # the corners of the bounding square are outside the diamond
+        assert image.pixel(16, 16) == 0
+
+    def test_outline(self, qtbot):
+        layer = MarkerLayer([[20, 20]], Shape.CIRCLE, Qt.red, 10,
+                            filled=False)
+        layer.set_visible(True)
+        image = self.paint(layer)
+        assert image.pixel(20, 20) == 0
+        assert not image.pixel(20, 15) == 0
+        assert not image.pixel(25, 20) == 0
+        # circles have more sides the larger they're drawn
+        assert len(layer._outline(10, 1)) == 8
+        assert len(layer._outline(10, 10)) == 64
+
+    def test_outline_diamond(self, qtbot):
+        layer = MarkerLayer([[10, 10], [30, 20]], Shape.DIAMOND, Qt.red, 10,
+                            filled=False)
+        layer.set_visible(True)
+        image = self.paint(layer)
+        for x, y in [(10, 10), (30, 20)]:
+            assert image.pixel(x, y) == 0
+            assert not image.pixel(x, y - 5) == 0
+            assert not image.pixel(x + 5, y) == 0
+            # the corners of the bounding square are outside the diamond
+            assert image.pixel(x - 4, y - 4) == 0
+
+    def test_style(self, qtbot):
+        layer = MarkerLayer(np.zeros((3, 2)), size=2)
+        layer.set_marker_color(Qt.blue, [1])
+        assert list(layer.colors == QColor(Qt.blue).rgba()) == \
+            [False, True, False]
+        assert layer.get_marker_color() == QColor(Qt.red)
+        layer.set_marker_size(8)
+        assert (layer.sizes == 8).all()
+        assert layer.boundingRect() == QRectF(-4.25, -4.25, 8.5, 8.5)
+
+    def test_scene(self, qtbot):
+        scene = VGraphicsScene()
+        scene.add_top_level_group(DataType.PREDICTED)
+        assert not scene.has_markers(DataType.PREDICTED, 0)
+        layer = MarkerLayer(np.arange(8).reshape(4, 2))
+        scene.reset_markers(DataType.PREDICTED, 0, layer)
+        assert scene.has_markers(DataType.PREDICTED, 0)
+        assert scene.count_markers(DataType.PREDICTED, 0) == 4
+        assert layer.scene() is scene
+        assert scene.set_markers_visible(DataType.PREDICTED, 0, True, {1, 3})
+        assert list(scene.get_markers(
+            DataType.PREDICTED, 0, MarkerVisible.true)) == [1, 3]
+        assert list(scene.get_markers(
+            DataType.PREDICTED, 0, MarkerVisible.false)) == [0, 2]
+        assert not scene.set_markers_visible(DataType.PREDICTED, 1, True)
+        assert scene.delete_markers(DataType.PREDICTED, slice(None))
+        assert not scene.has_markers(DataType.PREDICTED, 0)
+        assert layer.scene() is None
+
+    def test_visible_indices(self, qtbot):
+        layer = MarkerLayer(np.arange(20.).reshape(10, 2) * 10, size=4)
+        layer.set_visible(True, range(0, 10, 2))
+        assert list(layer.visible_indices()) == [0, 2, 4, 6, 8]
+        # markers overlapping the rectangle count
+        rect = QRectF(41, 51, 40, 40)
+        assert list(layer.visible_indices(rect)) == [2, 4]
+
+    def test_pick(self, qtbot):
+        layer = MarkerLayer([[10, 10], [30, 30]], size=6)
+        # hidden markers aren't picked
+        assert layer.pick(11, 12) is None
+        layer.set_visible(True)
+        assert layer.pick(11, 12) == 0
+        assert layer.pick(30, 34) is None
+        assert layer.pick(30, 34, tolerance=1.5) == 1
+        assert MarkerLayer(np.empty((0, 2))).pick(0, 0) is None
+        # a visible marker further away than a hidden one is picked
+        layer.set_visible(False, [0])
+        layer.set_marker_size(60)
+        assert layer.pick(12, 12) == 1
+
+        scene = VGraphicsScene()
+        scene.add_top_level_group(DataType.PREDICTED)
+        scene.reset_markers(DataType.PREDICTED, 0, layer)
+        assert scene.pick_marker(DataType.PREDICTED, 0, QPointF(29, 29)) == 1
+        assert scene.pick_marker(DataType.PREDICTED, 1, QPointF(29, 29)) \
+            is None
@@ -0,0 +1,92 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import pytest
+import numpy as np
+
+from ..spatial import GridIndex
+
+
+@pytest.fixture
+def points():
+    state = np.random.RandomState(0)
+    return state.uniform(0, 100, (1000, 2))
+
+
+def brute_nearest(points, x, y):
+    return int(((points - (x, y)) ** 2).sum(1).argmin())
+
+
+class TestGridIndex(object):
+    def test_cells(self, points):
+        index = GridIndex(points, density=4)
+        assert len(index) == 1000
+        counts = np.diff(index.starts)
+        assert counts.sum() == 1000
+        assert counts.mean() == pytest.approx(4, rel=0.1)
+
+    def test_query_rect(self, points):
+        index = GridIndex(points)
+        for x0, y0, x1, y1 in [(10, 20, 30, 25), (-50, -50, 200, 200),
+                               (99.5, 0, 150, 100), (40, 40, 40, 40),
+                               (200, 200, 300, 300), (30, 30, 10, 10)]:
+            x, y = points.T
+            expected = np.flatnonzero(
+                (x >= x0) & (x <= x1) & (y >= y0) & (y <= y1))
+            np.testing.assert_array_equal(
+                index.query_rect(x0, y0, x1, y1), expected)
+
+    def test_nearest(self, points):
+        index = GridIndex(points)
+        state = np.random.RandomState(1)
+        for x, y in state.uniform(-20, 120, (200, 2)):
+            assert index.nearest(x, y) == brute_nearest(points, x, y)
+        # far outside the grid
+        assert index.nearest(1e6, -1e6) == brute_nearest(points, 1e6, -1e6)
+
+    def test_mask(self, points):
+        index = GridIndex(points)
+        mask = np.zeros(len(points), bool)
+        mask[::3] = True
+        state = np.random.RandomState(2)
+        for x, y in state.uniform(-20, 120, (50, 2)):
+            assert index.nearest(x, y, mask=mask) == 3 * brute_nearest(
+                points[::3], x, y)
+        assert index.nearest(50, 50, mask=np.zeros(len(points), bool)) \
+            is None
+
+    def test_max_distance(self, points):
+        index = GridIndex(points)
+        i = index.nearest(50, 50)
+        distance = np.hypot(*(points[i] - 50))
+        assert index.nearest(50, 50, distance) == i
+        assert index.nearest(50, 50, distance * 0.99) is None
+
+    def test_degenerate(self):
+        assert GridIndex(np.empty((0, 2))).nearest(0, 0) is None
+        assert len(GridIndex(np.empty((0, 2))).query_rect(0, 0, 1, 1)) == 0
+        # points along a line, and at one position
+        line = np.stack([np.arange(50.), np.zeros(50)], axis=1)
+        index = GridIndex(line)
+        assert index.nearest(20.2, 3) == 20
+        assert list(index.query_rect(4.5, -1, 7, 1)) == [5, 6, 7]
+        index = GridIndex(np.ones((5, 2)))
+        assert index.nearest(0, 0) == 0
+        assert list(index.query_rect(1, 1, 1, 1)) == [0, 1, 2, 3, 4]
@@ -0,0 +1,138 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import pytest
+import h5py
+import numpy as np
+
+from ..datasource import HDF5DataSource, HDF5Request1D, HDF5RequestND
+from ..stats import FrameStatistics, compute_statistics, load_statistics
+
+
+class ArraySource(object):
+    def __init__(self, frames):
+        self.frames = frames
+        self.filename = None
+
+    def __len__(self):
+        return len(self.frames)
+
+    def request(self, index):
+        return self.frames[index]
+
+
+@pytest.fixture
+def frames():
+    state = np.random.RandomState(0)
+    return state.randint(0, 4000, (4, 1, 30, 20)).astype(np.uint16)
+
+
+class TestComputeStatistics(object):
+    def test_integers(self, frames):
+        stats = compute_statistics(ArraySource(frames), q=(50, ))
+        assert len(stats) == 4
+        assert np.array_equal(stats.minimum, frames.min(axis=(1, 2, 3)))
+        assert np.array_equal(stats.maximum, frames.max(axis=(1, 2, 3)))
+        assert stats.limits(2) == (frames[2].min(), frames[2].max())
+        assert stats.limits() == (frames.min(), frames.max())
+        low, high = stats.limits(None, 1, 99)
+        assert low == pytest.approx(np.percentile(frames, 1), abs=2)
+        assert high == pytest.approx(np.percentile(frames, 99), abs=2)
+        assert stats.percentiles[1, 0] == pytest.approx(
+            np.median(frames[1]), abs=1)
+        counts, edges = stats.histogram(0)
+        assert counts.sum() == 600
+        assert edges[0] == frames[0].min() and edges[-1] == frames[0].max()
+
+    def test_floats(self, frames):
+        frames = frames.astype(np.float32) - 1000
+        stats = compute_statistics(ArraySource(frames))
+        assert stats.counts is None
+        assert stats.limits(3) == (frames[3].min(), frames[3].max())
+        assert stats.limits() == (frames.min(), frames.max())
+        # the stack's limits bound those of its frames, interpolated alike
+        lows, highs = zip(*(stats.limits(i, 5, 95) for i in range(4)))
+        assert stats.limits(None, 5, 95) == \
+            pytest.approx((min(lows), max(highs)))
+        assert stats.limits(None, 5, 95) is stats.limits(None, 5, 95)
+
+    def test_chunk_blocks(self, tmpdir, frames, monkeypatch):
+        # chunks of two frames, each read once, in blocks of one chunk
+        monkeypatch.setattr('vsvis.stats.STATS_BLOCK_NBYTES', 100)
+        filename = str(tmpdir.join('stack.h5'))
+        with h5py.File(filename, 'w') as h5file:
+            h5file.create_dataset('/image/data', data=frames[:, 0],
+                                  chunks=(2, 30, 20), compression='gzip')
+        req = HDF5Request1D(filename, [['/image/data']], axis=0)
+        with HDF5DataSource(filename, req) as source:
+            blocks = []
+            read_block = source.read_block
+
+            def record(start, stop):
+                blocks.append((start, stop))
+                return read_block(start, stop)
+            monkeypatch.setattr(source, 'read_block', record)
+            stats = compute_statistics(source)
+            assert blocks == [(0, 2), (2, 4)]
+            assert len(source.cache) == 0
+        expected = compute_statistics(ArraySource(frames))
+        assert np.array_equal(stats.percentiles, expected.percentiles)
+        assert np.array_equal(stats.histograms, expected.histograms)
+
+    def test_row_blocks(self, tmpdir, frames, monkeypatch):
+        # frames navigated along several Dimensions are read frame by
+        # frame, in blocks of a few rows
+        monkeypatch.setattr('vsvis.stats.STATS_BLOCK_NBYTES', 100)
+        filename = str(tmpdir.join('nd.h5'))
+        with h5py.File(filename, 'w') as h5file:
+            h5file['/image/nd'] = frames.reshape(2, 2, 30, 20)
+        req = HDF5RequestND(filename, '/image/nd')
+        with HDF5DataSource(filename, req) as source:
+            stats = compute_statistics(source)
+            assert len(source.cache) == 0
+        expected = compute_statistics(ArraySource(frames))
+        assert np.array_equal(stats.percentiles, expected.percentiles)
+        assert np.array_equal(stats.histograms, expected.histograms)
+
+
+class TestLoadStatistics(object):
+    def test_sidecar(self, tmpdir, frames):
+        filename = str(tmpdir.join('stack.h5'))
+        with h5py.File(filename, 'w') as h5file:
+            h5file['/image/data'] = frames[:, 0]
+        cache_dir = str(tmpdir.join('cache'))
+        req = HDF5Request1D(filename, [['/image/data']], axis=0)
+        calls = []
+        with HDF5DataSource(filename, req) as source:
+            stats = load_statistics(
+                source, cache_dir, lambda *args: calls.append(args))
+            assert len(calls) == 4
+            cached = load_statistics(
+                source, cache_dir, lambda *args: calls.append(args))
+        # read from the sidecar file
+        assert len(calls) == 4
+        assert np.array_equal(cached.counts, stats.counts)
+        assert cached.limits(1) == stats.limits(1)
+
+    def test_key_mismatch(self, tmpdir, frames):
+        filename = str(tmpdir.join('stats.npz'))
+        compute_statistics(ArraySource(frames)).save(filename, 'a')
+        assert FrameStatistics.load(filename, 'b') is None
+        assert len(FrameStatistics.load(filename, 'a')) == 4
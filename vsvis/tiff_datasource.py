@@ -0,0 +1,320 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import struct
+import zlib
+import numpy as np
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from .cache import FrameCache
+from .config import FRAME_CACHE_NBYTES
+
+"""
+A minimal reader for multipage TIFF (and OME-TIFF) stacks. Only the chain of
+image file directories (IFDs) is walked when a file is opened; a page's tags
+are parsed, and its pixels read, when the page is first requested.
+"""
+
+# TIFF tags that we need to locate a page's pixels
+IMAGE_WIDTH = 256
+IMAGE_LENGTH = 257
+BITS_PER_SAMPLE = 258
+COMPRESSION = 259
+STRIP_OFFSETS = 273
+SAMPLES_PER_PIXEL = 277
+ROWS_PER_STRIP = 278
+STRIP_BYTE_COUNTS = 279
+PLANAR_CONFIGURATION = 284
+PREDICTOR = 317
+TILE_WIDTH = 322
+SAMPLE_FORMAT = 339
+
+# TIFF field type -> struct format character
+FIELD_TYPES = {1: 'B', 2: 's', 3: 'H', 4: 'I', 5: 'I', 6: 'b', 7: 'B',
+               8: 'h', 9: 'i', 10: 'i', 11: 'f', 12: 'd', 16: 'Q', 17: 'q',
+               18: 'Q'}
+# rational numbers are stored as two integers, numerator and denominator
+RATIONAL_TYPES = (5, 10)
+
+# SampleFormat tag value -> numpy dtype kind
+SAMPLE_KINDS = {1: 'u', 2: 'i', 3: 'f'}
+
+UNCOMPRESSED = 1
+DEFLATE = (8, 32946)
+
+
+class TiffPage(NamedTuple):
+    shape: Tuple[int, ...]
+    dtype: np.dtype
+    compression: int
+    offsets: Tuple[int, ...]
+    bytecounts: Tuple[int, ...]
+
+    @property
+    def contiguous(self) -> bool:
+        """
+        Whether the page's strips are stored back to back in the file.
+        """
+        ends = np.add(self.offsets[:-1], self.bytecounts[:-1])
+        return bool(np.all(ends == self.offsets[1:]))
+
+
+class TiffDataSource(object):
+    """
+    Reads pages from a multipage TIFF file on demand, with the same 'request'
+    API as HDF5DataSource.
+
+    The file is memory-mapped once when it's opened. Pages of uncompressed
+    data whose strips are contiguous are returned as views into the memory
+    map, without copying; other pages are read, decompressed if needed, and
+    cached.
+
+    Pages are returned with a leading axis of length one and the image's
+    axes ordered (X, Y), i.e. transposed compared to the TIFF's row-major
+    layout. This is the same layout as frames of HDF5 image Datasets.
+    Pages with several samples per pixel, e.g. RGB pages, are reduced to
+    one of their samples, so that every frame is a 2-D image.
+
+    Parameters
+    ------------
+    filename : str
+
+    cache : Optional[FrameCache]
+        See HDF5DataSource.
+
+    sample : int
+        The sample of pages with several samples per pixel that is returned
+        as their frame.
+    """
+    def __init__(self, filename: str, cache: Optional[FrameCache] = None,
+                 sample: int = 0):
+        self.filename = filename
+        self.sample = sample
+        self.cache = FrameCache(FRAME_CACHE_NBYTES) if cache is None else cache
+        self._buffer = np.memmap(filename, dtype=np.uint8, mode='r')
+        self._byteorder, self._bigtiff, first = self._read_header()
+        self._ifd_offsets = self._index_pages(first)
+        self._pages: Dict[int, TiffPage] = dict()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.cleanup()
+
+    def __len__(self):
+        return len(self._ifd_offsets)
+
+    def cleanup(self):
+        self._pages.clear()
+        self._buffer = None
+
+    def _unpack(self, fmt: str, offset: int) -> Tuple:
+        return struct.unpack_from(self._byteorder + fmt, self._buffer, offset)
+
+    def _calcsize(self, fmt: str) -> int:
+        # the byte order prefix also turns off native alignment
+        return struct.calcsize(self._byteorder + fmt)
+
+    def _read_header(self) -> Tuple[str, bool, int]:
+        byteorder = bytes(self._buffer[:2])
+        if byteorder == b'II':
+            byteorder = '<'
+        elif byteorder == b'MM':
+            byteorder = '>'
+        else:
+            raise ValueError('{} is not a TIFF file.'.format(self.filename))
+
+        version, = struct.unpack_from(byteorder + 'H', self._buffer, 2)
+        if version == 42:
+            first, = struct.unpack_from(byteorder + 'I', self._buffer, 4)
+            return byteorder, False, first
+        elif version == 43:
+            first, = struct.unpack_from(byteorder + 'Q', self._buffer, 8)
+            return byteorder, True, first
+        else:
+            raise ValueError('{} is not a TIFF file.'.format(self.filename))
+
+    def _index_pages(self, offset: int) -> np.ndarray:
+        """
+        Follows the chain of IFDs, recording where each one starts but
+        skipping over its contents.
+        """
+        if self._bigtiff:
+            count_fmt, entry_size, next_fmt = 'Q', 20, 'Q'
+        else:
+            count_fmt, entry_size, next_fmt = 'H', 12, 'I'
+        count_size = self._calcsize(count_fmt)
+
+        offsets = []
+        visited = set()
+        while offset and offset not in visited:
+            visited.add(offset)
+            offsets.append(offset)
+            count, = self._unpack(count_fmt, offset)
+            offset, = self._unpack(
+                next_fmt, offset + count_size + count * entry_size)
+        return np.array(offsets, dtype=np.int64)
+
+    def _read_tags(self, offset: int) -> Dict[int, Tuple]:
+        if self._bigtiff:
+            count_fmt, entry_fmt, inline = 'Q', 'HHQ', 8
+        else:
+            count_fmt, entry_fmt, inline = 'H', 'HHI', 4
+        count, = self._unpack(count_fmt, offset)
+        offset += self._calcsize(count_fmt)
+        entry_size = self._calcsize(entry_fmt) + inline
+
+        tags = dict()
+        for i in range(count):
+            entry = offset + i * entry_size
+            tag, typ, n = self._unpack(entry_fmt, entry)
+            if typ not in FIELD_TYPES:
+                continue
+            if typ in RATIONAL_TYPES:
+                n *= 2
+            fmt = '{}{}'.format(n, FIELD_TYPES[typ])
+            value_offset = entry + self._calcsize(entry_fmt)
+            if self._calcsize(fmt) > inline:
+                value_offset, = self._unpack(
+                    'Q' if self._bigtiff else 'I', value_offset)
+            tags[tag] = self._unpack(fmt, value_offset)
+        return tags
+
+    def _parse_page(self, index: int) -> TiffPage:
+        try:
+            return self._pages[index]
+        except KeyError:
+            pass
+
+        tags = self._read_tags(int(self._ifd_offsets[index]))
+        if TILE_WIDTH in tags:
+            raise NotImplementedError('Tiled TIFF pages are not supported.')
+        planar = tags.get(PLANAR_CONFIGURATION, (1, ))[0]
+        samples = tags.get(SAMPLES_PER_PIXEL, (1, ))[0]
+        if samples > 1 and not planar == 1:
+            raise NotImplementedError(
+                'Planar multi-sample TIFF pages are not supported.')
+
+        bits = tags.get(BITS_PER_SAMPLE, (1, ))[0]
+        kind = SAMPLE_KINDS[tags.get(SAMPLE_FORMAT, (1, ))[0]]
+        if bits % 8:
+            raise NotImplementedError(
+                '{}-bit TIFF pages are not supported.'.format(bits))
+        dtype = np.dtype('{}{}{}'.format(self._byteorder, kind, bits // 8))
+
+        shape = (tags[IMAGE_LENGTH][0], tags[IMAGE_WIDTH][0])
+        if samples > 1:
+            shape += (samples, )
+
+        compression = tags.get(COMPRESSION, (UNCOMPRESSED, ))[0]
+        if compression in DEFLATE and tags.get(PREDICTOR, (1, ))[0] != 1:
+            raise NotImplementedError(
+                'Compressed TIFF pages with a predictor are not supported.')
+
+        page = TiffPage(shape, dtype, compression,
+                        tags[STRIP_OFFSETS], tags[STRIP_BYTE_COUNTS])
+        self._pages[index] = page
+        return page
+
+    def _read_page(self, page: TiffPage) -> np.ndarray:
+        if page.compression == UNCOMPRESSED:
+            strips = [self._buffer[o:o + n]
+                      for o, n in zip(page.offsets, page.bytecounts)]
+        elif page.compression in DEFLATE:
+            strips = [np.frombuffer(zlib.decompress(self._buffer[o:o + n]),
+                                    np.uint8)
+                      for o, n in zip(page.offsets, page.bytecounts)]
+        else:
+            raise NotImplementedError(
+                'TIFF compression scheme {} is not supported.'.format(
+                    page.compression))
+
+        nbytes = int(np.prod(page.shape)) * page.dtype.itemsize
+        data = np.concatenate(strips) if len(strips) > 1 else strips[0]
+        return data[:nbytes].view(page.dtype).reshape(page.shape)
+
+    def request(self, index: int, axis: int = -1) -> np.ndarray:
+        """
+        Returns page 'index' of the TIFF file. Negative indices count from
+        the last page. See the class docstring for the layout of the
+        returned array.
+        """
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError('Index out of range.')
+        return self._frame(index, cached=True)
+
+    @property
+    def axis(self) -> int:
+        """
+        Axis along which pages are stacked into blocks; see read_block.
+        """
+        return 0
+
+    def frame_blocks(self, maxbytes: int) -> List[Tuple[int, int]]:
+        """
+        Splits the pages into blocks, (start, stop), for reading with
+        read_block. Each block is at most 'maxbytes' large, assuming that
+        every page is the size of the first, unless a single page is larger.
+        """
+        n = len(self)
+        if not n:
+            return []
+        page = self._parse_page(0)
+        frame_nbytes = int(np.prod(page.shape[:2])) * page.dtype.itemsize
+        length = max(maxbytes // max(frame_nbytes, 1), 1)
+        return [(b, min(b + length, n)) for b in range(0, n, length)]
+
+    def read_block(self, start: int, stop: int) -> np.ndarray:
+        """
+        Returns pages 'start' to 'stop' concatenated along self.axis.
+        Compressed pages that aren't cached already are read without being
+        cached, so reading every page doesn't evict the frames being shown.
+        """
+        return np.concatenate([self._frame(i, cached=False)
+                               for i in range(start, stop)], axis=0)
+
+    def _frame(self, index: int, cached: bool) -> np.ndarray:
+        page = self._parse_page(index)
+        if page.compression == UNCOMPRESSED and page.contiguous:
+            start = page.offsets[0]
+            nbytes = int(np.prod(page.shape)) * page.dtype.itemsize
+            data = self._buffer[start:start + nbytes]
+            arr = data.view(page.dtype).reshape(page.shape)
+            return self._select_sample(arr).swapaxes(0, 1)[None]
+
+        key = (self.filename, index)
+        arr = self.cache.get(key)
+        if arr is None:
+            arr = self._read_page(page)
+            if cached:
+                arr = self.cache.put(key, arr)
+        return self._select_sample(arr).swapaxes(0, 1)[None]
+
+    def _select_sample(self, arr: np.ndarray) -> np.ndarray:
+        if arr.ndim == 2:
+            return arr
+        if not -arr.shape[-1] <= self.sample < arr.shape[-1]:
+            raise IndexError('Sample {} out of range for pages with {} '
+                             'samples per pixel.'.format(self.sample,
+                                                         arr.shape[-1]))
+        return arr[..., self.sample]
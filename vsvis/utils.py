@@ -19,21 +19,39 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 import h5py
+import hashlib
+import os
+import pickle
+import re
 import sys
 import traceback
 from anytree import Node
 from abc import abstractmethod
+from collections import defaultdict
+from typing import (
+    Callable, Dict, Iterable, List, Optional, Sequence, Tuple)
 from vladutils.data_structures import EnumDict
 
+from .config import CACHE_DIR, SWMR_READ
+from .registry import file_registry
 from .widgets import VErrorMessageBox
 
 
-def load_node_from_hdf5(filename: str, *args, **kwargs) -> Node:
+def load_node_from_hdf5(filename: str, *args,
+                        cache_dir: Optional[str] = CACHE_DIR,
+                        progress: Optional[Callable] = None,
+                        **kwargs) -> Node:
     """
     Load the contents of an HDF5 file into an anytree.Node object. The result
     is a graph whose root is a Node('root') and the leaves are Datasets.
     Dataset attributes that we want to load store may be passed into *args.
 
+    Scanning a large file is slow, so the scanned structure is saved to a
+    sidecar file in 'cache_dir'. It's reused as long as the HDF5 file's size
+    and modification time haven't changed, and the same attributes are
+    requested. The functions in 'kwargs' are therefore assumed to depend
+    only on the Dataset passed to them.
+
     Parameters
     ------------
     filename : str
@@ -41,56 +59,120 @@ def load_node_from_hdf5(filename: str, *args, **kwargs) -> Node:
 
     args : str
         Attributes of Dataset objects to store in each leaf node.
-    """
-    with h5py.File(filename, 'r') as h5file:
-        root = _recursively_load_as_node(h5file, '/', Node('root'), *args, **kwargs)
 
-    while root.parent is not None:
-        root = root.parent
+    cache_dir : Optional[str]
+        Directory of the sidecar files. If None, the file is always scanned.
+
+    progress : Optional[Callable]
+        Called with the number of items scanned so far and 0 (the total
+        isn't known in advance) while the file is being scanned.
+
+    kwargs : Callable
+        Functions that take a Dataset; their results are stored in each
+        leaf node under the keyword's name.
+    """
+    if cache_dir is None:
+        records = _scan_hdf5(filename, args, kwargs, progress)
+    else:
+        stat = os.stat(filename)
+        key = (os.path.abspath(filename), stat.st_size, stat.st_mtime_ns,
+               tuple(args), tuple(sorted(kwargs)))
+        records = _read_structure_cache(cache_dir, key)
+        if records is None:
+            records = _scan_hdf5(filename, args, kwargs, progress)
+            _write_structure_cache(cache_dir, key, records)
+
+    return _build_node(records)
+
+
+def _scan_hdf5(filename: str, args: Sequence[str],
+               kwargs: Dict[str, Callable],
+               progress: Optional[Callable] = None
+               ) -> List[Tuple[str, bool, Dict]]:
+    """
+    Returns a (path, is_group, attributes) record for every Group and Dataset
+    in the file, parents before their children.
+    """
+    records = []
+
+    def visit(grp, path):
+        for key, item in grp.items():
+            if isinstance(item, h5py.Dataset):
+                attributes = {k: fn(item) for k, fn in kwargs.items()}
+                attributes.update({arg: getattr(item, arg) for arg in args})
+                records.append((path + key, False, attributes))
+            elif isinstance(item, h5py.Group):
+                records.append((path + key, True, dict()))
+                visit(item, path + key + '/')
+            if progress is not None:
+                progress(len(records), 0)
+
+    with file_registry.open(filename, SWMR_READ) as h5file:
+        visit(h5file, '/')
+    return records
+
+
+def _build_node(records: Iterable[Tuple[str, bool, Dict]]) -> Node:
+    root = Node('root')
+    groups = {'': root}
+    rows = defaultdict(int)
+    for path, is_group, attributes in records:
+        parent_path, _, key = path.rpartition('/')
+        _kwargs = {'name': key, 'parent': groups[parent_path],
+                   'row': rows[parent_path]}
+        rows[parent_path] += 1
+        if is_group:
+            groups[path] = Node(**_kwargs)
+        else:
+            _kwargs.update(attributes)
+            Node(**_kwargs)
     return root
 
 
-def _recursively_load_as_node(grp, path, node, *args, **kwargs):
+def _structure_cache_filename(cache_dir: str, filename: str) -> str:
+    digest = hashlib.sha1(filename.encode('utf-8')).hexdigest()
+    return os.path.join(cache_dir, digest + '.structure.pickle')
+
+
+def _read_structure_cache(cache_dir: str, key: Tuple) -> Optional[List]:
+    try:
+        with open(_structure_cache_filename(cache_dir, key[0]), 'rb') as f:
+            cached_key, records = pickle.load(f)
+    except Exception:
+        # besides I/O errors, a stale or corrupt pickle can raise nearly
+        # anything, e.g. AttributeError if a class it refers to was renamed
+        return None
+    if cached_key == key:
+        return records
+    return None
+
+
+def _write_structure_cache(cache_dir: str, key: Tuple, records: List):
+    """
+    Saves the scanned file structure. Failing to do so isn't an error; the
+    file will just be scanned again next time.
+    """
+    cache_filename = _structure_cache_filename(cache_dir, key[0])
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        # write to a temporary file first so that readers never see a
+        # partially written cache
+        temp_filename = cache_filename + '.tmp'
+        with open(temp_filename, 'wb') as f:
+            pickle.dump((key, records), f, pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_filename, cache_filename)
+    except (OSError, pickle.PicklingError):
+        pass
+
+
+def natural_sort_key(text: str) -> Tuple:
     """
+    Key for sorting strings with the numbers in them compared by value, so
+    that e.g. 'block_2.h5' comes before 'block_10.h5'.
     """
-    def nodepath(node):
-        """
-        >>> root = Node('root')
-        >>> group1 = Node('group1', parent=root)
-        >>> group2 = Node('group2', parent=group1)
-        >>> dataset1 = Node('dataset1', parent=group2)
-        >>> str(dataset1)
-        "Node('/root/group1/group2/dataset1')"
-        >>> nodepath(dataset1)
-        '/group1/group2/dataset1/'
-        """
-        return str(node).split("'")[1][5:] + '/'
-
-    row = 0
-    for key, item in grp[path].items():
-        if isinstance(item, h5py.Dataset):
-            _kwargs = {'name': key, 'parent': node, 'row': row}
-            _kwargs.update({k: fn(item) for k, fn in kwargs.items()})
-            _kwargs.update({arg: getattr(item, arg) for arg in args})
-            child = Node(**_kwargs)
-            # child.directory = nodepath(child)
-            row += 1
-
-        elif isinstance(item, h5py.Group):
-            # backtrack to common branchpoint
-            while node.parent is not None:
-                # print(nodepath(node))
-                # print(path)
-                if nodepath(node) == path:
-                    break
-                else:
-                    node = node.parent
-
-            child = Node(name=key, parent=node, row=row)
-            node = _recursively_load_as_node(
-                grp, path + key + '/', child, *args, **kwargs)
-            row += 1
-    return node
+    parts = re.split(r'(\d+)', text)
+    return tuple((0, int(p), p) if p.isdigit() else (1, 0, p)
+                 for p in parts)
 
 
 def gui_error(message: str):
@@ -21,20 +21,22 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import numpy as np
 import pandas as pd
 from qtpy.QtWidgets import (
-    QAbstractItemView, QAbstractItemView, QColorDialog, QGraphicsView,
-    QGroupBox, QMessageBox, QSizePolicy, QScrollBar, QSlider, QTabWidget,
-    QTableView, QVBoxLayout, QWidget)
+    QAbstractItemView, QAbstractItemView, QApplication, QColorDialog,
+    QGraphicsView, QGroupBox, QHBoxLayout, QLabel, QMessageBox, QSizePolicy,
+    QScrollBar, QSlider, QTabWidget, QTableView, QVBoxLayout, QWidget)
 from qtpy.QtCore import (
-    Property, QItemSelectionModel, QObject, QRect, Qt, Signal, Slot)
+    Property, QItemSelectionModel, QObject, QPointF, QRect, Qt, Signal, Slot)
 from qtpy.QtGui import QColor, QIcon, QPalette
 from functools import partialmethod
-from typing import Optional, Union
+from typing import Optional, Tuple, Union
 from vladutils.data_structures import EnumDict
 from collections import deque, OrderedDict
 from typing import Sequence, List
 from os.path import join
 
-from .config import UI_DIR, DATATYPES, DataType, loadUiType, Shape
+from .config import (
+    UI_DIR, DATATYPES, DataType, Dimension, loadUiType, Shape,
+    MARKER_PICK_TOLERANCE, PYRAMID_MAX_LEVEL)
 from .models.table import DataFrameModel
 from .models.marker import Marker, MarkerFactory
 
@@ -42,11 +44,65 @@ from .models.marker import Marker, MarkerFactory
 class VGraphicsView(QGraphicsView):
     """
     Zoomable GraphicsView.
+
+    While zoomed out, level_changed is emitted with the level of the image
+    pyramid that matches the zoom, i.e. the number of times the image can be
+    halved in size before one of its pixels is smaller than a screen pixel.
+
+    A left click, i.e. a press and release without dragging in between,
+    emits clicked with its position in the scene and MARKER_PICK_TOLERANCE
+    screen pixels in scene units, e.g. for picking markers.
     """
     # minimum image view size
     minimum_size = (256, 256)
     # sensitivity to zoom
     zoom_rate = 1.1
+    level_changed = Signal(int)
+    #               scene position, tolerance
+    clicked = Signal(QPointF, float)
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._level = 0
+        self._press_pos = None
+
+    @property
+    def level(self) -> int:
+        return self._level
+
+    def _update_level(self):
+        transform = self.transform()
+        scale = min(abs(transform.m11()), abs(transform.m22()))
+        if scale <= 0 or scale >= 1:
+            level = 0
+        else:
+            # small tolerance, so that a scale of exactly 0.5 is level 1
+            level = int(np.floor(-np.log2(scale) + 1e-6))
+        level = min(level, PYRAMID_MAX_LEVEL)
+        if not level == self._level:
+            self._level = level
+            self.level_changed.emit(level)
+
+    def scale(self, sx: float, sy: float):
+        super().scale(sx, sy)
+        self._update_level()
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            self._press_pos = event.pos()
+        super().mousePressEvent(event)
+
+    def mouseReleaseEvent(self, event):
+        super().mouseReleaseEvent(event)
+        if not event.button() == Qt.LeftButton or self._press_pos is None:
+            return
+        moved = (event.pos() - self._press_pos).manhattanLength()
+        self._press_pos = None
+        if moved <= QApplication.startDragDistance():
+            transform = self.transform()
+            scale = min(abs(transform.m11()), abs(transform.m22())) or 1
+            self.clicked.emit(self.mapToScene(event.pos()),
+                              MARKER_PICK_TOLERANCE / scale)
 
     def wheelEvent(self, event):
         factor = self.zoom_rate**(event.angleDelta().y() / 120.)
@@ -63,6 +119,7 @@ class VGraphicsView(QGraphicsView):
     @Slot()
     def fit_to_window(self):
         self.fitInView(self.sceneRect(), Qt.KeepAspectRatio)
+        self._update_level()
 
 
 class VAbstractSliderMixin(object):
@@ -98,6 +155,76 @@ class VScrollBar(QScrollBar, VAbstractSliderMixin):
     pass
 
 
+class VDimensionNavigator(QWidget):
+    """
+    One scrollbar per navigation Dimension of an image stack, e.g. T, Z and
+    C, side by side. position_changed is emitted with the position along
+    every Dimension when one of them changes; like VScrollBar.value_changed,
+    not while a scrollbar is being dragged.
+    """
+    position_changed = Signal(object)
+
+    def __init__(self, parent: Optional[QWidget] = None):
+        super().__init__(parent)
+        layout = QHBoxLayout(self)
+        layout.setContentsMargins(0, 0, 0, 0)
+        self.dimensions: Sequence[Dimension] = ()
+        self._scrollbars: List[VScrollBar] = []
+        self._columns: List[QWidget] = []
+
+    def set_dimensions(self, dimensions: Sequence[Dimension],
+                       shape: Sequence[int]):
+        """
+        Shows a scrollbar for each of 'dimensions', whose lengths are
+        'shape', at position 0.
+        """
+        self.clear()
+        self.dimensions = tuple(dimensions)
+        for dimension, length in zip(dimensions, shape):
+            column = QWidget(self)
+            layout = QVBoxLayout(column)
+            layout.setContentsMargins(0, 0, 0, 0)
+            label = QLabel(dimension.name, column)
+            label.setAlignment(Qt.AlignHCenter)
+            scrollbar = VScrollBar(Qt.Vertical, column)
+            scrollbar.setRange(0, length - 1)
+            scrollbar.setToolTip(
+                self.tr('Scroll through {}').format(dimension.name))
+            scrollbar.value_changed[int].connect(self._emit_position)
+            layout.addWidget(label)
+            layout.addWidget(scrollbar)
+            self.layout().addWidget(column)
+            self._columns.append(column)
+            self._scrollbars.append(scrollbar)
+        self.setVisible(bool(self._scrollbars))
+
+    def clear(self):
+        for column in self._columns:
+            self.layout().removeWidget(column)
+            column.deleteLater()
+        self._columns = []
+        self._scrollbars = []
+        self.dimensions = ()
+        self.setVisible(False)
+
+    @Property(object)
+    def position(self) -> Tuple[int, ...]:
+        return tuple(s.value() for s in self._scrollbars)
+
+    def set_position(self, position: Sequence[int]):
+        """
+        Moves the scrollbars without emitting position_changed.
+        """
+        for scrollbar, value in zip(self._scrollbars, position):
+            scrollbar.blockSignals(True)
+            scrollbar.setValue(value)
+            scrollbar.blockSignals(False)
+
+    @Slot(int)
+    def _emit_position(self, value: int):
+        self.position_changed.emit(self.position)
+
+
 class VTabTableView(QTableView):
     selection_changed = Signal(
         'QItemSelection', 'QItemSelection', object)
@@ -219,7 +346,8 @@ class VTabWidget(QTabWidget):
         print('')
         self.model_about_to_be_reset.emit(dtype)
         cols = self._columns[dtype]
-        df = pd.DataFrame(data, columns=cols)
+        # data may be a read-only array held by a datasource's cache
+        df = pd.DataFrame(data, columns=cols, copy=True)
         model = DataFrameModel(df)
         table = self.tables[dtype]
         table.setModel(model)
@@ -238,6 +366,19 @@ class VTabWidget(QTabWidget):
             selection_model = t.selectionModel()
             selection_model.clearSelection()
 
+    def select_row(self, dtype: DataType, row: int):
+        """
+        Shows the table of 'dtype', and selects and scrolls to its 'row' in
+        place of the current selection.
+        """
+        table = self.tables[dtype]
+        self.setCurrentWidget(table.parentWidget())
+        index = table.model().index(row, 0)
+        table.selectionModel().setCurrentIndex(
+            index, QItemSelectionModel.ClearAndSelect |
+            QItemSelectionModel.Rows)
+        table.scrollTo(index)
+
     def setSelectionMode(self, mode: int):
         """
         QAbstractItemView.ExtendedSelection
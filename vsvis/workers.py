@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""
+@author: Vladimir Shteyn
+@email: vladimir.shteyn@googlemail.com
+
+Copyright Vladimir Shteyn, 2018
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+import sys
+import traceback
+from threading import Event
+from typing import Callable
+from qtpy.QtCore import QObject, QThread, Signal, Slot
+
+
+class Cancelled(Exception):
+    """
+    Raised inside a Worker's function when the Worker has been cancelled.
+    """
+    pass
+
+
+class Worker(QObject):
+    """
+    Runs a function on a QThread, reporting its progress, result and errors
+    with signals, which are received on the GUI thread.
+
+    The function must accept a 'progress' keyword argument: a callable
+    taking the number of steps done and the total number of steps (0 if
+    unknown). Calling it after the Worker has been cancelled raises
+    Cancelled, which the function may catch to clean up before re-raising.
+
+    Parameters
+    ------------
+    function : Callable
+
+    args, kwargs
+        Arguments passed to 'function'.
+    """
+    progress = Signal(int, int)
+    finished = Signal(object)
+    failed = Signal(str, str)
+    cancelled = Signal()
+    # emitted last, after any of finished, failed or cancelled
+    done = Signal()
+
+    def __init__(self, function: Callable, *args, **kwargs):
+        super().__init__()
+        self.function = function
+        self.args = args
+        self.kwargs = kwargs
+        self._cancel = Event()
+        self.thread = QThread()
+        self.moveToThread(self.thread)
+        self.thread.started.connect(self.run)
+
+    def start(self):
+        self.thread.start()
+
+    def cancel(self):
+        self._cancel.set()
+
+    def wait(self):
+        self.thread.wait()
+
+    def _report_progress(self, done: int, total: int = 0):
+        if self._cancel.is_set():
+            raise Cancelled()
+        self.progress.emit(done, total)
+
+    @Slot()
+    def run(self):
+        try:
+            result = self.function(
+                *self.args, progress=self._report_progress, **self.kwargs)
+        except Cancelled:
+            self.cancelled.emit()
+        except Exception as e:
+            typ, value, tb = sys.exc_info()
+            detailed = ''.join(traceback.format_exception(typ, value, tb))
+            self.failed.emit(str(e), detailed)
+        else:
+            self.finished.emit(result)
+        # QThread.quit is thread-safe, and unlike a queued connection it
+        # doesn't need the GUI thread's event loop, which may be in wait()
+        self.thread.quit()
+        self.done.emit()